@@ -0,0 +1,73 @@
+"""
+Decode and resize time per image format: full-resolution decode against dd.image.decode_image with target size.
+
+> python benchmarks/image_decode.py
+"""
+import io
+import timeit
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+import deepdanbooru as dd
+
+WIDTH = 299
+HEIGHT = 299
+IMAGE_SIZES = [(1000, 750), (4000, 3000)]
+IMAGE_COUNT = 10
+
+
+def encode(image, image_format):
+    stream = io.BytesIO()
+    Image.fromarray(image).save(stream, format=image_format)
+
+    return stream.getvalue()
+
+
+def create_images(width, height, image_format):
+    random_ = np.random.default_rng(0)
+    # Smooth image, since JPEG of noise is much larger than photos or illustrations.
+    image = np.linspace(0, 255, width * height * 3).reshape((height, width, 3))
+    image = (image + random_.uniform(0, 16, image.shape)).clip(0, 255).astype(np.uint8)
+
+    return [encode(image, image_format)] * IMAGE_COUNT
+
+
+def decode_full(image_raw):
+    image = tf.io.decode_image(image_raw, channels=3, expand_animations=False)
+
+    return tf.image.resize(image, size=(HEIGHT, WIDTH), method=tf.image.ResizeMethod.AREA, preserve_aspect_ratio=True)
+
+
+def decode_target(image_raw):
+    image = dd.image.decode_image(image_raw, WIDTH, HEIGHT)
+
+    return tf.image.resize(image, size=(HEIGHT, WIDTH), method=tf.image.ResizeMethod.AREA, preserve_aspect_ratio=True)
+
+
+def run(image_raws, function):
+    dataset = tf.data.Dataset.from_tensor_slices(image_raws).map(function)
+
+    def run_dataset():
+        for _ in dataset:
+            pass
+
+    run_dataset()
+    seconds = min(timeit.repeat(run_dataset, number=1, repeat=3))
+
+    return seconds / len(image_raws) * 1000.0
+
+
+if __name__ == '__main__':
+    print(f'{"":<20}{"full":>12}{"target":>12}')
+    for width, height in IMAGE_SIZES:
+        for image_format in ['JPEG', 'PNG', 'GIF', 'WEBP']:
+            image_raws = create_images(width, height, image_format)
+            name = f'{image_format} {width}x{height}'
+            if image_format == 'WEBP':
+                # Full-resolution decode_image can not decode WebP.
+                print(f'{name:<20}{"-":>12}{run(image_raws, decode_target):12.2f} ms/image', flush=True)
+            else:
+                print(f'{name:<20}{run(image_raws, decode_full):12.2f}{run(image_raws, decode_target):12.2f} ms/image',
+                      flush=True)
@@ -0,0 +1,73 @@
+"""
+Memory and time of loading and shuffling image records: dd.data.load_image_records against
+dd.data.load_image_records_compact on a synthetic database.
+
+> python benchmarks/image_records.py [post_count]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import deepdanbooru as dd
+
+TAG_COUNT = 6000
+TAGS_PER_POST = 30
+
+
+def create_database(database_path, post_count):
+    rng = np.random.default_rng(0)
+
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(
+            'CREATE TABLE posts (id INTEGER PRIMARY KEY, md5 TEXT, file_ext TEXT, tag_string TEXT, tag_count_general INTEGER)')
+        connection.executemany('INSERT INTO posts VALUES (?, ?, ?, ?, ?)', (
+            (post_id, f'{post_id:032x}', 'jpg',
+             ' '.join(f'tag_{tag}' for tag in rng.integers(0, TAG_COUNT * 2, TAGS_PER_POST)), TAGS_PER_POST)
+            for post_id in range(1, post_count + 1)))
+
+
+def measure(name, function):
+    # Time is measured without tracemalloc, which slows down allocations.
+    start = time.time()
+    function()
+    seconds = time.time() - start
+
+    tracemalloc.start()
+    result = function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<12}{seconds:8.2f} s{current / 2 ** 20:10.1f} MB retained{peak / 2 ** 20:10.1f} MB peak', flush=True)
+
+    return result
+
+
+def load_and_shuffle_tuples(database_path):
+    image_records = dd.data.load_image_records(database_path, 1)
+    random.Random(0).shuffle(image_records)
+
+    return image_records
+
+
+def load_and_shuffle_compact(database_path, tags):
+    image_records = dd.data.load_image_records_compact(database_path, 1, tags, path_layout='md5')
+    order = np.random.default_rng(0).permutation(len(image_records))
+
+    return image_records, order
+
+
+if __name__ == '__main__':
+    post_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    tags = [f'tag_{tag}' for tag in range(TAG_COUNT)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'db.sqlite')
+        create_database(database_path, post_count)
+        print(f'{post_count} posts')
+        measure('tuples', lambda: load_and_shuffle_tuples(database_path))
+        measure('compact', lambda: load_and_shuffle_compact(database_path, tags))
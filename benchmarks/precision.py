@@ -0,0 +1,63 @@
+"""
+Training and inference throughput and peak memory on CPU for each precision option.
+Each precision runs in its own process, since the dtype policy is global and peak RSS only grows.
+
+> python benchmarks/precision.py
+"""
+import resource
+import subprocess
+import sys
+import time
+
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+WIDTH = 64
+HEIGHT = 64
+TAG_COUNT = 1000
+MINIBATCH_SIZE = 8
+MINIBATCH_COUNT = 20
+PRECISIONS = ['float32', 'bfloat16']
+
+
+def run(precision):
+    policy = dd.model.set_precision(precision)
+    inputs = tf.keras.Input(shape=(HEIGHT, WIDTH, 3), dtype=tf.float32)
+    outputs = dd.model.resnet.create_resnet_custom_v1(inputs, TAG_COUNT)
+    model = tf.keras.Model(inputs=inputs, outputs=outputs)
+    optimizer = tf.optimizers.Adam(0.001)
+    used_minibatch = tf.Variable(0, dtype=tf.int64)
+    used_sample = tf.Variable(0, dtype=tf.int64)
+    train_function = dd.train.create_train_function(
+        model, optimizer, dd.model.losses.binary_crossentropy(), [tf.keras.metrics.Precision()],
+        minibatch_counter=used_minibatch, sample_counters=[used_sample])
+    predict = dd.commands.create_predict_function(model, MINIBATCH_SIZE)
+
+    x = tf.random.uniform((MINIBATCH_SIZE, HEIGHT, WIDTH, 3))
+    y = tf.cast(tf.random.uniform((MINIBATCH_SIZE, TAG_COUNT)) > 0.99, tf.float32)
+    iterator = iter(tf.data.Dataset.from_tensors((x, y)).repeat(MINIBATCH_COUNT + 1))
+
+    train_function(iterator, tf.constant(1, dtype=tf.int64))  # warm up
+    start = time.time()
+    train_function(iterator, tf.constant(MINIBATCH_COUNT, dtype=tf.int64))
+    train_seconds = time.time() - start
+
+    predict(x)  # warm up
+    start = time.time()
+    for _ in range(MINIBATCH_COUNT):
+        predict(x).numpy()
+    predict_seconds = time.time() - start
+
+    sample_count = MINIBATCH_SIZE * MINIBATCH_COUNT
+    peak_memory_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{precision + " (" + policy + ")":<28}{sample_count / train_seconds:10.1f} train samples/s'
+          f'{sample_count / predict_seconds:10.1f} predict samples/s{peak_memory_mb:10.0f} MB peak RSS', flush=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        for precision in PRECISIONS:
+            subprocess.run([sys.executable, __file__, precision], check=True)
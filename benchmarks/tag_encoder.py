@@ -0,0 +1,55 @@
+"""
+Microbenchmark of label encoding: np.isin against TagEncoder.
+
+> python benchmarks/tag_encoder.py
+"""
+import random
+import timeit
+
+import numpy as np
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+def encode_isin(tag_all_array, tag_string):
+    tag_array = np.array(tag_string.split(' '))
+
+    return np.where(np.isin(tag_all_array, tag_array), 1, 0).astype(np.float32)
+
+
+def run(tag_count, sample_count=1000, tags_per_image=30):
+    tags = [f'tag_{i}' for i in range(tag_count)]
+    random_ = random.Random(0)
+    tag_strings = [' '.join(random_.sample(tags, tags_per_image)) for _ in range(sample_count)]
+
+    tag_all_array = np.array(tags)
+    encoder = dd.data.TagEncoder(tags)
+
+    for tag_string in tag_strings[:10]:
+        assert (encode_isin(tag_all_array, tag_string) == encoder.encode(tag_string)).all()
+
+    dataset = tf.data.Dataset.from_tensor_slices(tag_strings)
+
+    def run_isin():
+        for tag_string in tag_strings:
+            encode_isin(tag_all_array, tag_string)
+
+    def run_dict():
+        for tag_string in tag_strings:
+            encoder.encode(tag_string)
+
+    def run_graph():
+        for _ in dataset.map(encoder.encode_tf, num_parallel_calls=tf.data.experimental.AUTOTUNE).batch(256):
+            pass
+
+    print(f'tags={tag_count}, samples={sample_count}')
+    for name, function in [('np.isin', run_isin), ('TagEncoder.encode', run_dict), ('TagEncoder.encode_tf', run_graph)]:
+        function()
+        seconds = min(timeit.repeat(function, number=1, repeat=3))
+        print(f'\t{name:<24}{seconds / sample_count * 1e6:10.1f} us/sample')
+
+
+if __name__ == '__main__':
+    for tag_count in [6000, 20000]:
+        run(tag_count)
@@ -0,0 +1,80 @@
+"""
+Training throughput on CPU: model.train_on_batch against dd.train.create_train_function.
+
+> python benchmarks/train_step.py [--jit]
+"""
+import sys
+import time
+
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+WIDTH = 64
+HEIGHT = 64
+TAG_COUNT = 1000
+MINIBATCH_SIZE = 8
+MINIBATCH_COUNT = 20
+
+
+def create_model():
+    inputs = tf.keras.Input(shape=(HEIGHT, WIDTH, 3), dtype=tf.float32)
+    outputs = dd.model.resnet.create_resnet_custom_v1(inputs, TAG_COUNT)
+    model = tf.keras.Model(inputs=inputs, outputs=outputs)
+    model.compile(optimizer=tf.optimizers.Adam(0.001), loss=dd.model.losses.binary_crossentropy(),
+                  metrics=[tf.keras.metrics.Precision(), tf.keras.metrics.Recall()])
+
+    return model
+
+
+def create_dataset():
+    x = tf.random.uniform((MINIBATCH_SIZE, HEIGHT, WIDTH, 3))
+    y = tf.cast(tf.random.uniform((MINIBATCH_SIZE, TAG_COUNT)) > 0.99, tf.float32)
+
+    return tf.data.Dataset.from_tensors((x, y)).repeat(MINIBATCH_COUNT + 2)
+
+
+def run_train_on_batch():
+    model = create_model()
+    iterator = iter(create_dataset())
+
+    for x, y in [next(iterator), next(iterator)]:  # warm up
+        model.train_on_batch(x, y)
+
+    start = time.time()
+    for x, y in iterator:
+        model.train_on_batch(x, y)
+
+    return time.time() - start
+
+
+def run_train_function(steps_per_execution, jit_compile):
+    model = create_model()
+    used_minibatch = tf.Variable(0, dtype=tf.int64)
+    used_sample = tf.Variable(0, dtype=tf.int64)
+    train_function = dd.train.create_train_function(
+        model, model.optimizer, dd.model.losses.binary_crossentropy(),
+        [tf.keras.metrics.Precision(), tf.keras.metrics.Recall()],
+        minibatch_counter=used_minibatch, sample_counters=[used_sample], jit_compile=jit_compile)
+    iterator = iter(create_dataset())
+    steps = tf.constant(steps_per_execution, dtype=tf.int64)
+
+    train_function(iterator, tf.constant(2, dtype=tf.int64))  # warm up
+
+    start = time.time()
+    while int(train_function(iterator, steps)[1]) > 0:
+        pass
+
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    sample_count = MINIBATCH_SIZE * MINIBATCH_COUNT
+    seconds = run_train_on_batch()
+    print(f'{"train_on_batch":<40}{sample_count / seconds:10.1f} samples/s', flush=True)
+
+    for steps_per_execution in [1, 10]:
+        for jit_compile in [False, True] if '--jit' in sys.argv else [False]:
+            seconds = run_train_function(steps_per_execution, jit_compile)
+            name = f'train_function(steps={steps_per_execution}, jit={jit_compile})'
+            print(f'{name:<40}{sample_count / seconds:10.1f} samples/s', flush=True)
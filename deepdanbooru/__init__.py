@@ -1,8 +1,16 @@
-import deepdanbooru.commands
-import deepdanbooru.data
-import deepdanbooru.extra
-import deepdanbooru.image
-import deepdanbooru.io
-import deepdanbooru.model
-import deepdanbooru.project
-import deepdanbooru.train
+import importlib
+
+# Subpackages are imported on first access (dd.data, dd.model, ...), so importing deepdanbooru or running
+# command line help does not import TensorFlow.
+SUBPACKAGES = ['commands', 'data', 'extra', 'image', 'io', 'model', 'project', 'train']
+
+
+def __getattr__(name):
+    if name in SUBPACKAGES:
+        return importlib.import_module(f'{__name__}.{name}')
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + SUBPACKAGES)
@@ -1,24 +1,34 @@
+import os
 import sys
 
 import click
 
 import deepdanbooru as dd
 
-import tensorflow as tf
+__version__ = '1.1.0'
 
-# Devices
-physical_devices = [dev.name.replace("/physical_device:", "") for dev in tf.config.list_physical_devices()]
-gpu_devices_names = [dev for dev in physical_devices if dev[:3] == 'GPU']
-cpu_devices_names = [dev for dev in physical_devices if dev[:3] == 'CPU']
-print("===== GPU Devices are: {}".format(gpu_devices_names))
-print("===== CPU Devices are: {}".format(cpu_devices_names))
 
-# Fixes CUDNN error on GPU
-gpu_devices = tf.config.experimental.list_physical_devices('GPU')
-if len(gpu_devices):
-    config = tf.config.experimental.set_memory_growth(gpu_devices[0], True)
+def initialize_tensorflow(allow_gpu=True):
+    """
+    Import TensorFlow and configure devices. This is called only by commands which use TensorFlow,
+    so other commands and help don't pay for importing it.
+    """
+    if not allow_gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
-__version__ = '1.1.0'
+    import tensorflow as tf
+
+    # Devices
+    physical_devices = [dev.name.replace("/physical_device:", "") for dev in tf.config.list_physical_devices()]
+    gpu_devices_names = [dev for dev in physical_devices if dev[:3] == 'GPU']
+    cpu_devices_names = [dev for dev in physical_devices if dev[:3] == 'CPU']
+    print("===== GPU Devices are: {}".format(gpu_devices_names))
+    print("===== CPU Devices are: {}".format(cpu_devices_names))
+
+    # Fixes CUDNN error on GPU
+    gpu_devices = tf.config.experimental.list_physical_devices('GPU')
+    if len(gpu_devices):
+        tf.config.experimental.set_memory_growth(gpu_devices[0], True)
 
 
 @click.version_option(prog_name='DeepDanbooru', version=__version__)
@@ -40,24 +50,30 @@ def create_project(project_path):
 @click.option('--limit', default=10000, help='Limit for each category tag count.')
 @click.option('--minimum-post-count', default=500, help='Minimum post count for tag.')
 @click.option('--overwrite', help='Overwrite tags if exists.', is_flag=True)
+@click.option('--jobs', default=4, help='Number of pages fetched at once.')
 @click.argument('path', type=click.Path(exists=False, resolve_path=True, file_okay=False, dir_okay=True))
-def download_tags(path, limit, minimum_post_count, overwrite):
-    dd.commands.download_tags(path, limit, minimum_post_count, overwrite)
+def download_tags(path, limit, minimum_post_count, overwrite, jobs):
+    dd.commands.download_tags(path, limit, minimum_post_count, overwrite, jobs)
 
 
 @main.command('make-training-database-metadata')
 @click.argument('data_meta_glob', nargs=1, required=True)
 @click.argument('output_path', type=click.Path(exists=False, resolve_path=True, file_okay=True, dir_okay=False), nargs=1, required=True)
-@click.option('--image_path_glob', default=None, help='glob to path of images to filter out IDs', )
+@click.option('--image_path_glob', default=None, help='glob to path of images to filter out IDs. Deprecated, use --image-folder-path instead.', )
+@click.option('--image-folder-path', default=None, type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True),
+              help='Import only posts which have image file ({image-folder-path}/*/{id}.{ext}). Image file index is saved to the output database.')
 @click.option('--start-id', default=1, help='Start id.', )
 @click.option('--end-id', default=sys.maxsize, help='End id.')
 @click.option('--use-deleted', help='Use deleted posts.', is_flag=True)
-@click.option('--chunk-size', default=5000000, help='Chunk size for internal processing.')
+@click.option('--chunk-size', default=100000, help='Number of rows inserted per transaction.')
 @click.option('--overwrite', help='Overwrite tags if exists.', is_flag=True)
 @click.option('--vacuum', help='Execute VACUUM command after making database.', is_flag=True)
-def make_training_database_metadata(data_meta_glob, output_path, image_path_glob, start_id, end_id, use_deleted, chunk_size, overwrite, vacuum):
+@click.option('--jobs', default=1, help='Number of processes parsing metadata shards.')
+@click.option('--bulk-load', help='Disable journaling and sync while building for speed. The database is unusable if the build is interrupted.', is_flag=True)
+@click.option('--incremental', help='Update existing database with new or changed posts only. Interrupted update resumes on next run.', is_flag=True)
+def make_training_database_metadata(data_meta_glob, output_path, image_path_glob, image_folder_path, start_id, end_id, use_deleted, chunk_size, overwrite, vacuum, jobs, bulk_load, incremental):
     dd.commands.make_training_database_metadata_glob(data_meta_glob, output_path, image_path_glob, start_id, end_id,
-                                       use_deleted, chunk_size, overwrite, vacuum)
+                                       use_deleted, chunk_size, overwrite, vacuum, jobs, bulk_load, incremental, image_folder_path)
 
 
 @main.command('make-training-database')
@@ -69,14 +85,36 @@ def make_training_database_metadata(data_meta_glob, output_path, image_path_glob
 @click.option('--chunk-size', default=5000000, help='Chunk size for internal processing.')
 @click.option('--overwrite', help='Overwrite tags if exists.', is_flag=True)
 @click.option('--vacuum', help='Execute VACUUM command after making database.', is_flag=True)
-def make_training_database(source_path, output_path, start_id, end_id, use_deleted, chunk_size, overwrite, vacuum):
+@click.option('--bulk-load', help='Disable journaling and sync while building for speed. The database is unusable if the build is interrupted.', is_flag=True)
+@click.option('--incremental', help='Update existing database with posts after the last imported id. Interrupted update resumes on next run.', is_flag=True)
+def make_training_database(source_path, output_path, start_id, end_id, use_deleted, chunk_size, overwrite, vacuum, bulk_load, incremental):
     dd.commands.make_training_database(source_path, output_path, start_id, end_id,
-                                       use_deleted, chunk_size, overwrite, vacuum)
+                                       use_deleted, chunk_size, overwrite, vacuum, bulk_load, incremental)
+
+
+@main.command('build-cache', help='Build training cache of pre-resized images and encoded labels as sharded TFRecords.')
+@click.argument('project_path', type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True))
+@click.option('--shard-size', default=10000, help='Image count of each shard.')
+@click.option('--image-format', type=click.Choice(['raw', 'png']), default='raw', help='Format of cached images. raw is faster to read, png is smaller.')
+@click.option('--overwrite', help='Overwrite cache if exists.', is_flag=True)
+def build_cache(project_path, shard_size, image_format, overwrite):
+    initialize_tensorflow()
+    dd.commands.build_cache(project_path, shard_size, image_format, overwrite)
+
+
+@main.command('validate-images', help='Decode all training images of the project and quarantine broken ones in the training database. Quarantined images are excluded from training.')
+@click.argument('project_path', type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True))
+@click.option('--jobs', default=16, help='Number of images decoded at once.')
+@click.option('--revalidate', help='Validate images again even if they are not changed.', is_flag=True)
+def validate_images(project_path, jobs, revalidate):
+    initialize_tensorflow()
+    dd.commands.validate_images(project_path, jobs, revalidate)
 
 
 @main.command('train-project')
 @click.argument('project_path', type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True))
 def train_project(project_path):
+    initialize_tensorflow()
     dd.commands.train_project(project_path)
 
 
@@ -84,8 +122,10 @@ def train_project(project_path):
 @click.argument('project_path', type=click.Path(exists=True, resolve_path=True, file_okay=False, dir_okay=True))
 @click.argument('target_path', type=click.Path(exists=True, resolve_path=True, file_okay=True, dir_okay=True))
 @click.option('--threshold', help='Threshold for tag estimation.', default=0.5)
-def evaluate_project(project_path, target_path, threshold):
-    dd.commands.evaluate_project(project_path, target_path, threshold)
+@click.option('--batch-size', default=32, help='Number of images evaluated at once.')
+def evaluate_project(project_path, target_path, threshold, batch_size):
+    initialize_tensorflow()
+    dd.commands.evaluate_project(project_path, target_path, threshold, batch_size)
 
 
 @main.command('grad-cam', help='Experimental feature. Calculate activation map using Grad-CAM.')
@@ -94,6 +134,7 @@ def evaluate_project(project_path, target_path, threshold):
 @click.argument('output_path', type=click.Path(resolve_path=True, file_okay=False, dir_okay=True), default='.')
 @click.option('--threshold', help='Threshold for tag estimation.', default=0.5)
 def grad_cam(project_path, target_path, output_path, threshold):
+    initialize_tensorflow()
     dd.commands.grad_cam(project_path, target_path, output_path, threshold)
 
 
@@ -110,8 +151,11 @@ def grad_cam(project_path, target_path, output_path, threshold):
 @click.option('--folder-filters', default='*.[Pp][Nn][Gg],*.[Jj][Pp][Gg],*.[Jj][Pp][Ee][Gg],*.[Gg][Ii][Ff]', help='Glob pattern for searching image files in folder. You can specify multiple patterns by separating comma. This is used when --allow-folder is enabled. Default:*.[Pp][Nn][Gg],*.[Jj][Pp][Gg],*.[Jj][Pp][Ee][Gg],*.[Gg][Ii][Ff]')
 @click.option('--verbose', default=False, is_flag=True)
 @click.option('--output-csv', type=click.Path(exists=False, resolve_path=True, file_okay=True, dir_okay=False), default=None)
-def evaluate(target_paths, project_path, model_path, tags_path, threshold, allow_gpu, compile_model, allow_folder, folder_filters, verbose, output_csv):
-    dd.commands.evaluate(target_paths, project_path, model_path, tags_path, threshold, allow_gpu, compile_model, allow_folder, folder_filters, verbose, output_csv)
+@click.option('--batch-size', default=32, help='Number of images evaluated at once.')
+@click.option('--precision', default='float32', type=click.Choice(['float32', 'bfloat16']), help='Compute precision. bfloat16 is used only when the device supports it.')
+def evaluate(target_paths, project_path, model_path, tags_path, threshold, allow_gpu, compile_model, allow_folder, folder_filters, verbose, output_csv, batch_size, precision):
+    initialize_tensorflow(allow_gpu)
+    dd.commands.evaluate(target_paths, project_path, model_path, tags_path, threshold, allow_gpu, compile_model, allow_folder, folder_filters, verbose, output_csv, batch_size, precision)
 
 
 if __name__ == '__main__':
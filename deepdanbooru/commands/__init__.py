@@ -1,7 +1,51 @@
-from .create_project import create_project
-from .download_tags import download_tags
-from .make_training_database import make_training_database, make_training_database_metadata_glob
-from .train_project import train_project
-from .evaluate_project import evaluate_project
-from .grad_cam import grad_cam
-from .evaluate import evaluate, evaluate_image
+import importlib
+import sys
+import types
+
+# Command modules are imported on first access, so commands which don't use TensorFlow start fast.
+COMMAND_MODULES = {
+    'create_project': 'create_project',
+    'download_tags': 'download_tags',
+    'make_training_database': 'make_training_database',
+    'make_training_database_metadata_glob': 'make_training_database',
+    'train_project': 'train_project',
+    'evaluate_project': 'evaluate_project',
+    'grad_cam': 'grad_cam',
+    'evaluate': 'evaluate',
+    'evaluate_image': 'evaluate',
+    'evaluate_images': 'evaluate',
+    'create_predict_function': 'evaluate',
+    'build_cache': 'build_cache',
+    'validate_images': 'validate_images',
+}
+
+
+class CommandsModule(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing a command module (also by 'import deepdanbooru.commands.<module>') sets the module as attribute
+        # of this package, which must not hide the command function of the same name.
+        if isinstance(value, types.ModuleType) and COMMAND_MODULES.get(name) == name:
+            value = getattr(value, name)
+
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = CommandsModule
+
+
+def __getattr__(name):
+    if name not in COMMAND_MODULES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    module = importlib.import_module(f'.{COMMAND_MODULES[name]}', __name__)
+
+    # Other functions of the module are set too.
+    for function_name, module_name in COMMAND_MODULES.items():
+        if module_name == COMMAND_MODULES[name]:
+            globals()[function_name] = getattr(module, function_name)
+
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(list(globals()) + list(COMMAND_MODULES))
@@ -0,0 +1,94 @@
+import math
+import os
+import shutil
+
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+def build_cache(project_path, shard_size, image_format, overwrite):
+    """
+    Build training cache which contains pre-resized uint8 images and tag indices as sharded TFRecords.
+    """
+    project_context_path = os.path.join(project_path, 'project.json')
+    project_context = dd.io.deserialize_from_json(project_context_path)
+
+    width = project_context['image_width']
+    height = project_context['image_height']
+    database_path = project_context['database_path']
+    image_folder_path = project_context.get('image_folder_path')
+    minimum_tag_count = project_context['minimum_tag_count']
+    scale_range = project_context['scale_range']
+    cache_path = project_context.get('cache_path') or os.path.join(project_path, 'cache')
+    cache_path = os.path.join(project_path, cache_path)
+
+    if os.path.exists(cache_path):
+        if overwrite:
+            shutil.rmtree(cache_path)
+        else:
+            raise Exception(f'{cache_path} is already exists.')
+
+    dd.io.try_create_directory(cache_path)
+
+    print('Loading tags ... ')
+    tags = dd.project.load_tags_from_project(project_path)
+
+    print('Loading database ... ')
+    image_records = dd.data.load_image_records_compact(
+        database_path, minimum_tag_count, tags, image_folder_path)
+
+    dataset_wrapper = dd.data.DatasetWrapper(
+        image_records, tags, width, height, scale_range=scale_range, rotation_range=None, shift_range=None)
+
+    dataset = image_records.get_dataset()
+    dataset = dataset.map(
+        lambda image_path, tag_indices: (image_path,) + dataset_wrapper.map_load_image(image_path, tag_indices)[:2],
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.apply(tf.data.experimental.ignore_errors())
+    dataset = dataset.map(
+        lambda image_path, image, tag_indices: (image_path, tf.cast(tf.round(image), tf.uint8), tag_indices),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.prefetch(
+        buffer_size=tf.data.experimental.AUTOTUNE)
+
+    shard_count = max(math.ceil(len(image_records) / shard_size), 1)
+    shards = []
+    record_count = 0
+    writer = None
+
+    print(f'Building cache ... ({len(image_records)} images, {shard_count} shards)')
+
+    for image_path, image, tag_indices in dataset:
+        if record_count % shard_size == 0:
+            if writer:
+                writer.close()
+            shard = f'cache-{len(shards):05d}-of-{shard_count:05d}.tfrecord'
+            shards.append(shard)
+            writer = tf.io.TFRecordWriter(os.path.join(cache_path, shard))
+
+        writer.write(dd.data.serialize_cache_record(
+            image_path.numpy(), image, tag_indices.numpy().tolist(), image_format))
+        record_count += 1
+
+        if record_count % 10000 == 0:
+            print(f'{record_count} images are cached.')
+
+    if writer:
+        writer.close()
+
+    cache_context = {
+        'image_width': width,
+        'image_height': height,
+        'scale_range': scale_range,
+        'image_format': image_format,
+        'tag_count': len(tags),
+        'record_count': record_count,
+        'shards': shards
+    }
+    dd.io.serialize_as_json(cache_context, os.path.join(cache_path, 'cache.json'))
+
+    print(f'Total {record_count} images are cached. ({len(image_records) - record_count} images are skipped)')
+
+    if not project_context.get('cache_path'):
+        print(f'Set "cache_path" in project.json to "{os.path.relpath(cache_path, project_path)}" for using this cache.')
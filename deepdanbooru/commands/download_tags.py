@@ -1,12 +1,58 @@
+import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import deepdanbooru as dd
 
+DANBOORU_TAGS_URL = 'https://danbooru.donmai.us/tags.json'
 
-def download_category_tags(category, minimum_post_count, limit, page_size=1000, order='count'):
+
+def create_session(jobs, retries=5, backoff_factor=0.5):
+    """
+    Create session which keeps up to jobs connections and retries failed requests with exponential backoff.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def load_download_checkpoint(checkpoint_path, parameters):
+    """
+    Load {page: [(name, post_count), ...]} from checkpoint file.
+    Checkpoint made with other parameters is ignored.
+    """
+    pages = {}
+
+    if not os.path.exists(checkpoint_path):
+        return pages
+
+    with open(checkpoint_path, 'r', encoding='utf-8') as checkpoint_stream:
+        lines = [json.loads(line) for line in checkpoint_stream if line.strip()]
+
+    if not lines or lines[0] != parameters:
+        return pages
+
+    for line in lines[1:]:
+        pages[line['page']] = [tuple(tag) for tag in line['tags']]
+
+    return pages
+
+
+def download_category_tags(category, minimum_post_count, limit, page_size=1000, order='count', jobs=1,
+                           session=None, executor=None, checkpoint_path=None, request_url=DANBOORU_TAGS_URL):
+    """
+    Download tags of category. Pages are fetched by executor in windows of jobs pages.
+    Fetched pages are appended to checkpoint_path, so interrupted download is resumed from it.
+    """
     category_to_index = {
         'general': 0,
         'artist': 1,
@@ -24,48 +70,97 @@ def download_category_tags(category, minimum_post_count, limit, page_size=1000,
 
     parameters = {
         'limit': page_size,
-        'page': 1,
         'search[order]': order,
         'search[category]': category_index
     }
 
-    request_url = 'https://danbooru.donmai.us/tags.json'
+    if session is None:
+        session = create_session(jobs)
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return download_category_tags(
+                category, minimum_post_count, limit, page_size, order, jobs, session, executor, checkpoint_path,
+                request_url)
+
+    pages = load_download_checkpoint(checkpoint_path, parameters) if checkpoint_path else {}
+
+    if pages:
+        print(f'{len(pages)} pages of {category} tags are resumed from checkpoint.')
+
+    def fetch_page(page):
+        response = session.get(request_url, params={**parameters, 'page': page}, timeout=60)
+        response.raise_for_status()
+
+        return [(tag_json['name'], tag_json['post_count']) for tag_json in response.json()]
+
+    checkpoint_stream = None
+
+    if checkpoint_path:
+        checkpoint_stream = open(checkpoint_path, 'a' if pages else 'w', encoding='utf-8')
+
+        if not pages:
+            checkpoint_stream.write(json.dumps(parameters) + '\n')
 
     tags = set()
+    page = 1
+    is_full = False
+    futures = {}
 
-    while True:
-        response = requests.get(request_url, params=parameters)
-        response_json = response.json()
+    try:
+        while not is_full:
+            window = range(page, page + jobs)
+            futures = {window_page: executor.submit(fetch_page, window_page)
+                       for window_page in window if window_page not in pages}
 
-        response_tags = [tag_json['name']
-                         for tag_json in response_json if tag_json['post_count'] >= minimum_post_count]
+            # Pages are processed in order, so the result is same as sequential download.
+            for window_page in window:
+                if window_page not in pages:
+                    pages[window_page] = futures[window_page].result()
 
-        if not response_tags:
-            break
+                    if checkpoint_stream:
+                        checkpoint_stream.write(json.dumps({'page': window_page, 'tags': pages[window_page]}) + '\n')
+                        checkpoint_stream.flush()
 
-        is_full = False
+                response_tags = [name for name, post_count in pages[window_page] if post_count >= minimum_post_count]
 
-        for tag in response_tags:
-            if tag in gold_only_tags:
-                continue
+                if not response_tags:
+                    is_full = True
+                    break
+
+                for tag in response_tags:
+                    if tag in gold_only_tags:
+                        continue
 
-            tags.add(tag)
+                    tags.add(tag)
 
-            if len(tags) >= limit:
-                is_full = True
-                break
+                    if len(tags) >= limit:
+                        is_full = True
+                        break
 
-        if is_full:
-            break
-        else:
-            parameters['page'] += 1
+                if is_full:
+                    break
+
+            page += jobs
+    finally:
+        # Pages fetched after the last one needed are not waited.
+        for future in futures.values():
+            future.cancel()
+
+        if checkpoint_stream:
+            checkpoint_stream.close()
 
     return tags
 
 
-def download_tags(project_path, limit, minimum_post_count, is_overwrite):
+def download_tags(project_path, limit, minimum_post_count, is_overwrite, jobs=4, request_url=DANBOORU_TAGS_URL):
+    """
+    Download tags of categories concurrently, sharing up to jobs connections.
+    Fetched pages are kept in tags-{category}.download.jsonl until all categories are downloaded,
+    so interrupted download is resumed by running again.
+    """
     print(
-        f'Start downloading tags ... (limit:{limit}, minimum_post_count:{minimum_post_count})')
+        f'Start downloading tags ... (limit:{limit}, minimum_post_count:{minimum_post_count}, jobs:{jobs})')
 
     log = {
         'date': time.strftime("%Y/%m/%d %H:%M:%S"),
@@ -122,21 +217,34 @@ def download_tags(project_path, limit, minimum_post_count, is_overwrite):
 
     total_tags_count = 0
 
+    session = create_session(jobs)
+    checkpoint_paths = [os.path.join(project_path, f'tags-{category_definition["category"]}.download.jsonl')
+                        for category_definition in category_definitions]
+
+    print(f'{", ".join(category_definition["category"] for category_definition in category_definitions)} '
+          f'tags are downloading ...')
+
+    # Categories are downloaded by their own threads and their pages share one executor.
+    with ThreadPoolExecutor(max_workers=jobs) as page_executor, \
+            ThreadPoolExecutor(max_workers=len(category_definitions)) as category_executor:
+        category_tags = list(category_executor.map(
+            lambda category_definition, checkpoint_path: download_category_tags(
+                category_definition['category'], minimum_post_count, limit, jobs=jobs, session=session,
+                executor=page_executor, checkpoint_path=checkpoint_path, request_url=request_url),
+            category_definitions, checkpoint_paths))
+
     with open(all_tags_path, 'w') as all_tags_stream:
-        for category_definition in category_definitions:
+        for category_definition, tags in zip(category_definitions, category_tags):
             category = category_definition['category']
             category_tags_path = category_definition['path']
 
-            print(f'{category} tags are downloading ...')
-            tags = download_category_tags(category, minimum_post_count, limit)
-
             tags = dd.extra.natural_sorted(tags)
             tag_count = len(tags)
             if tag_count == 0:
                 print(f'{category} tags are not exists.')
                 continue
             else:
-                print(f'{tag_count} tags are downloaded.')
+                print(f'{tag_count} {category} tags are downloaded.')
 
             with open(category_tags_path, 'w') as category_tags_stream:
                 for tag in tags:
@@ -158,6 +266,9 @@ def download_tags(project_path, limit, minimum_post_count, is_overwrite):
 
     dd.io.serialize_as_json(categories_for_web, categories_for_web_path)
 
+    for checkpoint_path in checkpoint_paths:
+        os.remove(checkpoint_path)
+
     print(f'Total {total_tags_count} tags are downloaded.')
 
     print('All processes are complete.')
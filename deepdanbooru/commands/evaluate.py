@@ -32,7 +32,47 @@ def evaluate_image(
             yield tag, result_dict[tag]
 
 
-def evaluate(target_paths, project_path, model_path, tags_path, threshold, allow_gpu, compile_model, allow_folder, folder_filters, verbose, output_csv):
+def create_predict_function(model: Any, batch_size: int) -> Any:
+    """
+    Create compiled predict function which takes fixed size batch.
+    """
+    input_shape = (batch_size,) + tuple(model.input_shape[1:])
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=input_shape, dtype=tf.float32)])
+    def predict(x):
+        return model(x, training=False)
+
+    return predict
+
+
+def evaluate_images(
+    image_inputs: List[Union[str, six.BytesIO]], model: Any, tags: List[str], threshold: float, batch_size: int = 32
+) -> Iterable[Tuple[Union[str, six.BytesIO], List[Tuple[str, float]]]]:
+    """
+    Estimate tags of images by batch. Results are yielded in input order.
+    """
+    width = model.input_shape[2]
+    height = model.input_shape[1]
+    predict = create_predict_function(model, batch_size)
+    image_index = 0
+
+    for images in dd.data.get_dataset_for_evaluate(image_inputs, width, height, batch_size):
+        sample_count = int(images.shape[0])
+
+        if sample_count < batch_size:
+            # Pad last batch to keep input shape of compiled function.
+            images = tf.pad(images, [[0, batch_size - sample_count], [0, 0], [0, 0], [0, 0]])
+
+        y = predict(images).numpy()[:sample_count]
+
+        for i in range(sample_count):
+            result = [(tag, y[i][j]) for j, tag in enumerate(tags) if y[i][j] >= threshold]
+
+            yield image_inputs[image_index], result
+            image_index += 1
+
+
+def evaluate(target_paths, project_path, model_path, tags_path, threshold, allow_gpu, compile_model, allow_folder, folder_filters, verbose, output_csv, batch_size=32, precision='float32'):
     if not allow_gpu:
         os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
@@ -61,6 +101,11 @@ def evaluate(target_paths, project_path, model_path, tags_path, threshold, allow
             print(f'Loading model from project {project_path} ...')
         model = dd.project.load_model_from_project(project_path, compile_model=compile_model)
 
+    # Model saved in mixed precision is converted back to float32 too.
+    if verbose:
+        print(f'Converting model to {precision} ...')
+    model = dd.model.convert_model_precision(model, precision)
+
     if tags_path:
         if verbose:
             print(f'Loading tags from {tags_path} ...')
@@ -70,18 +115,20 @@ def evaluate(target_paths, project_path, model_path, tags_path, threshold, allow
             print(f'Loading tags from project {project_path} ...')
         tags = dd.project.load_tags_from_project(project_path)
 
+    results = evaluate_images(target_image_paths, model, tags, threshold, batch_size)
+
     if output_csv:
         with open(output_csv, 'w', newline='') as csvfile:
             writer = csv.writer(csvfile, delimiter='\t', quotechar='"', quoting=csv.QUOTE_ALL)
             writer.writerow(["img_path", "tag", "score"])
-            for image_path in target_image_paths:
+            for image_path, result in results:
                 print(f'Tags of {image_path}:')
-                for tag, score in evaluate_image(image_path, model, tags, threshold):
+                for tag, score in result:
                     writer.writerow([image_path, tag, score])
     else:
-        for image_path in target_image_paths:
+        for image_path, result in results:
             print(f'Tags of {image_path}:')
-            for tag, score in evaluate_image(image_path, model, tags, threshold):
+            for tag, score in result:
                 print(f'({score:05.3f}) {tag}')
 
         print()
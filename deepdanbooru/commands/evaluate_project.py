@@ -3,7 +3,7 @@ import os
 import deepdanbooru as dd
 
 
-def evaluate_project(project_path, target_path, threshold):
+def evaluate_project(project_path, target_path, threshold, batch_size=32):
     if not os.path.exists(target_path):
         raise Exception(f'Target path {target_path} is not exists.')
 
@@ -25,27 +25,9 @@ def evaluate_project(project_path, target_path, threshold):
 
     project_context, model, tags = dd.project.load_project(project_path)
 
-    width = project_context['image_width']
-    height = project_context['image_height']
-
-    for image_path in taget_image_paths:
-        image = dd.data.load_image_for_evaluate(
-            image_path, width=width, height=height)
-
-        image_shape = image.shape
-        # image = image.astype(np.float16)
-        image = image.reshape(
-            (1, image_shape[0], image_shape[1], image_shape[2]))
-        y = model.predict(image)[0]
-
-        result_dict = {}
-
-        for i, tag in enumerate(tags):
-            result_dict[tag] = y[i]
-
+    for image_path, result in dd.commands.evaluate_images(taget_image_paths, model, tags, threshold, batch_size):
         print(f'Tags of {image_path}:')
-        for tag in tags:
-            if result_dict[tag] >= threshold:
-                print(f'({result_dict[tag]:05.3f}) {tag}')
+        for tag, score in result:
+            print(f'({score:05.3f}) {tag}')
 
         print()
@@ -2,19 +2,93 @@ import os
 import sqlite3
 import sys
 import glob
+import hashlib
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
 from tqdm import tqdm
-from deepdanbooru.data.dataset import read_metadata_dict
+from deepdanbooru.data.dataset import iter_metadata
+from deepdanbooru.data.image_manifest import update_image_manifest, load_image_paths
+
+
+def begin_bulk_load(connection):
+    """
+    Disable journaling and sync during database build. The database is not crash-safe until finish_training_database is called.
+    """
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute('PRAGMA cache_size = -1048576')  # 1GB
+    connection.execute('PRAGMA mmap_size = 1073741824')
+    connection.execute('PRAGMA temp_store = MEMORY')
+
+
+def finish_training_database(connection, bulk_load):
+    """
+    Create secondary index after rows are loaded, update statistics and restore default journaling.
+    """
+    print('Creating index ...')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS posts_file_ext_tag_count_general ON posts (file_ext, tag_count_general)')
+    connection.execute('ANALYZE')
+    connection.commit()
+
+    if bulk_load:
+        connection.execute('PRAGMA journal_mode = DELETE')
+        connection.execute('PRAGMA synchronous = FULL')
+
+
+def create_sync_tables(connection):
+    """
+    Create tables which record progress of incremental updates.
+    sync_state has the max imported id and whether the image filter is used,
+    sync_shards has checksums of imported metadata shards.
+    """
+    connection.execute('CREATE TABLE IF NOT EXISTS sync_state (name TEXT NOT NULL PRIMARY KEY, value INTEGER)')
+    connection.execute('CREATE TABLE IF NOT EXISTS sync_shards (name TEXT NOT NULL PRIMARY KEY, checksum TEXT)')
+    connection.commit()
+
+
+def get_sync_max_id(connection):
+    row = connection.execute("SELECT value FROM sync_state WHERE name = 'max_id'").fetchone()
+
+    return row[0] if row else 0
+
+
+def update_sync_max_id(connection, max_id):
+    """
+    Record max imported id. This is committed with the rows of the same chunk.
+    """
+    connection.execute(
+        """INSERT OR REPLACE INTO sync_state (name, value)
+        VALUES ('max_id', MAX(?, IFNULL((SELECT value FROM sync_state WHERE name = 'max_id'), 0)))""", (int(max_id),))
+
+
+def get_file_checksum(file_path):
+    file_hash = hashlib.sha1()
+
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
 
 
 def make_training_database(source_path, output_path, start_id, end_id,
-                           use_deleted, chunk_size, overwrite, vacuum):
+                           use_deleted, chunk_size, overwrite, vacuum, bulk_load=False, incremental=False):
     '''
     Make sqlite database for training. Also add system tags.
+    If bulk_load is True, journaling and sync are disabled while building.
+    If incremental is True, existing output is updated with posts after the max imported id.
+    Each chunk is committed with its max id, so interrupted update resumes from the last chunk.
     '''
     if source_path == output_path:
         raise Exception('Source path and output path is equal.')
 
-    if os.path.exists(output_path):
+    check_incremental_options(overwrite, bulk_load, incremental)
+
+    if os.path.exists(output_path) and not incremental:
         if overwrite:
             os.remove(output_path)
         else:
@@ -27,6 +101,12 @@ def make_training_database(source_path, output_path, start_id, end_id,
     output_connection = sqlite3.connect(output_path)
     output_connection.row_factory = sqlite3.Row
     output_cursor = output_connection.cursor()
+    start_time = time.time()
+
+    if bulk_load:
+        begin_bulk_load(output_connection)
+
+    create_sync_tables(output_connection)
 
     table_name = 'posts'
     id_column_name = 'id'
@@ -40,7 +120,7 @@ def make_training_database(source_path, output_path, start_id, end_id,
 
     # Create output table
     print('Creating table ...')
-    output_cursor.execute(f"""CREATE TABLE {table_name} (
+    output_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {table_name} (
         {id_column_name} INTEGER NOT NULL PRIMARY KEY,
         {md5_column_name} TEXT,
         {extension_column_name} TEXT,
@@ -51,6 +131,10 @@ def make_training_database(source_path, output_path, start_id, end_id,
 
     current_start_id = start_id
 
+    if incremental:
+        current_start_id = max(start_id, get_sync_max_id(output_connection) + 1)
+        print(f'Updating from id {current_start_id} ...')
+
     while True:
         print(
             f'Fetching source rows ... ({current_start_id}~)')
@@ -107,31 +191,275 @@ def make_training_database(source_path, output_path, start_id, end_id,
         if insert_params:
             print('Inserting ...')
             output_cursor.executemany(
-                f"""INSERT INTO {table_name} (
+                f"""INSERT OR REPLACE INTO {table_name} (
                 {id_column_name},{md5_column_name},{extension_column_name},{tags_column_name},{tag_count_general_column_name})
                 values (?, ?, ?, ?, ?)""", insert_params)
-            output_connection.commit()
+
+        update_sync_max_id(output_connection, min(rows[-1][id_column_name], end_id))
+        output_connection.commit()
 
         current_start_id = rows[-1][id_column_name] + 1
 
         if current_start_id > end_id or len(rows) < chunk_size:
             break
 
+    finish_training_database(output_connection, bulk_load)
+
     if vacuum:
         print('Vacuum ...')
         output_cursor.execute('vacuum')
         output_connection.commit()
 
+    print(f'Building database is complete. ({time.time() - start_time:.1f}s)')
+
     source_connection.close()
     output_connection.close()
 
 
+METADATA_TABLE_NAME = 'posts'
+METADATA_COLUMN_NAMES = ['id', 'md5', 'file_ext', 'tag_string', 'tag_count_general', 'rating', 'score', 'is_deleted']
+
+
+def check_incremental_options(overwrite, bulk_load, incremental):
+    if incremental and overwrite:
+        raise Exception('Incremental update can\'t be used with overwrite.')
+
+    if incremental and bulk_load:
+        raise Exception('Incremental update can\'t be used with bulk load, which is not crash-safe.')
+
+
+def create_metadata_table(output_cursor):
+    output_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {METADATA_TABLE_NAME} (
+        id INTEGER NOT NULL PRIMARY KEY,
+        md5 TEXT,
+        file_ext TEXT,
+        tag_string TEXT,
+        tag_count_general INTEGER,
+        rating TEXT,
+        score FLOAT,
+        is_deleted BOOL
+        )""")
+
+
+def write_metadata_rows(output_connection, insert_params, deleted_ids, incremental):
+    """
+    Write converted metadata rows in one transaction and return count of changed rows.
+    Rows are sorted by id to append to primary key in order. Duplicated ids are replaced by the last row.
+    In incremental mode, existing rows are updated only if changed, deleted posts are removed
+    and max imported id is recorded in the same transaction.
+    Upsert is written as UPDATE and INSERT OR IGNORE, which don't need SQLite 3.24 or later.
+    """
+    total_changes = output_connection.total_changes
+    insert_params.sort(key=lambda insert_param: int(insert_param[0]))
+
+    if incremental:
+        value_column_names = METADATA_COLUMN_NAMES[1:]
+        output_connection.executemany(
+            f"""UPDATE {METADATA_TABLE_NAME} SET {','.join(name + ' = ?' for name in value_column_names)}
+            WHERE id = ? AND ({' OR '.join(name + ' IS NOT ?' for name in value_column_names)})""",
+            [insert_param[1:] + insert_param[:1] + insert_param[1:] for insert_param in insert_params])
+
+    output_connection.executemany(
+        f"""INSERT OR {'IGNORE' if incremental else 'REPLACE'} INTO {METADATA_TABLE_NAME} ({','.join(METADATA_COLUMN_NAMES)})
+        values ({','.join('?' * len(METADATA_COLUMN_NAMES))})""", insert_params)
+
+    if incremental:
+        output_connection.executemany(
+            f'DELETE FROM {METADATA_TABLE_NAME} WHERE id = ?', [(int(id),) for id in deleted_ids])
+
+    changed_count = output_connection.total_changes - total_changes
+
+    if incremental and insert_params:
+        update_sync_max_id(output_connection, insert_params[-1][0])
+
+    output_connection.commit()
+
+    return changed_count
+
+
+def record_shard_checksum(output_connection, metadata_file_path, checksum):
+    output_connection.execute(
+        'INSERT OR REPLACE INTO sync_shards (name, checksum) VALUES (?, ?)',
+        (os.path.basename(metadata_file_path), checksum))
+    output_connection.commit()
+
+
+def get_changed_shards(output_path, metadata_list):
+    """
+    Return {path: checksum} of metadata shards which are not imported yet or changed after last import.
+    """
+    output_connection = sqlite3.connect(output_path)
+    create_sync_tables(output_connection)
+    imported_checksums = dict(output_connection.execute('SELECT name, checksum FROM sync_shards').fetchall())
+    output_connection.close()
+
+    changed_shards = {}
+
+    for metadata_file_path in metadata_list:
+        checksum = get_file_checksum(metadata_file_path)
+
+        if imported_checksums.get(os.path.basename(metadata_file_path)) != checksum:
+            changed_shards[metadata_file_path] = checksum
+
+    return changed_shards
+
+
+def get_imported_shard_checksums(output_path, metadata_list):
+    """
+    Return {path: checksum} of metadata shards recorded as imported.
+    """
+    output_connection = sqlite3.connect(output_path)
+    imported_checksums = dict(output_connection.execute('SELECT name, checksum FROM sync_shards').fetchall())
+    output_connection.close()
+
+    return {path: imported_checksums[os.path.basename(path)] for path in metadata_list}
+
+
+def create_sync_filter_table(connection):
+    """
+    sync_filter_ids has ids which are allowed by the image filter of the last import.
+    """
+    connection.execute('CREATE TABLE IF NOT EXISTS sync_filter_ids (id INTEGER NOT NULL PRIMARY KEY)')
+    connection.commit()
+
+
+def get_added_filter_ids(output_path, id_filter_set):
+    """
+    Compare image filter with the one of the last import, and return (has_added_ids, added_id_filter_set).
+    added_id_filter_set has ids which are allowed now but were filtered out on the last import,
+    or is None if posts are not filtered now but were filtered on the last import.
+    """
+    output_connection = sqlite3.connect(output_path)
+    create_sync_tables(output_connection)
+    create_sync_filter_table(output_connection)
+    row = output_connection.execute("SELECT value FROM sync_state WHERE name = 'image_filter'").fetchone()
+    previous_id_filter_set = set(
+        str(id) for id, in output_connection.execute('SELECT id FROM sync_filter_ids')) if row and row[0] else None
+    output_connection.close()
+
+    if previous_id_filter_set is None:
+        return False, None
+
+    if id_filter_set is None:
+        return True, None
+
+    added_id_filter_set = id_filter_set - previous_id_filter_set
+
+    return bool(added_id_filter_set), added_id_filter_set
+
+
+def record_image_filter(output_path, id_filter_set):
+    """
+    Record image filter of the import, so posts of unchanged shards are imported when their images are added.
+    """
+    output_connection = sqlite3.connect(output_path)
+    create_sync_filter_table(output_connection)
+    output_connection.execute('DELETE FROM sync_filter_ids')
+
+    if id_filter_set is not None:
+        output_connection.executemany(
+            'INSERT INTO sync_filter_ids (id) VALUES (?)', ((int(id),) for id in id_filter_set if id.isdigit()))
+
+    output_connection.execute(
+        "INSERT OR REPLACE INTO sync_state (name, value) VALUES ('image_filter', ?)", (int(id_filter_set is not None),))
+    output_connection.commit()
+    output_connection.close()
+
+
+def get_image_folder_path_from_glob(image_path_glob):
+    """
+    Return image folder of image_path_glob ({image_folder_path}/*/*), or None if it has other pattern.
+    """
+    directory_glob, file_glob = os.path.split(image_path_glob)
+    image_folder_path, directory = os.path.split(directory_glob)
+
+    if directory != '*' or file_glob not in ('*', '*.*') or any(c in image_folder_path for c in '*?['):
+        return None
+
+    return image_folder_path
+
+
+def convert_metadata_row(row, start_id, end_id, id_filter_set, use_deleted):
+    """
+    Convert metadata row to insert parameters, or return None if the row is filtered out.
+    """
+    post_id = row['id']
+    is_deleted = row['is_deleted']
+
+    if int(post_id) < start_id or int(post_id) > end_id:
+        return None
+
+    if id_filter_set is not None and str(post_id) not in id_filter_set:
+        return None
+
+    if is_deleted and not use_deleted:
+        return None
+
+    md5 = row['md5']
+    extension = row['file_ext']
+    tags = row['tags']
+    general_tag_count = len(tags)
+    rating = row['rating']
+    score = row['score']
+
+    # Convert tags into a list of string with white space separated
+    tags = [t['name'] for t in tags]
+    tags = " ".join(tags)
+
+    # Add rating to tags
+    if rating == 's':
+        tags += f' rating:safe'
+    elif rating == 'q':
+        tags += f' rating:questionable'
+    elif rating == 'e':
+        tags += f' rating:explicit'
+
+    return post_id, md5, extension, tags, general_tag_count, rating, score, is_deleted
+
+
+def iter_metadata_chunks(data_meta, start_id, end_id, id_filter_set, use_deleted, chunk_size):
+    """
+    Convert metadata rows and yield (insert_params, deleted_ids, parsed_count) by chunk_size rows.
+    deleted_ids are ids of skipped deleted posts, which are removed from database in incremental mode.
+    """
+    insert_params = []
+    deleted_ids = []
+    parsed_count = 0
+
+    for row in data_meta:
+        parsed_count += 1
+        insert_param = convert_metadata_row(row, start_id, end_id, id_filter_set, use_deleted)
+
+        if insert_param is not None:
+            insert_params.append(insert_param)
+        elif row['is_deleted'] and not use_deleted:
+            deleted_ids.append(row['id'])
+
+        if len(insert_params) + len(deleted_ids) >= chunk_size:
+            yield insert_params, deleted_ids, parsed_count
+            insert_params = []
+            deleted_ids = []
+            parsed_count = 0
+
+    if parsed_count:
+        yield insert_params, deleted_ids, parsed_count
+
+
 def make_training_database_metadata(data_meta, output_path, id_filter_list, start_id, end_id,
-                                    use_deleted, chunk_size, overwrite, vacuum):
+                                    use_deleted, chunk_size, overwrite, vacuum, bulk_load=False, finish=True,
+                                    incremental=False):
+    """
+    Insert metadata rows into training database. data_meta can be any iterable of rows (or dict of rows),
+    which is consumed lazily and inserted by chunk_size rows per transaction.
+    If finish is False, index creation and vacuum are left to the caller which appends more rows.
+    If incremental is True, existing posts are updated if changed and deleted posts are removed.
+    """
     print("Writing data_meta into output_path: \n\t{}".format(output_path))
 
-    n_images = len(list(data_meta.keys()))
-    print("\tThere are n = {} images".format(n_images))
+    check_incremental_options(overwrite, bulk_load, incremental)
+
+    if isinstance(data_meta, dict):
+        data_meta = data_meta.values()
 
     if os.path.exists(output_path):
         if overwrite:
@@ -142,96 +470,162 @@ def make_training_database_metadata(data_meta, output_path, id_filter_list, star
 
     # Connect
     output_connection = sqlite3.connect(output_path)
-    output_connection.row_factory = sqlite3.Row
     output_cursor = output_connection.cursor()
 
-    table_name = 'posts'
-    id_column_name = 'id'
-    md5_column_name = 'md5'
-    extension_column_name = 'file_ext'
-    tags_column_name = 'tag_string'
-    tag_count_general_column_name = 'tag_count_general'
-    rating_column_name = 'rating'
-    score_column_name = 'score'
-    deleted_column_name = 'is_deleted'
+    if bulk_load:
+        begin_bulk_load(output_connection)
 
     # Create output table
     print('\tCreating table ...')
-    output_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {table_name} (
-        {id_column_name} INTEGER NOT NULL PRIMARY KEY,
-        {md5_column_name} TEXT,
-        {extension_column_name} TEXT,
-        {tags_column_name} TEXT,
-        {tag_count_general_column_name} INTEGER,
-        {rating_column_name} TEXT,
-        {score_column_name} FLOAT,
-        {deleted_column_name} BOOL
-        )""")
+    create_metadata_table(output_cursor)
+    create_sync_tables(output_connection)
     output_connection.commit()
     print('\tCreating table is complete.')
 
-    current_start_id = start_id
+    # Skip if ID not found in image path
+    id_filter_set = set(str(id) for id in id_filter_list) if id_filter_list else None
 
-    # Hold
-    insert_params = []
+    parsed_count = 0
+    inserted_count = 0
+    insert_seconds = 0.0
+    start_time = time.time()
 
-    # Skip if ID not found in image path
-    if id_filter_list:
-        print("\tFiltering metadata...")
-        id_filter_set = set(id_filter_list)
-        id_data_meta = set(data_meta.keys())
-        id_data_meta_filtered = id_data_meta.intersection(id_filter_set)
-        data_meta = {k: v for k, v in data_meta.items() if str(k) in id_data_meta_filtered}
-        n_images = len(list(data_meta.keys()))
-        print("\tFiltered metadata down to n = {}".format(n_images))
-
-    # Preview
-    print("\tParsing data meta")
-    for i, (k, row) in enumerate(tqdm(data_meta.items())):
-
-        post_id = row['id']
-        md5 = row['md5']
-        extension = row['file_ext']
-        tags = row['tags']
-        general_tag_count = len(tags)
-        rating = row['rating']
-        score = row['score']
-        is_deleted = row['is_deleted']
-
-        # Convert tags into a list of string with white space separated
-        tags = [t['name'] for t in tags]
-        tags = " ".join(tags)
-
-        if is_deleted and not use_deleted:
-            continue
+    print("\tParsing and inserting data meta")
+    for insert_params, deleted_ids, chunk_parsed_count in iter_metadata_chunks(
+            tqdm(data_meta), start_id, end_id, id_filter_set, use_deleted, chunk_size):
+        insert_start_time = time.time()
+        inserted_count += write_metadata_rows(output_connection, insert_params, deleted_ids, incremental)
+        insert_seconds += time.time() - insert_start_time
+        parsed_count += chunk_parsed_count
 
-        # Add rating to tags
-        if rating == 's':
-            tags += f' rating:safe'
-        elif rating == 'q':
-            tags += f' rating:questionable'
-        elif rating == 'e':
-            tags += f' rating:explicit'
-
-        insert_params.append(
-            (post_id, md5, extension, tags, general_tag_count, rating, score, is_deleted))
-
-    if insert_params:
-        print('\tInserting ...')
-        output_cursor.executemany(
-            f"""INSERT INTO {table_name} (
-            {id_column_name},{md5_column_name},{extension_column_name},{tags_column_name},{tag_count_general_column_name},{rating_column_name},{score_column_name},{deleted_column_name})
-            values (?, ?, ?, ?, ?, ?, ?, ?)""", insert_params)
+    parse_seconds = time.time() - start_time - insert_seconds
+    print("\tInserted or updated n = {} images".format(inserted_count))
+    print_metadata_rates(parsed_count, parse_seconds, inserted_count, insert_seconds)
+
+    if finish:
+        finish_training_database(output_connection, bulk_load)
+
+    if finish and vacuum:
+        print('\tVacuum ...')
+        output_cursor.execute('vacuum')
         output_connection.commit()
 
-    #     current_start_id = rows[-1][id_column_name] + 1
+    print("\tDone. Closing Connection.")
+    output_connection.close()
+
+
+def print_metadata_rates(parsed_count, parse_seconds, inserted_count, insert_seconds):
+    print("\tParse : {} rows, {:.0f} rows/sec per process".format(parsed_count, parsed_count / max(parse_seconds, 1e-6)))
+    print("\tInsert : {} rows, {:.0f} rows/sec".format(inserted_count, inserted_count / max(insert_seconds, 1e-6)))
+
+
+def parse_metadata_shard(metadata_file_path, queue, start_id, end_id, id_filter_set, use_deleted, chunk_size):
+    """
+    Worker of parallel ingest. Parse and filter one metadata shard, and put ('rows', insert_params, deleted_ids)
+    to queue by chunk_size rows. Finally put ('done', metadata_file_path, parsed_count, parse_seconds)
+    or ('error', message).
+    """
+    try:
+        parsed_count = 0
+        start_time = time.time()
+
+        for insert_params, deleted_ids, chunk_parsed_count in iter_metadata_chunks(
+                iter_metadata(metadata_file_path), start_id, end_id, id_filter_set, use_deleted, chunk_size):
+            queue.put(('rows', insert_params, deleted_ids))
+            parsed_count += chunk_parsed_count
+
+        queue.put(('done', metadata_file_path, parsed_count, time.time() - start_time))
+    except Exception:
+        queue.put(('error', f'{metadata_file_path}\n{traceback.format_exc()}'))
+
+
+def make_training_database_metadata_parallel(metadata_list, output_path, id_filter_list, start_id, end_id,
+                                             use_deleted, chunk_size, overwrite, vacuum, jobs, bulk_load=False,
+                                             shard_checksums=None):
+    """
+    Parse metadata shards in worker processes and insert rows from single writer (this process).
+    If shard_checksums ({path: checksum}) is given, update is incremental and checksum of each shard is
+    recorded after all of its rows are written.
+    """
+    print("Writing metadata into output_path with {} jobs: \n\t{}".format(jobs, output_path))
+
+    incremental = shard_checksums is not None
+    check_incremental_options(overwrite, bulk_load, incremental)
+
+    if os.path.exists(output_path) and overwrite:
+        os.remove(output_path)
+
+    output_connection = sqlite3.connect(output_path)
+    output_cursor = output_connection.cursor()
+
+    if bulk_load:
+        begin_bulk_load(output_connection)
+
+    create_metadata_table(output_cursor)
+    create_sync_tables(output_connection)
+    output_connection.commit()
+
+    id_filter_set = set(str(id) for id in id_filter_list) if id_filter_list else None
+
+    parsed_count = 0
+    parse_seconds = 0.0
+    inserted_count = 0
+    insert_seconds = 0.0
+    done_count = 0
+    start_time = time.time()
+
+    # Executor is exited after manager, so workers blocked on the queue fail when manager is shut down on error.
+    with ProcessPoolExecutor(jobs) as executor, multiprocessing.Manager() as manager:
+        # Bounded queue keeps memory of parsed but not inserted rows constant.
+        queue = manager.Queue(maxsize=jobs * 2)
+        futures = {executor.submit(
+            parse_metadata_shard, metadata_file_path, queue, start_id, end_id, id_filter_set, use_deleted,
+            chunk_size): metadata_file_path for metadata_file_path in metadata_list}
+
+        try:
+            with tqdm(total=len(metadata_list)) as progress:
+                while done_count < len(metadata_list):
+                    try:
+                        message = queue.get(timeout=1.0)
+                    except Empty:
+                        # Worker killed by OS (e.g. out of memory) can't send error, but breaks the executor.
+                        for future, metadata_file_path in futures.items():
+                            if future.done() and future.exception():
+                                raise Exception(
+                                    f'Parsing metadata is failed : {metadata_file_path}') from future.exception()
+                        continue
+
+                    if message[0] == 'rows':
+                        insert_start_time = time.time()
+                        inserted_count += write_metadata_rows(output_connection, message[1], message[2], incremental)
+                        insert_seconds += time.time() - insert_start_time
+                    elif message[0] == 'done':
+                        if incremental:
+                            record_shard_checksum(output_connection, message[1], shard_checksums[message[1]])
+
+                        parsed_count += message[2]
+                        parse_seconds += message[3]
+                        done_count += 1
+                        progress.update(1)
+                    else:
+                        raise Exception(f'Parsing metadata is failed : {message[1]}')
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    total_seconds = time.time() - start_time
+    print("\tInserted or updated n = {} images".format(inserted_count))
+    print_metadata_rates(parsed_count, parse_seconds, inserted_count, insert_seconds)
+    print("\tTotal : {:.0f} rows/sec".format(parsed_count / max(total_seconds, 1e-6)))
+
+    finish_training_database(output_connection, bulk_load)
 
     if vacuum:
         print('\tVacuum ...')
         output_cursor.execute('vacuum')
         output_connection.commit()
 
-    print("\tDone. Closing Connection.")
     output_connection.close()
 
 
@@ -242,18 +636,46 @@ def make_training_database_metadata_glob(
         start_id=1,
         end_id=sys.maxsize,
         use_deleted=False,
-        chunk_size=5000000,
+        chunk_size=100000,
         overwrite=True,
-        vacuum=False):
+        vacuum=False,
+        jobs=1,
+        bulk_load=False,
+        incremental=False,
+        image_folder_path=None):
     """
     Make training database from the danbooru metadata.
+    If image_folder_path is given, only posts which have image file are imported. Image files are found by
+    image manifest, which is saved to the output database and reused for training.
+    image_path_glob of {image_folder_path}/*/* is same as image_folder_path. Other patterns are globbed on each run.
+    If jobs is greater than 1, shards are parsed in jobs processes.
+    If bulk_load is True, journaling and sync are disabled while building.
+    If incremental is True, only shards which are new or changed since last import are imported (upsert),
+    and interrupted update resumes from the first shard which is not recorded as imported.
+    Posts of unchanged shards are imported too if their images are added after the last import.
     """
+    start_time = time.time()
+
+    check_incremental_options(overwrite, bulk_load, incremental)
+
+    # Remove before image manifest is written to the output.
+    if overwrite and os.path.exists(output_path):
+        os.remove(output_path)
 
     # Get Metadata files
     metadata_list = glob.glob(data_meta_glob)
     n_meta = len(metadata_list)
     print("metadata_list n = {}".format(n_meta))
 
+    if image_path_glob:
+        glob_image_folder_path = get_image_folder_path_from_glob(image_path_glob)
+
+        # Same layout as image_folder_path, which is found by image manifest instead of globbing all images.
+        if glob_image_folder_path is not None and (
+                image_folder_path is None or os.path.abspath(glob_image_folder_path) == os.path.abspath(image_folder_path)):
+            image_folder_path = glob_image_folder_path
+            image_path_glob = None
+
     # Include IDs that have matching ID in image directory
     id_filter_list = None
     if image_path_glob:
@@ -265,28 +687,89 @@ def make_training_database_metadata_glob(
             img_filename = os.path.basename(img_path)
             img_id, img_ext = os.path.splitext(img_filename)
             id_filter_list.append(img_id)
-        id_filter_list = [str(id) for id in id_filter_list]
+        id_filter_list = set(str(id) for id in id_filter_list)
+        print("Found image IDs \n\tn = {}".format(len(id_filter_list)))
+
+    if image_folder_path:
+        print("Filtering on IDs that have image file in image folder \n\t{}".format(image_folder_path))
+        update_image_manifest(output_path, image_folder_path)
+        image_ids = set(load_image_paths(output_path, image_folder_path).keys())
+        id_filter_list = id_filter_list & image_ids if id_filter_list is not None else image_ids
         print("Found image IDs \n\tn = {}".format(len(id_filter_list)))
 
-    for i, metadata_file_path in enumerate(metadata_list):
-        print("\tWorking on file [{} of {}] \n\t{}".format(i + 1, n_meta, metadata_file_path))
-
-        # Read metadatafile
-        data_meta = read_metadata_dict(metadata_file_path)
-
-        # overwrite=True - Only overwrite the first creation, else append
-        # overwrite=False - Append, but errors may happen if ID is non-unique
-        overwrite_first = i == 0 if overwrite else False
-
-        # Insert
-        make_training_database_metadata(
-            data_meta=data_meta,
-            output_path=output_path,
-            id_filter_list=id_filter_list,
-            start_id=start_id,
-            end_id=end_id,
-            use_deleted=use_deleted,
-            chunk_size=chunk_size,
-            overwrite=overwrite_first,
-            vacuum=vacuum
-        )
+    # (metadata_list, id_filter_list, shard_checksums) of each import pass
+    import_passes = [(metadata_list, id_filter_list, None)]
+
+    if incremental:
+        print("Checking changed metadata shards ...")
+        shard_checksums = get_changed_shards(output_path, metadata_list)
+        changed_list = [path for path in metadata_list if path in shard_checksums]
+        unchanged_list = [path for path in metadata_list if path not in shard_checksums]
+        print("\tSkipping n = {} unchanged shards".format(len(unchanged_list)))
+        import_passes = [(changed_list, id_filter_list, shard_checksums)]
+
+        # Posts of unchanged shards are imported again only if their images are added after the last import.
+        has_added_ids, added_id_filter_list = get_added_filter_ids(output_path, id_filter_list)
+
+        if unchanged_list and has_added_ids:
+            print("Importing posts of unchanged shards whose images are added \n\tn = {}".format(
+                len(added_id_filter_list) if added_id_filter_list is not None else 'all'))
+            import_passes.append(
+                (unchanged_list, added_id_filter_list, get_imported_shard_checksums(output_path, unchanged_list)))
+
+    import_passes = [import_pass for import_pass in import_passes if import_pass[0]]
+
+    for pass_index, (pass_metadata_list, pass_id_filter_list, pass_shard_checksums) in enumerate(import_passes):
+        is_last_pass = pass_index == len(import_passes) - 1
+        n_meta = len(pass_metadata_list)
+
+        if jobs > 1:
+            make_training_database_metadata_parallel(
+                metadata_list=pass_metadata_list,
+                output_path=output_path,
+                id_filter_list=pass_id_filter_list,
+                start_id=start_id,
+                end_id=end_id,
+                use_deleted=use_deleted,
+                chunk_size=chunk_size,
+                overwrite=False,
+                vacuum=vacuum and is_last_pass,
+                jobs=jobs,
+                bulk_load=bulk_load,
+                shard_checksums=pass_shard_checksums
+            )
+            continue
+
+        for i, metadata_file_path in enumerate(pass_metadata_list):
+            print("\tWorking on file [{} of {}] \n\t{}".format(i + 1, n_meta, metadata_file_path))
+
+            # Read metadatafile lazily
+            data_meta = iter_metadata(metadata_file_path)
+
+            # Output is already removed if overwrite=True
+            # overwrite=False - Append, but errors may happen if ID is non-unique
+            # Insert
+            make_training_database_metadata(
+                data_meta=data_meta,
+                output_path=output_path,
+                id_filter_list=pass_id_filter_list,
+                start_id=start_id,
+                end_id=end_id,
+                use_deleted=use_deleted,
+                chunk_size=chunk_size,
+                overwrite=False,
+                vacuum=vacuum,
+                bulk_load=bulk_load,
+                finish=is_last_pass and i == n_meta - 1,
+                incremental=incremental
+            )
+
+            if incremental:
+                output_connection = sqlite3.connect(output_path)
+                record_shard_checksum(output_connection, metadata_file_path, pass_shard_checksums[metadata_file_path])
+                output_connection.close()
+
+    if incremental:
+        record_image_filter(output_path, id_filter_list)
+
+    print(f'Building database is complete. ({time.time() - start_time:.1f}s)')
@@ -1,7 +1,7 @@
 import os
-import random
 import time
 import datetime
+import tempfile
 
 import tensorflow as tf
 
@@ -31,35 +31,52 @@ def train_project(project_path):
         'export_model_per_epoch'] if 'export_model_per_epoch' in project_context else 10
     checkpoint_frequency_mb = project_context['checkpoint_frequency_mb']
     console_logging_frequency_mb = project_context['console_logging_frequency_mb']
+    steps_per_execution = project_context.get('steps_per_execution', 1)
+    jit_compile = project_context.get('jit_compile', False)
+    precision = project_context.get('precision', 'float32')
+    async_checkpoint = project_context.get('async_checkpoint', True)
+    metrics_log_path = project_context.get('metrics_log_path')
+    profile_minibatch_range = project_context.get('profile_minibatch_range')
     rotation_range = project_context['rotation_range']
     scale_range = project_context['scale_range']
     shift_range = project_context['shift_range']
+    cache_path = project_context.get('cache_path')
+    distribution = project_context.get('distribution')
+    distribution_cpu_device_count = project_context.get('distribution_cpu_device_count')
+    image_cache_size = project_context.get('image_cache_size')
+    image_cache_spill_path = project_context.get('image_cache_spill_path')
 
     # Upload S3
     cloud_storage_input = dd.io.CloudStorage(s3_bucket=s3_input_bucket, s3_key_prefix=s3_input_dir)
-    cloud_storage_output = dd.io.CloudStorage(s3_bucket=s3_output_bucket, s3_key_prefix=s3_output_dir)
+    # Outputs are uploaded only if s3_output_bucket is specified.
+    cloud_storage_output = dd.io.CloudStorage(
+        s3_bucket=s3_output_bucket, s3_key_prefix=s3_output_dir) if s3_output_bucket else None
 
     # disable PNG warning
     os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
     tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
 
     # tf.keras.backend.set_epsilon(1e-4)
-    # tf.keras.mixed_precision.experimental.set_policy('infer_float32_vars')
     # tf.config.gpu.set_per_process_memory_growth(True)
 
-    if optimizer_type == 'adam':
-        optimizer = tf.optimizers.Adam(learning_rate)
-        print('Using Adam optimizer ... ')
-    elif optimizer_type == 'sgd':
-        optimizer = tf.optimizers.SGD(
-            learning_rate, momentum=0.9, nesterov=True)
-        print('Using SGD optimizer ... ')
-    elif optimizer_type == 'rmsprop':
-        optimizer = tf.optimizers.RMSprop(learning_rate)
-        print('Using RMSprop optimizer ... ')
-    else:
-        raise Exception(
-            f"Not supported optimizer : {optimizer_type}")
+    strategy = dd.train.create_distribution_strategy(distribution, distribution_cpu_device_count)
+    is_chief = dd.train.is_chief(strategy)
+    print(f'Using {strategy.num_replicas_in_sync} replicas ({distribution or "default"}) ... ')
+
+    with strategy.scope():
+        if optimizer_type == 'adam':
+            optimizer = tf.optimizers.Adam(learning_rate)
+            print('Using Adam optimizer ... ')
+        elif optimizer_type == 'sgd':
+            optimizer = tf.optimizers.SGD(
+                learning_rate, momentum=0.9, nesterov=True)
+            print('Using SGD optimizer ... ')
+        elif optimizer_type == 'rmsprop':
+            optimizer = tf.optimizers.RMSprop(learning_rate)
+            print('Using RMSprop optimizer ... ')
+        else:
+            raise Exception(
+                f"Not supported optimizer : {optimizer_type}")
 
     if model_type == 'resnet_152':
         model_delegate = dd.model.resnet.create_resnet_152
@@ -93,22 +110,47 @@ def train_project(project_path):
     output_dim = len(tags)
 
     print(f'Creating model ({model_type}) ... ')
+    precision_policy = dd.model.set_precision(precision)
+    print(f'Using {precision_policy} precision policy ... ')
     # tf.keras.backend.set_learning_phase(1)
 
-    inputs = tf.keras.Input(shape=(height, width, 3),
-                            dtype=tf.float32)  # HWC
-    ouputs = model_delegate(inputs, output_dim)
-    model = tf.keras.Model(inputs=inputs, outputs=ouputs, name=model_type)
-    print(f'Model : {model.input_shape} -> {model.output_shape}')
-
-    model.compile(optimizer=optimizer, loss=dd.model.losses.binary_crossentropy(),
-                  metrics=[tf.keras.metrics.Precision(), tf.keras.metrics.Recall()])
-
-    print(f'Loading database ... ')
-    image_records = dd.data.load_image_records_raw(
-        database_path, minimum_tag_count, image_folder_path)
+    with strategy.scope():
+        inputs = tf.keras.Input(shape=(height, width, 3),
+                                dtype=tf.float32)  # HWC
+        ouputs = model_delegate(inputs, output_dim)
+        model = tf.keras.Model(inputs=inputs, outputs=ouputs, name=model_type)
+        print(f'Model : {model.input_shape} -> {model.output_shape}')
+
+        loss_function = dd.model.losses.binary_crossentropy()
+        metric_precision = tf.keras.metrics.Precision()
+        metric_recall = tf.keras.metrics.Recall()
+        model.compile(optimizer=optimizer, loss=loss_function)
+
+    if cache_path:
+        print('Loading cache ... ')
+        cache_path = os.path.join(project_path, cache_path)
+        cache_context = dd.data.load_cache_context(cache_path)
+        if cache_context['tag_count'] != output_dim:
+            raise Exception(f'Tag count of cache ({cache_context["tag_count"]}) is not equal to project ({output_dim}).')
+        if cache_context['image_width'] != width or cache_context['image_height'] != height or cache_context['scale_range'] != scale_range:
+            raise Exception('Image size of cache is not equal to project. Rebuild cache using build-cache command.')
+        cache_shard_paths = dd.data.get_cache_shard_paths(cache_path, cache_context)
+    else:
+        # Only chief updates the database, so workers don't scan images and write to the same database at once.
+        if is_chief:
+            print('Updating database ... ')
+            dd.data.update_image_records_database(database_path, image_folder_path)
+        dd.train.synchronize_workers(strategy)
+        print('Loading database ... ')
+        image_records = dd.data.load_image_records_compact(
+            database_path, minimum_tag_count, tags, image_folder_path, update_database=False)
+
+    # Pre-resized images are kept across epochs, so images are decoded only once.
+    image_cache = dd.data.ImageCache(
+        image_cache_size, image_cache_spill_path) if image_cache_size and not cache_path else None
 
     # Checkpoint variables
+    # Counters are not mirrored, they are updated only in cross-replica context.
     used_epoch = tf.Variable(0, dtype=tf.int64)
     used_minibatch = tf.Variable(0, dtype=tf.int64)
     used_sample = tf.Variable(0, dtype=tf.int64)
@@ -125,20 +167,21 @@ def train_project(project_path):
         random_seed=random_seed)
 
     checkpoint_path = os.path.join(project_path, 'checkpoints')
+    # Every worker must save checkpoint, but only chief writes to the project.
     manager = tf.train.CheckpointManager(
         checkpoint=checkpoint,
-        directory=checkpoint_path,
+        directory=checkpoint_path if is_chief else tempfile.mkdtemp(),
         max_to_keep=3)
 
-    if manager.latest_checkpoint:
+    latest_checkpoint = tf.train.latest_checkpoint(checkpoint_path)
+    if latest_checkpoint:
         print("Checkpoint exists. Continuing training ...")
-        checkpoint.restore(manager.latest_checkpoint)
+        checkpoint.restore(latest_checkpoint)
         print(f'used_epoch={int(used_epoch)}, used_minibatch={int(used_minibatch)}, used_sample={int(used_sample)}, offset={int(offset)}, random_seed={int(random_seed)}')
     else:
         print('No checkpoint. Starting new training ...')
 
-    epoch_size = len(image_records)
-    slice_size = minibatch_size * checkpoint_frequency_mb
+    epoch_size = cache_context['record_count'] if cache_path else len(image_records)
     loss_sum = 0.0
     loss_count = 0
     used_sample_sum = 0
@@ -146,15 +189,47 @@ def train_project(project_path):
 
     # Logs for Tensorboard
     log_dir = os.path.join(project_path, 'logs')
-    summary_writer = tf.summary.create_file_writer(log_dir)
+    summary_writer = tf.summary.create_file_writer(log_dir) if is_chief else tf.summary.create_noop_writer()
+    # Time of training loop is split into waiting for input pipeline, compute, checkpoint, export and upload.
+    training_metrics = dd.train.TrainingMetrics(
+        duration_names=['data_wait', 'compute', 'checkpoint', 'export', 'upload'], summary_writer=summary_writer,
+        metrics_path=os.path.join(project_path, metrics_log_path) if is_chief and metrics_log_path else None)
+    profiler_window = dd.train.ProfilerWindow(log_dir, profile_minibatch_range if is_chief else None)
+    last_upload_seconds = 0.0
     ts_start = datetime.datetime.now()
     ts_minibatch_start = datetime.datetime.now()
 
-    while int(used_epoch) < epoch_count:
-        print(f'Shuffling samples (epoch {int(used_epoch)}) ... ')
-        epoch_random = random.Random(int(random_seed))
-        epoch_random.shuffle(image_records)
+    # Samples dropped by decoding errors are not counted for offset, so few samples can be repeated on resume.
+    train_function = dd.train.create_train_function(
+        model, optimizer, loss_function, [metric_precision, metric_recall],
+        minibatch_counter=used_minibatch, sample_counters=[used_sample, offset], jit_compile=jit_compile,
+        strategy=strategy, label_count=output_dim)
+
+    # Checkpoints and exported models are written in background while training continues.
+    checkpoint_options = dd.train.create_checkpoint_options(async_checkpoint)
+    # TensorFlow without async checkpoint has no Checkpoint.sync, and its saves are already written.
+    wait_for_checkpoint = getattr(checkpoint, 'sync', None)
+    model_exporter = dd.train.ModelExporter(model)
+
+    def upload_exported_model(export_path):
+        if cloud_storage_output:
+            cloud_storage_output.upload_file_async(
+                local_file=export_path, s3_key=os.path.relpath(export_path, project_path))
+
+    # Minibatches entered prefetch buffer of input pipeline, for tracking queue depth.
+    with tf.device('/cpu:0'):
+        produced_minibatch = tf.Variable(0, dtype=tf.int64, trainable=False)
+    local_replica_count = 1
+
+    def on_minibatch_end(previous_minibatch, current_minibatch):
+        nonlocal checkpoint_options
+
+        if current_minibatch // checkpoint_frequency_mb > previous_minibatch // checkpoint_frequency_mb:
+            print('Saving checkpoint ... ')
+            with training_metrics.measure('checkpoint'):
+                checkpoint_options = dd.train.save_checkpoint(manager, checkpoint_options)
 
+    while int(used_epoch) < epoch_count:
         # Udpate learning rate
         if learning_rates:
             for learning_rate_per_epoch in learning_rates:
@@ -164,93 +239,155 @@ def train_project(project_path):
         optimizer.learning_rate.assign(learning_rate)
         print(f'Learning rate is changed to {optimizer.learning_rate} ...')
 
-        while int(offset) < epoch_size:
-            image_records_slice = image_records[int(offset):min(
-                int(offset) + slice_size, epoch_size)]
-
-            image_paths = [image_record[0]
-                           for image_record in image_records_slice]
-            tag_strings = [image_record[1]
-                           for image_record in image_records_slice]
-
+        # Dataset is built once per epoch and resumed from offset.
+        if cache_path:
             dataset_wrapper = dd.data.DatasetWrapper(
-                (image_paths, tag_strings), tags, width, height, scale_range=scale_range, rotation_range=rotation_range, shift_range=shift_range)
-            dataset = dataset_wrapper.get_dataset(minibatch_size)
-
-            for (x_train, y_train) in dataset:
-                sample_count = x_train.shape[0]
-
-                step_result = model.train_on_batch(
-                    x_train, y_train, reset_metrics=False)
-
-                used_minibatch.assign_add(1)
-                used_sample.assign_add(sample_count)
-                used_sample_sum += sample_count
-                loss_sum += step_result[0]
-                loss_count += 1
-
-                if int(used_minibatch) % console_logging_frequency_mb == 0:
-                    # calculate logging informations
-                    current_time = time.time()
-                    delta_time = current_time - last_time
-                    step_metric_precision = step_result[1]
-                    step_metric_recall = step_result[2]
-                    if step_metric_precision + step_metric_recall > 0.0:
-                        step_metric_f1_score = 2.0 * \
-                            (step_metric_precision * step_metric_recall) / \
-                            (step_metric_precision + step_metric_recall)
-                    else:
-                        step_metric_f1_score = 0.0
-                    average_loss = loss_sum / float(loss_count)
-                    samples_per_seconds = float(
-                        used_sample_sum) / max(delta_time, 0.001)
-                    progress = float(int(used_sample)) / \
-                        float(epoch_size * epoch_count) * 100.0
-                    remain_seconds = float(
-                        epoch_size * epoch_count - int(used_sample)) / max(samples_per_seconds, 0.001)
-                    eta_datetime = datetime.datetime.now() + datetime.timedelta(seconds=remain_seconds)
-                    eta_datetime_string = eta_datetime.strftime(
-                        '%Y-%m-%d %H:%M:%S')
-                    seconds_elapsed = (datetime.datetime.now() - ts_start).total_seconds()
-                    seconds_minibatch = (datetime.datetime.now() - ts_minibatch_start).total_seconds()
-                    print(
-                        f'Epoch[{int(used_epoch)}] Loss={average_loss:.6f}, P={step_metric_precision:.6f}, R={step_metric_recall:.6f}, F1={step_metric_f1_score:.6f}, Speed = {samples_per_seconds:.1f} samples/s, {progress:.2f} %, ETA = {eta_datetime_string}')
-
-                    # Tensorboard
-                    with summary_writer.as_default():
-                        tf.summary.scalar('loss', average_loss, step=used_minibatch)
-                        tf.summary.scalar('precision', step_metric_precision, step=used_minibatch)
-                        tf.summary.scalar('recall', step_metric_recall, step=used_minibatch)
-                        tf.summary.scalar('f1_score', step_metric_f1_score, step=used_minibatch)
-                        tf.summary.scalar('seconds_elapsed', seconds_elapsed, step=used_minibatch)
-                        tf.summary.scalar('seconds_minibatch', seconds_minibatch, step=used_minibatch)
-
-                    # reset for next logging
-                    model.reset_metrics()
-                    loss_sum = 0.0
-                    loss_count = 0
-                    used_sample_sum = 0
-                    last_time = current_time
-                    ts_minibatch_start = datetime.datetime.now()
-
-            offset.assign_add(slice_size)
-            print('Saving checkpoint ... ')
-            manager.save()
+                cache_shard_paths, tags, width, height, scale_range=scale_range, rotation_range=rotation_range, shift_range=shift_range, seed=int(random_seed),
+                batch_counter=produced_minibatch)
+            dataset_function = dataset_wrapper.get_cached_dataset
+        else:
+            # Samples are shuffled by random_seed of each epoch in DatasetWrapper.
+            dataset_wrapper = dd.data.DatasetWrapper(
+                image_records, tags, width, height, scale_range=scale_range, rotation_range=rotation_range, shift_range=shift_range, seed=int(random_seed),
+                batch_counter=produced_minibatch, image_cache=image_cache)
+            dataset_function = dataset_wrapper.get_dataset
+
+        # Each worker reads its own shard of the inputs.
+        epoch_offset = int(offset)
+
+        def create_dataset(input_context):
+            nonlocal local_replica_count
+            # Each step consumes one minibatch per replica of this worker.
+            local_replica_count = input_context.num_replicas_in_sync // input_context.num_input_pipelines
+
+            return dataset_function(
+                input_context.get_per_replica_batch_size(minibatch_size), skip_count=epoch_offset,
+                shard_count=input_context.num_input_pipelines, shard_index=input_context.input_pipeline_id)
+
+        dataset = strategy.distribute_datasets_from_function(create_dataset)
+        produced_minibatch.assign(0)
+        epoch_step_count = 0
+
+        iterator = iter(dataset)
+
+        while True:
+            profiler_window.update(int(used_minibatch))
+
+            # Run multiple minibatches in one call for reducing Python overhead.
+            call_start = time.perf_counter()
+            step_loss_sum, step_count, sample_count, data_wait_seconds = train_function(
+                iterator, tf.constant(steps_per_execution, dtype=tf.int64))
+            step_count = int(step_count)
+            call_seconds = time.perf_counter() - call_start
+
+            data_wait_seconds = float(data_wait_seconds)
+            training_metrics.add_duration('data_wait', data_wait_seconds)
+            training_metrics.add_duration('compute', max(call_seconds - data_wait_seconds, 0.0))
+
+            if step_count == 0:
+                break
+
+            epoch_step_count += step_count
+            training_metrics.add_gauge(
+                'input_queue_depth', int(produced_minibatch) - epoch_step_count * local_replica_count)
+
+            used_sample_sum += int(sample_count)
+            loss_sum += float(step_loss_sum)
+            loss_count += step_count
+            current_minibatch = int(used_minibatch)
+            previous_minibatch = current_minibatch - step_count
+
+            if current_minibatch // console_logging_frequency_mb > previous_minibatch // console_logging_frequency_mb:
+                # calculate logging informations
+                current_time = time.time()
+                delta_time = current_time - last_time
+                step_metric_precision = float(metric_precision.result())
+                step_metric_recall = float(metric_recall.result())
+                if step_metric_precision + step_metric_recall > 0.0:
+                    step_metric_f1_score = 2.0 * \
+                        (step_metric_precision * step_metric_recall) / \
+                        (step_metric_precision + step_metric_recall)
+                else:
+                    step_metric_f1_score = 0.0
+                average_loss = loss_sum / float(loss_count)
+                samples_per_seconds = float(
+                    used_sample_sum) / max(delta_time, 0.001)
+                progress = float(int(used_sample)) / \
+                    float(epoch_size * epoch_count) * 100.0
+                remain_seconds = float(
+                    epoch_size * epoch_count - int(used_sample)) / max(samples_per_seconds, 0.001)
+                eta_datetime = datetime.datetime.now() + datetime.timedelta(seconds=remain_seconds)
+                eta_datetime_string = eta_datetime.strftime(
+                    '%Y-%m-%d %H:%M:%S')
+                seconds_elapsed = (datetime.datetime.now() - ts_start).total_seconds()
+                seconds_minibatch = (datetime.datetime.now() - ts_minibatch_start).total_seconds()
+                seconds_data_wait = training_metrics.get_duration('data_wait')
+                data_wait_ratio = seconds_data_wait / max(
+                    seconds_data_wait + training_metrics.get_duration('compute'), 0.001)
+                if cloud_storage_output:
+                    training_metrics.add_duration(
+                        'upload', cloud_storage_output.background_seconds - last_upload_seconds)
+                    last_upload_seconds = cloud_storage_output.background_seconds
+                print(
+                    f'Epoch[{int(used_epoch)}] Loss={average_loss:.6f}, P={step_metric_precision:.6f}, R={step_metric_recall:.6f}, F1={step_metric_f1_score:.6f}, '
+                    f'Speed = {samples_per_seconds:.1f} samples/s, Data wait = {data_wait_ratio * 100.0:.1f} %, {progress:.2f} %, ETA = {eta_datetime_string}')
+
+                # Tensorboard and metrics log
+                training_metrics.write(
+                    used_minibatch,
+                    loss=average_loss,
+                    precision=step_metric_precision,
+                    recall=step_metric_recall,
+                    f1_score=step_metric_f1_score,
+                    seconds_elapsed=seconds_elapsed,
+                    seconds_minibatch=seconds_minibatch,
+                    samples_per_second=samples_per_seconds,
+                    data_wait_ratio=data_wait_ratio)
+
+                # reset for next logging
+                metric_precision.reset_state()
+                metric_recall.reset_state()
+                loss_sum = 0.0
+                loss_count = 0
+                used_sample_sum = 0
+                last_time = current_time
+                ts_minibatch_start = datetime.datetime.now()
+
+            on_minibatch_end(previous_minibatch, current_minibatch)
 
         used_epoch.assign_add(1)
         random_seed.assign_add(1)
         offset.assign(0)
 
-        if int(used_epoch) % export_model_per_epoch == 0:
-            print('Saving model ... (per epoch {export_model_per_epoch})')
+        print('Saving checkpoint ... ')
+        with training_metrics.measure('checkpoint'):
+            checkpoint_options = dd.train.save_checkpoint(manager, checkpoint_options)
+
+        if is_chief and int(used_epoch) % export_model_per_epoch == 0:
+            print(f'Saving model ... (per epoch {export_model_per_epoch})')
             export_path = os.path.join(
                 project_path, f'model-{model_type}.h5.e{int(used_epoch)}')
-            model.save(export_path, include_optimizer=False, save_format='h5')
-            cloud_storage_output.upload_file(local_file=export_path, s3_key=os.path.relpath(export_path, project_path))
+            with training_metrics.measure('export'):
+                model_exporter.export(export_path, on_exported=upload_exported_model)
+
+        # Upload to S3 in background after checkpoint is written, only new or changed files are uploaded.
+        if is_chief and cloud_storage_output:
+            cloud_storage_output.sync_dir_async(local_dir=checkpoint_path, s3_key="", wait_for=wait_for_checkpoint)
+            cloud_storage_output.sync_dir_async(local_dir=log_dir, s3_key="")
+
+    profiler_window.stop()
+
+    # Wait for background writes before exit.
+    if wait_for_checkpoint:
+        wait_for_checkpoint()
+    model_exporter.close()
+
+    if image_cache is not None:
+        image_cache.close()
 
-        # Upload to S3
-        cloud_storage_output.upload_dir(local_dir=checkpoint_path, s3_key="")
-        cloud_storage_output.upload_dir(local_dir=log_dir, s3_key="")
+    if not is_chief:
+        print('Training is complete.')
+        return
 
     print('Saving model ...')
     model_path = os.path.join(
@@ -258,14 +395,16 @@ def train_project(project_path):
 
     # tf.keras.experimental.export_saved_model throw exception now
     # see https://github.com/tensorflow/tensorflow/issues/27112
-    model.save(model_path, include_optimizer=False)
-    cloud_storage_output.upload_file(local_file=model_path, s3_key=os.path.relpath(model_path, project_path))
+    # Saved in float32, so the model is evaluated in float32 by default even if trained in mixed precision.
+    dd.model.convert_model_precision(model, 'float32').save(model_path, include_optimizer=False)
 
     print('Training is complete.')
     print(
         f'used_epoch={int(used_epoch)}, used_minibatch={int(used_minibatch)}, used_sample={int(used_sample)}')
 
     # Upload final project
-    cloud_storage_output.upload_file(local_file=model_path, s3_key=os.path.relpath(model_path, project_path))
-    cloud_storage_output.upload_file(local_file=os.path.join(project_path, "tags.txt"), s3_key="tags.txt")
-    cloud_storage_output.upload_file(local_file=os.path.join(project_path, "project.json"), s3_key="project.json")
+    if cloud_storage_output:
+        cloud_storage_output.wait()
+        cloud_storage_output.upload_file(local_file=model_path, s3_key=os.path.relpath(model_path, project_path))
+        cloud_storage_output.upload_file(local_file=os.path.join(project_path, "tags.txt"), s3_key="tags.txt")
+        cloud_storage_output.upload_file(local_file=os.path.join(project_path, "project.json"), s3_key="project.json")
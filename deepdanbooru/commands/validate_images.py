@@ -0,0 +1,35 @@
+import os
+
+import deepdanbooru as dd
+
+
+def validate_images(project_path, jobs=16, revalidate=False):
+    """
+    Decode all images of the training database of project and quarantine broken ones, so they are excluded
+    from training and build-cache. Images which are not changed since the last validation are skipped.
+    """
+    project_context_path = os.path.join(project_path, 'project.json')
+    project_context = dd.io.deserialize_from_json(project_context_path)
+
+    width = project_context['image_width']
+    height = project_context['image_height']
+    database_path = project_context['database_path']
+    image_folder_path = project_context.get('image_folder_path')
+    minimum_tag_count = project_context['minimum_tag_count']
+    scale_range = project_context['scale_range']
+
+    print('Loading tags ... ')
+    tags = dd.project.load_tags_from_project(project_path)
+
+    print('Loading database ... ')
+    # Quarantined images are validated again if they are changed.
+    image_records = dd.data.load_image_records_compact(
+        database_path, minimum_tag_count, tags, image_folder_path, exclude_quarantined=False)
+
+    # Images are decoded in the same size as training.
+    dataset_wrapper = dd.data.DatasetWrapper(
+        image_records, tags, width, height, scale_range=scale_range, rotation_range=None, shift_range=None)
+    pre_scaled_height, pre_scaled_width = dataset_wrapper.get_pre_scaled_size()
+
+    return dd.data.validate_image_records(
+        database_path, image_records, pre_scaled_width, pre_scaled_height, jobs=jobs, revalidate=revalidate)
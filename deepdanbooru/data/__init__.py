@@ -1,29 +1,33 @@
-from typing import Any, Union
+import importlib
 
-import six
-import tensorflow as tf
+# Modules are imported on first access, so database commands don't import TensorFlow.
+MODULE_ATTRIBUTES = {
+    'dataset': ['load_image_records', 'load_image_records_raw', 'load_tags', 'read_metadata', 'read_metadata_dict',
+                'iter_metadata', 'query_db'],
+    'dataset_wrapper': ['DatasetWrapper'],
+    'tag_encoder': ['TagEncoder', 'tag_indices_to_labels'],
+    'image_manifest': ['update_image_manifest', 'load_image_manifest', 'load_image_paths'],
+    'image_records': ['ImageRecords', 'load_image_records_compact', 'update_image_records_database'],
+    'image_cache': ['ImageCache'],
+    'image_quarantine': ['validate_image', 'validate_image_records', 'load_quarantined_ids'],
+    'cache': ['CACHE_RECORD_FEATURES', 'serialize_cache_record', 'decode_cache_image', 'load_cache_context',
+              'get_cache_shard_paths'],
+    'evaluation': ['map_load_image_for_evaluate', 'get_dataset_for_evaluate', 'load_image_for_evaluate'],
+}
+ATTRIBUTE_MODULES = {attribute: module for module, attributes in MODULE_ATTRIBUTES.items() for attribute in attributes}
 
-import deepdanbooru as dd
 
-from .dataset import load_image_records, load_image_records_raw, load_tags, read_metadata, read_metadata_dict, query_db
-from .dataset_wrapper import DatasetWrapper
+def __getattr__(name):
+    if name not in ATTRIBUTE_MODULES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
+    module = importlib.import_module(f'.{ATTRIBUTE_MODULES[name]}', __name__)
 
-def load_image_for_evaluate(
-        input_: Union[str, six.BytesIO], width: int, height: int, normalize: bool = True
-) -> Any:
-    if isinstance(input_, six.BytesIO):
-        image_raw = input_.getvalue()
-    else:
-        image_raw = tf.io.read_file(input_)
-    image = tf.io.decode_png(image_raw, channels=3)
+    for attribute in MODULE_ATTRIBUTES[ATTRIBUTE_MODULES[name]]:
+        globals()[attribute] = getattr(module, attribute)
 
-    image = tf.image.resize(
-        image, size=(height, width), method=tf.image.ResizeMethod.AREA, preserve_aspect_ratio=True)
-    image = image.numpy()  # EagerTensor to np.array
-    image = dd.image.transform_and_pad_image(image, width, height)
+    return globals()[name]
 
-    if normalize:
-        image = image / 255.0
 
-    return image
+def __dir__():
+    return sorted(list(globals()) + list(ATTRIBUTE_MODULES))
@@ -0,0 +1,64 @@
+import os
+
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+CACHE_RECORD_FEATURES = {
+    'key': tf.io.FixedLenFeature([], tf.string),
+    'image': tf.io.FixedLenFeature([], tf.string),
+    'image_format': tf.io.FixedLenFeature([], tf.string),
+    'height': tf.io.FixedLenFeature([], tf.int64),
+    'width': tf.io.FixedLenFeature([], tf.int64),
+    'tag_indices': tf.io.VarLenFeature(tf.int64),
+}
+
+
+def serialize_cache_record(key, image, tag_indices, image_format='raw'):
+    """
+    Serialize pre-resized uint8 image and tag indices as tf.train.Example.
+    """
+    if image_format == 'raw':
+        image_bytes = image.numpy().tobytes()
+    elif image_format == 'png':
+        image_bytes = tf.io.encode_png(image).numpy()
+    else:
+        raise Exception(f'Not supported cache image format : {image_format}')
+
+    feature = {
+        'key': tf.train.Feature(bytes_list=tf.train.BytesList(value=[key])),
+        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image_bytes])),
+        'image_format': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image_format.encode()])),
+        'height': tf.train.Feature(int64_list=tf.train.Int64List(value=[image.shape[0]])),
+        'width': tf.train.Feature(int64_list=tf.train.Int64List(value=[image.shape[1]])),
+        'tag_indices': tf.train.Feature(int64_list=tf.train.Int64List(value=tag_indices)),
+    }
+
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def decode_cache_image(features):
+    """
+    Decode uint8 image from parsed cache record.
+    """
+    return tf.cond(
+        tf.equal(features['image_format'], 'png'),
+        lambda: tf.io.decode_png(features['image'], channels=3),
+        lambda: tf.reshape(tf.io.decode_raw(features['image'], tf.uint8),
+                           tf.stack([features['height'], features['width'], 3])))
+
+
+def load_cache_context(cache_path):
+    """
+    Load cache information file made by build-cache command.
+    """
+    cache_context_path = os.path.join(cache_path, 'cache.json')
+
+    if not os.path.exists(cache_context_path):
+        raise Exception(f'Cache is not exists : {cache_path}')
+
+    return dd.io.deserialize_from_json(cache_context_path)
+
+
+def get_cache_shard_paths(cache_path, cache_context):
+    return [os.path.join(cache_path, shard) for shard in cache_context['shards']]
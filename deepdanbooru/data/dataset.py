@@ -1,9 +1,9 @@
 import os
 import sqlite3
-import glob
-import pandas as pd
 import json
 
+from .image_manifest import update_image_manifest, load_image_paths
+
 
 def load_tags(tags_path):
     with open(tags_path, 'r') as tags_stream:
@@ -67,13 +67,9 @@ def load_image_records_raw(sqlite_path, minimum_tag_count, image_folder_path=Non
     if image_folder_path is None:
         image_folder_path = os.path.join(os.path.dirname(sqlite_path), 'images')
 
-    # Make Image path lookup
-    image_path_list = glob.glob(os.path.join(image_folder_path, "*/*"))
-    image_dict = dict()
-    for img_path in image_path_list:
-        img_filename = os.path.basename(img_path)
-        img_id, img_ext = os.path.splitext(img_filename)
-        image_dict[img_id] = img_path
+    # Make Image path lookup from image manifest
+    update_image_manifest(sqlite_path, image_folder_path)
+    image_dict = load_image_paths(sqlite_path, image_folder_path)
 
     cursor.execute(
         """
@@ -137,7 +133,19 @@ def read_metadata_dict(file_path, top_n=None, filter_attributes=None, filter_tag
     return data
 
 
+def iter_metadata(file_path):
+    """
+    Yield metadata rows of JSONL file one by one without loading whole file.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
 def query_db(sqlite_path, query):
+    import pandas as pd
+
     output_connection = sqlite3.connect(sqlite_path)
 
     df = pd.read_sql_query(query, output_connection)
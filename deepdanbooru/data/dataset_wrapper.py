@@ -1,5 +1,3 @@
-import random
-
 import numpy as np
 import tensorflow as tf
 
@@ -9,25 +7,45 @@ import deepdanbooru as dd
 class DatasetWrapper:
     """
     Wrapper class for data pipelining/augmentation.
+    inputs is ImageRecords whose tags are in the same tag space with tags, or list of cache shard paths
+    for get_cached_dataset().
+    Minibatches are (images, tag_indices), where tag_indices is [batch, max tag count] padded by -1. It is converted
+    to multi-hot labels by dd.data.tag_indices_to_labels on device, so labels don't go through prefetch buffers.
+    If batch_counter (int64 variable on CPU) is given, it is incremented when minibatch enters prefetch buffer,
+    so input queue depth can be tracked by comparing it with consumed minibatches.
+    If image_cache (dd.data.ImageCache) is given for image records, pre-resized images are cached before augmentation
+    and reused by datasets of later epochs.
     """
 
-    def __init__(self, inputs, tags, width, height, scale_range, rotation_range, shift_range):
+    def __init__(self, inputs, tags, width, height, scale_range, rotation_range, shift_range, seed=0,
+                 batch_counter=None, image_cache=None):
         self.inputs = inputs
         self.width = width
         self.height = height
         self.scale_range = scale_range
         self.rotation_range = rotation_range
         self.shift_range = shift_range
-        self.tag_all_array = np.array(tags)
-
-    def get_dataset(self, minibatch_size):
-        dataset = tf.data.Dataset.from_tensor_slices(self.inputs)
+        self.seed = seed
+        self.batch_counter = batch_counter
+        self.image_cache = image_cache
+        self.tags = tags
+
+    def get_dataset(self, minibatch_size, skip_count=0, shard_count=1, shard_index=0, shuffle=True):
+        """
+        Create dataset from image records. Records are shuffled by the seed, so skip_count can be used for resuming.
+        """
+        order = np.random.default_rng(self.seed).permutation(len(self.inputs)) if shuffle else None
+        dataset = self.inputs.get_dataset(order)
+        dataset = dataset.skip(skip_count)
+        dataset = dataset.shard(shard_count, shard_index)
         dataset = dataset.map(
             self.map_load_image, num_parallel_calls=tf.data.experimental.AUTOTUNE)
         dataset = dataset.apply(tf.data.experimental.ignore_errors())
         dataset = dataset.map(
             self.map_transform_image_and_label, num_parallel_calls=tf.data.experimental.AUTOTUNE)
-        dataset = dataset.batch(minibatch_size)
+        dataset = self.batch(dataset, minibatch_size)
+        if self.batch_counter is not None:
+            dataset = dataset.map(self.map_count_batch)
         dataset = dataset.prefetch(
             buffer_size=tf.data.experimental.AUTOTUNE)
         # dataset = dataset.apply(
@@ -35,64 +53,113 @@ class DatasetWrapper:
 
         return dataset
 
-    def map_load_image(self, image_path, tag_string):
-        image_raw = tf.io.read_file(image_path)
-        image = tf.io.decode_png(image_raw, channels=3)
+    def get_cached_dataset(self, minibatch_size, skip_count=0, shard_count=1, shard_index=0, shuffle_buffer_size=10000):
+        """
+        Create dataset from cache shards made by build-cache command. Shards are read in parallel.
+        Shuffling is deterministic for the seed, so skip_count can be used for resuming.
+        """
+        dataset = tf.data.Dataset.from_tensor_slices(self.inputs)
+        dataset = dataset.shuffle(len(self.inputs), seed=self.seed)
+        dataset = dataset.interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=min(len(self.inputs), 16),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            deterministic=True)
+        dataset = dataset.shuffle(shuffle_buffer_size, seed=self.seed)
+        dataset = dataset.skip(skip_count)
+        dataset = dataset.shard(shard_count, shard_index)
+        dataset = dataset.map(
+            self.map_parse_cache_record, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        dataset = dataset.map(
+            self.map_transform_image_and_label, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        dataset = self.batch(dataset, minibatch_size)
+        if self.batch_counter is not None:
+            dataset = dataset.map(self.map_count_batch)
+        dataset = dataset.prefetch(
+            buffer_size=tf.data.experimental.AUTOTUNE)
+
+        return dataset
+
+    def batch(self, dataset, minibatch_size):
+        return dataset.padded_batch(
+            minibatch_size, padded_shapes=((self.height, self.width, 3), (None,)),
+            padding_values=(0.0, tf.constant(-1, dtype=tf.int32)))
 
+    def get_pre_scaled_size(self):
         if self.scale_range:
             pre_scale = self.scale_range[1]
         else:
             pre_scale = 1.0
 
-        size = (int(self.height * pre_scale), int(self.width * pre_scale))
+        return (int(self.height * pre_scale), int(self.width * pre_scale))
+
+    def get_sample_seed(self, key):
+        # Random seed of each sample is derived from its key, so augmentation is reproducible per epoch.
+        return tf.stack([
+            tf.constant(self.seed, dtype=tf.int64),
+            tf.strings.to_hash_bucket_fast(key, np.iinfo(np.int64).max)])
 
-        image = tf.image.resize(
-            image, size=size, method=tf.image.ResizeMethod.AREA, preserve_aspect_ratio=True)
+    def load_image(self, image_path):
+        pre_scaled_height, pre_scaled_width = self.get_pre_scaled_size()
+        image_raw = tf.io.read_file(image_path)
+        image = dd.image.decode_image(image_raw, pre_scaled_width, pre_scaled_height)
+
+        return tf.image.resize(
+            image, size=(pre_scaled_height, pre_scaled_width), method=tf.image.ResizeMethod.AREA, preserve_aspect_ratio=True)
 
-        return (image, tag_string)
+    def map_load_image(self, image_path, tag_indices):
+        if self.image_cache is None:
+            image = self.load_image(image_path)
+        else:
+            # Cached as uint8 like build-cache, augmentation is applied after the cache.
+            image = tf.cast(self.image_cache.load_tf(
+                image_path, lambda: tf.cast(tf.round(self.load_image(image_path)), tf.uint8)), tf.float32)
 
-    def map_transform_image_and_label(self, image, tag_string):
-        return tf.py_function(self.map_transform_image_and_label_py, (image, tag_string), (tf.float32, tf.float32))
+        return (image, tag_indices, self.get_sample_seed(image_path))
 
-    def map_transform_image_and_label_py(self, image, tag_string):
+    def map_parse_cache_record(self, serialized):
+        features = tf.io.parse_single_example(serialized, dd.data.CACHE_RECORD_FEATURES)
+        image = dd.data.decode_cache_image(features)
+        tag_indices = tf.cast(tf.sparse.to_dense(features['tag_indices']), tf.int32)
+
+        return (tf.cast(image, tf.float32), tag_indices, self.get_sample_seed(features['key']))
+
+    def map_count_batch(self, images, tag_indices):
+        with tf.control_dependencies([self.batch_counter.assign_add(1)]):
+            return (tf.identity(images), tag_indices)
+
+    def map_transform_image_and_label(self, image, tag_indices, sample_seed):
         # transform image
-        image = image.numpy()
+        random_values = tf.random.stateless_uniform(shape=(4,), seed=sample_seed)
 
         if self.scale_range:
-            scale = random.uniform(
-                self.scale_range[0], self.scale_range[1]) * (1.0 / self.scale_range[1])
+            scale = (self.scale_range[0] + random_values[0] * (self.scale_range[1] - self.scale_range[0])) * (
+                1.0 / self.scale_range[1])
+            scales = tf.expand_dims(scale, 0)
         else:
-            scale = None
+            scales = None
 
         if self.rotation_range:
-            rotation = random.uniform(
-                self.rotation_range[0], self.rotation_range[1])
+            rotation = self.rotation_range[0] + random_values[1] * (self.rotation_range[1] - self.rotation_range[0])
+            rotations = tf.expand_dims(rotation, 0)
         else:
-            rotation = None
+            rotations = None
 
         if self.shift_range:
-            shift_x = random.uniform(self.shift_range[0], self.shift_range[1])
-            shift_y = random.uniform(self.shift_range[0], self.shift_range[1])
-            shift = (shift_x, shift_y)
+            shift = self.shift_range[0] + random_values[2:4] * (self.shift_range[1] - self.shift_range[0])
+            shifts = tf.expand_dims(shift, 0)
         else:
-            shift = None
+            shifts = None
 
-        image = dd.image.transform_and_pad_image(
-            image=image,
+        image = dd.image.transform_and_pad_images(
+            images=tf.expand_dims(image, 0),
             target_width=self.width,
             target_height=self.height,
-            rotation=rotation,
-            scale=scale,
-            shift=shift)
+            rotations=rotations,
+            scales=scales,
+            shifts=shifts)[0]
 
         image = image / 255.0  # normalize to 0~1
-        # image = image.astype(np.float32)
-
-        # transform tag
-        tag_string = tag_string.numpy().decode()
-        tag_array = np.array(tag_string.split(' '))
-
-        labels = np.where(np.isin(self.tag_all_array,
-                                  tag_array), 1, 0).astype(np.float32)
+        image.set_shape((self.height, self.width, 3))
 
-        return (image, labels)
+        return (image, tf.cast(tag_indices, tf.int32))
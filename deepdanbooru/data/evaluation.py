@@ -0,0 +1,57 @@
+from typing import Any, List, Union
+
+import six
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+def map_load_image_for_evaluate(image_path, image_raw, width, height, normalize=True):
+    """
+    Load image for evaluation as graph operations. If image_path is empty, image_raw is used.
+    """
+    image_raw = tf.cond(tf.strings.length(image_path) > 0,
+                        lambda: tf.io.read_file(image_path), lambda: image_raw)
+    image = dd.image.decode_image(image_raw, width, height)
+
+    image = tf.image.resize(
+        image, size=(height, width), method=tf.image.ResizeMethod.AREA, preserve_aspect_ratio=True)
+    image = dd.image.center_and_pad_image(image, width, height)
+
+    if normalize:
+        image = image / 255.0
+
+    return image
+
+
+def get_dataset_for_evaluate(
+        inputs: List[Union[str, six.BytesIO]], width: int, height: int, minibatch_size: int, normalize: bool = True
+) -> Any:
+    """
+    Create dataset which loads images in parallel and yields batches in input order.
+    """
+    image_paths = ['' if isinstance(input_, six.BytesIO) else input_ for input_ in inputs]
+    image_raws = [input_.getvalue() if isinstance(input_, six.BytesIO) else b'' for input_ in inputs]
+
+    # Explicit dtype, since dtype of empty list is inferred as float32.
+    dataset = tf.data.Dataset.from_tensor_slices(
+        (tf.constant(image_paths, dtype=tf.string), tf.constant(image_raws, dtype=tf.string)))
+    dataset = dataset.map(
+        lambda image_path, image_raw: map_load_image_for_evaluate(image_path, image_raw, width, height, normalize),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.batch(minibatch_size)
+    dataset = dataset.prefetch(
+        buffer_size=tf.data.experimental.AUTOTUNE)
+
+    return dataset
+
+
+def load_image_for_evaluate(
+        input_: Union[str, six.BytesIO], width: int, height: int, normalize: bool = True
+) -> Any:
+    if isinstance(input_, six.BytesIO):
+        image = map_load_image_for_evaluate('', input_.getvalue(), width, height, normalize)
+    else:
+        image = map_load_image_for_evaluate(input_, b'', width, height, normalize)
+
+    return image.numpy()  # EagerTensor to np.array
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+class ImageCache:
+    """
+    Cache of decoded and pre-resized uint8 images by key (image path), which is shared by datasets of all epochs.
+    Images are kept in memory up to byte_budget bytes. If spill_path is given, images over the budget are saved
+    to files in a temporary directory under spill_path, otherwise they are not cached.
+    Images with empty key are not cached.
+    Cached keys and whether the budget is full are also kept as graph state, so samples which are not cached
+    don't call Python function once the budget is full.
+    """
+
+    def __init__(self, byte_budget, spill_path=None):
+        self.byte_budget = byte_budget
+        self.spill_directory_path = tempfile.mkdtemp(prefix='image-cache-', dir=spill_path) if spill_path else None
+        self.images = {}
+        self.spilled_keys = set()
+        self.byte_count = 0
+        self.is_full = False
+        self.lock = threading.Lock()
+        self.cached_key_table = tf.lookup.experimental.MutableHashTable(
+            key_dtype=tf.string, value_dtype=tf.bool, default_value=False)
+        self.is_full_variable = tf.Variable(False, trainable=False)
+
+    def __len__(self):
+        return len(self.images) + len(self.spilled_keys)
+
+    def get_spill_file_path(self, key):
+        return os.path.join(self.spill_directory_path, hashlib.md5(key).hexdigest() + '.npy')
+
+    def get(self, key):
+        """
+        Get cached image of key (bytes), or None.
+        """
+        with self.lock:
+            image = self.images.get(key)
+            is_spilled = image is None and key in self.spilled_keys
+
+        if is_spilled:
+            image = np.load(self.get_spill_file_path(key))
+
+        return image
+
+    def put(self, key, image):
+        """
+        Cache image (uint8 array) of key (bytes) if budget or spill directory allows, and return whether it is cached.
+        """
+        if not key:
+            return False
+
+        with self.lock:
+            if key in self.images or key in self.spilled_keys:
+                return True
+
+            if self.byte_count + image.nbytes <= self.byte_budget:
+                self.images[key] = image
+                self.byte_count += image.nbytes
+                return True
+
+            if not self.spill_directory_path:
+                self.is_full = True
+                return False
+
+        if self.spill_directory_path:
+            spill_file_path = self.get_spill_file_path(key)
+            # Written to temporary file first, so other threads never read incomplete file.
+            temporary_file_path = f'{spill_file_path}.{threading.get_ident()}.tmp'
+            with open(temporary_file_path, 'wb') as stream:
+                np.save(stream, image)
+            os.replace(temporary_file_path, spill_file_path)
+
+            with self.lock:
+                self.spilled_keys.add(key)
+
+        return True
+
+    def get_numpy(self, key):
+        return self.get(key)
+
+    def put_numpy(self, key, image):
+        # Input array can share memory with the tensor.
+        is_cached = self.put(key, image.copy())
+
+        return np.bool_(is_cached), np.bool_(self.is_full)
+
+    def load_tf(self, key, load_function):
+        """
+        Get cached image of key, or load image by load_function (which returns uint8 image) and cache it,
+        as graph operations.
+        """
+        def lookup():
+            image = tf.numpy_function(self.get_numpy, [key], tf.uint8)
+            image.set_shape((None, None, 3))
+
+            return image
+
+        def load():
+            image = load_function()
+
+            def put():
+                is_cached, is_full = tf.numpy_function(self.put_numpy, [key, image], [tf.bool, tf.bool])
+
+                with tf.control_dependencies([
+                        self.cached_key_table.insert(key, is_cached), self.is_full_variable.assign(is_full)]):
+                    return tf.identity(image)
+
+            # Uncached images are not passed to Python once the budget is full.
+            return tf.cond(self.is_full_variable, lambda: image, put)
+
+        return tf.cond(self.cached_key_table.lookup(key), lookup, load)
+
+    def close(self):
+        """
+        Remove spilled images.
+        """
+        if self.spill_directory_path:
+            shutil.rmtree(self.spill_directory_path, ignore_errors=True)
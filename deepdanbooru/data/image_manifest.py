@@ -0,0 +1,150 @@
+import os
+import sqlite3
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def create_image_manifest_tables(connection):
+    """
+    image_manifest has image files ({image_folder_path}/{directory}/{id}.{ext}) and
+    image_manifest_directories has mtime of each directory at the last scan.
+    """
+    connection.execute("""CREATE TABLE IF NOT EXISTS image_manifest (
+        id INTEGER NOT NULL PRIMARY KEY,
+        directory TEXT,
+        file_name TEXT,
+        size INTEGER,
+        mtime_ns INTEGER
+        )""")
+    connection.execute('CREATE INDEX IF NOT EXISTS image_manifest_directory ON image_manifest (directory)')
+    connection.execute("""CREATE TABLE IF NOT EXISTS image_manifest_directories (
+        directory TEXT NOT NULL PRIMARY KEY,
+        mtime_ns INTEGER
+        )""")
+    connection.execute('CREATE TABLE IF NOT EXISTS image_manifest_info (name TEXT NOT NULL PRIMARY KEY, value TEXT)')
+    connection.commit()
+
+
+def scan_image_directory(directory_path):
+    """
+    Return (id, file_name, size, mtime_ns) of image files whose name is id.
+    """
+    rows = []
+
+    for entry in os.scandir(directory_path):
+        name = os.path.splitext(entry.name)[0]
+
+        if not name.isdigit() or not entry.is_file():
+            continue
+
+        stat = entry.stat()
+        rows.append((int(name), entry.name, stat.st_size, stat.st_mtime_ns))
+
+    return rows
+
+
+def update_image_manifest(sqlite_path, image_folder_path, jobs=16):
+    """
+    Update image manifest in database for image_folder_path.
+    Only directories whose mtime is changed since the last update are scanned, by jobs threads.
+    """
+    connection = sqlite3.connect(sqlite_path)
+    create_image_manifest_tables(connection)
+
+    image_folder_path = os.path.abspath(image_folder_path)
+    row = connection.execute("SELECT value FROM image_manifest_info WHERE name = 'image_folder_path'").fetchone()
+
+    if not row or row[0] != image_folder_path:
+        # Manifest of other folder is not reusable.
+        connection.execute('DELETE FROM image_manifest')
+        connection.execute('DELETE FROM image_manifest_directories')
+        connection.execute(
+            "INSERT OR REPLACE INTO image_manifest_info (name, value) VALUES ('image_folder_path', ?)",
+            (image_folder_path,))
+        connection.commit()
+
+    scanned_mtimes = dict(connection.execute('SELECT directory, mtime_ns FROM image_manifest_directories'))
+    current_mtimes = {entry.name: entry.stat().st_mtime_ns
+                      for entry in os.scandir(image_folder_path) if entry.is_dir()}
+
+    for directory in scanned_mtimes.keys() - current_mtimes.keys():
+        connection.execute('DELETE FROM image_manifest WHERE directory = ?', (directory,))
+        connection.execute('DELETE FROM image_manifest_directories WHERE directory = ?', (directory,))
+    connection.commit()
+
+    changed_directories = sorted(
+        directory for directory, mtime_ns in current_mtimes.items() if scanned_mtimes.get(directory) != mtime_ns)
+
+    if changed_directories:
+        print(f'Scanning {len(changed_directories)} of {len(current_mtimes)} image directories ...')
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            lambda directory: scan_image_directory(os.path.join(image_folder_path, directory)), changed_directories)
+
+        # Rows and mtime of a directory are committed together, so interrupted update is resumed on next run.
+        for index, (directory, rows) in enumerate(zip(changed_directories, results)):
+            connection.execute('DELETE FROM image_manifest WHERE directory = ?', (directory,))
+            connection.executemany(
+                'INSERT OR REPLACE INTO image_manifest (id, directory, file_name, size, mtime_ns) VALUES (?, ?, ?, ?, ?)',
+                [(id, directory, file_name, size, mtime_ns) for id, file_name, size, mtime_ns in rows])
+            connection.execute(
+                'INSERT OR REPLACE INTO image_manifest_directories (directory, mtime_ns) VALUES (?, ?)',
+                (directory, current_mtimes[directory]))
+
+            if index % 100 == 99:
+                connection.commit()
+
+    connection.commit()
+
+    connection.close()
+
+
+def load_image_manifest(sqlite_path):
+    """
+    Load image manifest as (directories, extensions, ids, directory_codes, extension_codes) sorted by id.
+    """
+    connection = sqlite3.connect(sqlite_path)
+    directories = []
+    directory_to_code = {}
+    extensions = []
+    extension_to_code = {}
+    ids = array('q')
+    directory_codes = array('i')
+    extension_codes = array('i')
+
+    for id, directory, file_name in connection.execute(
+            'SELECT id, directory, file_name FROM image_manifest ORDER BY id'):
+        extension = os.path.splitext(file_name)[1]
+
+        if directory not in directory_to_code:
+            directory_to_code[directory] = len(directories)
+            directories.append(directory)
+
+        if extension not in extension_to_code:
+            extension_to_code[extension] = len(extensions)
+            extensions.append(extension)
+
+        ids.append(id)
+        directory_codes.append(directory_to_code[directory])
+        extension_codes.append(extension_to_code[extension])
+
+    connection.close()
+
+    return (directories, extensions, np.frombuffer(ids, dtype=np.int64),
+            np.frombuffer(directory_codes, dtype=np.int32), np.frombuffer(extension_codes, dtype=np.int32))
+
+
+def load_image_paths(sqlite_path, image_folder_path):
+    """
+    Load {id: image_path} from image manifest.
+    """
+    connection = sqlite3.connect(sqlite_path)
+    image_paths = {
+        str(id): os.path.join(image_folder_path, directory, file_name)
+        for id, directory, file_name in connection.execute('SELECT id, directory, file_name FROM image_manifest')}
+    connection.close()
+
+    return image_paths
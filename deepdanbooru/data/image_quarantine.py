@@ -0,0 +1,119 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+def create_image_validation_table(connection):
+    """
+    image_validation has result of decoding each image with size and mtime of the file at the time.
+    Images whose error is not NULL are quarantined and skipped on loading image records.
+    """
+    connection.execute("""CREATE TABLE IF NOT EXISTS image_validation (
+        id INTEGER NOT NULL PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        error TEXT
+        )""")
+    connection.commit()
+
+
+def load_quarantined_ids(sqlite_path):
+    """
+    Load sorted ids of quarantined images. Empty if images are not validated yet.
+    """
+    connection = sqlite3.connect(sqlite_path)
+
+    try:
+        ids = [id for id, in connection.execute('SELECT id FROM image_validation WHERE error IS NOT NULL ORDER BY id')]
+    except sqlite3.OperationalError:
+        ids = []
+    finally:
+        connection.close()
+
+    return np.array(ids, dtype=np.int64)
+
+
+def validate_image(image_path, width=None, height=None):
+    """
+    Decode image in the same way as training and return (size, mtime_ns, error). error is None for valid image.
+    """
+    try:
+        stat = os.stat(image_path)
+    except OSError as e:
+        return None, None, str(e)
+
+    try:
+        dd.image.decode_image(tf.io.read_file(image_path), width, height)
+        error = None
+    except tf.errors.OpError as e:
+        error = e.message.splitlines()[0] if e.message else type(e).__name__
+
+    return stat.st_size, stat.st_mtime_ns, error
+
+
+def validate_image_records(sqlite_path, image_records, width=None, height=None, jobs=16, revalidate=False,
+                           chunk_size=10000):
+    """
+    Decode images of image_records by jobs threads and save results to the database, so broken images are
+    excluded by load_image_records_compact. Images which are not changed since the last validation are skipped
+    unless revalidate is True.
+    :return: (validated count, newly quarantined count, skipped count, total quarantined count)
+    """
+    connection = sqlite3.connect(sqlite_path)
+    create_image_validation_table(connection)
+    validated = {id: (size, mtime_ns) for id, size, mtime_ns in connection.execute(
+        'SELECT id, size, mtime_ns FROM image_validation')}
+
+    def validate(index):
+        image_path = image_records.get_image_path(index)
+        id = int(image_records.ids[index])
+
+        if not revalidate and id in validated:
+            try:
+                stat = os.stat(image_path)
+                if validated[id] == (stat.st_size, stat.st_mtime_ns):
+                    return None
+            except OSError:
+                pass
+
+        return (id, image_path) + validate_image(image_path, width, height)
+
+    validated_count = 0
+    quarantined_count = 0
+
+    print(f'Validating {len(image_records)} images ...')
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Results of each chunk are committed together, so interrupted validation is resumed on next run.
+        for start in range(0, len(image_records), chunk_size):
+            results = [result for result in executor.map(
+                validate, range(start, min(start + chunk_size, len(image_records)))) if result is not None]
+
+            for id, image_path, size, mtime_ns, error in results:
+                if error is not None:
+                    quarantined_count += 1
+                    print(f'Quarantined {image_path} : {error}')
+
+            connection.executemany(
+                'INSERT OR REPLACE INTO image_validation (id, size, mtime_ns, error) VALUES (?, ?, ?, ?)',
+                [(id, size, mtime_ns, error) for id, _, size, mtime_ns, error in results])
+            connection.commit()
+            validated_count += len(results)
+
+            if results:
+                print(f'{validated_count} images are validated.')
+
+    total_quarantined_count = connection.execute(
+        'SELECT COUNT(*) FROM image_validation WHERE error IS NOT NULL').fetchone()[0]
+    connection.close()
+
+    skipped_count = len(image_records) - validated_count
+    print(f'{validated_count} images are validated, {quarantined_count} are quarantined, '
+          f'{skipped_count} unchanged images are skipped. {total_quarantined_count} images are in quarantine.')
+
+    return validated_count, quarantined_count, skipped_count, total_quarantined_count
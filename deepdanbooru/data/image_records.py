@@ -0,0 +1,225 @@
+import os
+import sqlite3
+from array import array
+
+import numpy as np
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+class ImageRecords:
+    """
+    Compact image records for training.
+    Ids, directory codes and extension codes are kept in NumPy arrays and tags are kept as indices in tag space
+    (tag_indices[tag_offsets[i]:tag_offsets[i + 1]] are tags of record i). Image paths are derived on demand.
+    If md5s is not None, file name is md5 (md5 layout), otherwise id.
+    """
+
+    def __init__(self, image_folder_path, directories, extensions, ids, directory_codes, extension_codes,
+                 tag_offsets, tag_indices, md5s=None):
+        self.image_folder_path = image_folder_path
+        self.directories = directories
+        self.extensions = extensions
+        self.ids = ids
+        self.directory_codes = directory_codes
+        self.extension_codes = extension_codes
+        self.tag_offsets = tag_offsets
+        self.tag_indices = tag_indices
+        self.md5s = md5s
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_image_path(self, index):
+        name = self.md5s[index].decode() if self.md5s is not None else str(self.ids[index])
+
+        return os.path.join(
+            self.image_folder_path, self.directories[self.directory_codes[index]],
+            name + self.extensions[self.extension_codes[index]])
+
+    def get_tag_indices(self, index):
+        return self.tag_indices[self.tag_offsets[index]:self.tag_offsets[index + 1]]
+
+    def select(self, mask):
+        """
+        Create ImageRecords of records where mask (boolean array) is True.
+        """
+        tag_counts = np.diff(self.tag_offsets)
+
+        return ImageRecords(
+            self.image_folder_path, self.directories, self.extensions, self.ids[mask], self.directory_codes[mask],
+            self.extension_codes[mask], np.concatenate([[0], np.cumsum(tag_counts[mask])]),
+            self.tag_indices[np.repeat(mask, tag_counts)], self.md5s[mask] if self.md5s is not None else None)
+
+    def exclude_quarantined(self, sqlite_path):
+        """
+        Create ImageRecords without images quarantined by dd.data.validate_image_records.
+        """
+        quarantined = np.isin(self.ids, dd.data.load_quarantined_ids(sqlite_path))
+
+        if not quarantined.any():
+            return self
+
+        print(f'{np.count_nonzero(quarantined)} posts are skipped since image file is quarantined.')
+
+        return self.select(~quarantined)
+
+    def get_dataset(self, order=None):
+        """
+        Create dataset of (image_path, tag_indices) in order (array of record indices).
+        """
+        if order is None:
+            order = np.arange(len(self))
+
+        directory_paths = tf.constant(
+            [os.path.join(self.image_folder_path, directory, '') for directory in self.directories])
+        extensions = tf.constant(self.extensions)
+        names = self.md5s[order] if self.md5s is not None else self.ids[order]
+        tag_indices = tf.gather(tf.RaggedTensor.from_row_splits(self.tag_indices, self.tag_offsets), order)
+
+        def map_record(name, directory_code, extension_code, tag_indices):
+            if name.dtype != tf.string:
+                name = tf.strings.as_string(name)
+
+            image_path = tf.strings.join(
+                [tf.gather(directory_paths, directory_code), name, tf.gather(extensions, extension_code)])
+
+            return image_path, tag_indices
+
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (names, self.directory_codes[order], self.extension_codes[order], tag_indices))
+
+        return dataset.map(map_record, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+
+def get_image_folder_path(sqlite_path, image_folder_path=None):
+    return image_folder_path if image_folder_path is not None else os.path.join(os.path.dirname(sqlite_path), 'images')
+
+
+def update_image_records_database(sqlite_path, image_folder_path=None, path_layout='id'):
+    """
+    Create index for the filtering query of load_image_records_compact if it does not exist and the database
+    is writable, and update image manifest for 'id' layout.
+    """
+    if not os.path.exists(sqlite_path):
+        raise Exception(f'SQLite database is not exists : {sqlite_path}')
+
+    connection = sqlite3.connect(sqlite_path)
+
+    try:
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS posts_file_ext_tag_count_general ON posts (file_ext, tag_count_general)')
+        connection.commit()
+    except sqlite3.OperationalError:
+        pass
+    finally:
+        connection.close()
+
+    if path_layout == 'id':
+        dd.data.update_image_manifest(sqlite_path, get_image_folder_path(sqlite_path, image_folder_path))
+
+
+def load_image_records_compact(sqlite_path, minimum_tag_count, tags, image_folder_path=None, path_layout='id',
+                               exclude_quarantined=True, update_database=True):
+    """
+    Load image records as ImageRecords. Tags which are not in tags are dropped.
+    path_layout is 'id' ({image_folder_path}/*/{id}.{ext}, same as load_image_records_raw, posts without image file
+    are skipped) or 'md5' ({image_folder_path}/{md5[0:2]}/{md5}.{file_ext}, same as load_image_records).
+    For 'id' layout, image files are found by image manifest in the database.
+    If exclude_quarantined is True, images quarantined by dd.data.validate_image_records are skipped.
+    If update_database is True, update_image_records_database is called before loading. Otherwise the database is
+    only read, so it can be updated once by one process and loaded by many processes.
+    """
+    if not os.path.exists(sqlite_path):
+        raise Exception(f'SQLite database is not exists : {sqlite_path}')
+
+    if path_layout not in ('id', 'md5'):
+        raise Exception(f'Not supported path layout : {path_layout}')
+
+    image_folder_path = get_image_folder_path(sqlite_path, image_folder_path)
+
+    if update_database:
+        update_image_records_database(sqlite_path, image_folder_path, path_layout)
+
+    connection = sqlite3.connect(sqlite_path)
+
+    cursor = connection.execute(
+        """
+        SELECT
+            id,
+            md5,
+            file_ext,
+            tag_string
+        FROM
+            posts
+        WHERE
+            file_ext IN ('png', 'jpg', 'jpeg')
+            AND (tag_count_general >= ?)
+        ORDER BY
+            id
+        """,
+        (minimum_tag_count,))
+
+    tag_encoder = dd.data.TagEncoder(tags)
+    ids = array('q')
+    md5s = []
+    file_extensions = array('i')
+    tag_offsets = array('q', [0])
+    tag_indices = array('i')
+    extensions = []
+    extension_to_code = {}
+
+    for post_id, md5, file_extension, tag_string in cursor:
+        ids.append(post_id)
+
+        if path_layout == 'md5':
+            md5s.append(md5)
+
+            if file_extension not in extension_to_code:
+                extension_to_code[file_extension] = len(extensions)
+                extensions.append(f'.{file_extension}')
+
+            file_extensions.append(extension_to_code[file_extension])
+
+        tag_indices.frombytes(tag_encoder.encode_indices(tag_string).tobytes())
+        tag_offsets.append(len(tag_indices))
+
+    connection.close()
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    tag_offsets = np.frombuffer(tag_offsets, dtype=np.int64)
+    tag_indices = np.frombuffer(tag_indices, dtype=np.int32)
+
+    if path_layout == 'md5':
+        md5s = np.array(md5s, dtype='S32')
+        # Directory is first 2 characters of md5.
+        directories, directory_codes = np.unique(md5s.astype('S2'), return_inverse=True)
+
+        image_records = ImageRecords(
+            image_folder_path, [directory.decode() for directory in directories], extensions, ids,
+            directory_codes.astype(np.int32),
+            np.frombuffer(file_extensions, dtype=np.int32), tag_offsets, tag_indices, md5s)
+    else:
+        directories, extensions, image_ids, image_directory_codes, image_extension_codes = \
+            dd.data.load_image_manifest(sqlite_path)
+        image_indices = np.minimum(np.searchsorted(image_ids, ids), max(len(image_ids) - 1, 0))
+        found = image_ids[image_indices] == ids if len(image_ids) else np.zeros(len(ids), dtype=bool)
+
+        if not found.all():
+            print(f'{np.count_nonzero(~found)} posts are skipped since image file is not exists.')
+
+        # Drop tags of skipped records.
+        tag_counts = np.diff(tag_offsets)
+        tag_indices = tag_indices[np.repeat(found, tag_counts)]
+        tag_offsets = np.concatenate([[0], np.cumsum(tag_counts[found])])
+        image_indices = image_indices[found]
+
+        image_records = ImageRecords(
+            image_folder_path, directories, extensions, ids[found], image_directory_codes[image_indices],
+            image_extension_codes[image_indices], tag_offsets, tag_indices)
+
+    if exclude_quarantined:
+        image_records = image_records.exclude_quarantined(sqlite_path)
+
+    return image_records
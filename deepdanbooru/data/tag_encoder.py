@@ -0,0 +1,74 @@
+import numpy as np
+import tensorflow as tf
+
+
+class TagEncoder:
+    """
+    Encoder which converts tag string to label using precomputed tag-to-index lookup.
+    Encoding cost is proportional to the tag count of the image, not to the vocabulary size.
+    """
+
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.tag_count = len(self.tags)
+        self.tag_to_index = {tag: index for index, tag in enumerate(self.tags)}
+        self.table = tf.lookup.StaticHashTable(
+            tf.lookup.KeyValueTensorInitializer(
+                keys=tf.constant(self.tags, dtype=tf.string),
+                values=tf.range(self.tag_count, dtype=tf.int32)),
+            default_value=-1)
+
+    def encode_indices(self, tag_string):
+        """
+        Convert tag string to array of tag indices. Unknown tags are ignored.
+        """
+        indices = [self.tag_to_index.get(tag, -1) for tag in tag_string.split(' ')]
+
+        return np.array([index for index in indices if index >= 0], dtype=np.int32)
+
+    def encode(self, tag_string):
+        """
+        Convert tag string to multi-hot label vector.
+        """
+        labels = np.zeros((self.tag_count,), dtype=np.float32)
+        labels[self.encode_indices(tag_string)] = 1.0
+
+        return labels
+
+    def encode_indices_tf(self, tag_string):
+        """
+        Graph version of encode_indices.
+        """
+        indices = self.table.lookup(tf.strings.split(tag_string, ' '))
+
+        return tf.boolean_mask(indices, indices >= 0)
+
+    def encode_tf(self, tag_string):
+        """
+        Graph version of encode.
+        """
+        return self.indices_to_labels_tf(self.encode_indices_tf(tag_string))
+
+    def indices_to_labels_tf(self, indices):
+        """
+        Scatter tag indices to multi-hot label vector.
+        """
+        return tf.tensor_scatter_nd_update(
+            tf.zeros((self.tag_count,), dtype=tf.float32),
+            tf.expand_dims(indices, 1),
+            tf.ones_like(indices, dtype=tf.float32))
+
+
+def tag_indices_to_labels(tag_indices, tag_count):
+    """
+    Scatter batch of tag indices padded by -1 ([batch, max tag count]) to multi-hot labels ([batch, tag_count]),
+    as graph operations.
+    """
+    positions = tf.where(tag_indices >= 0)
+    indices = tf.stack([positions[:, 0], tf.cast(tf.gather_nd(tag_indices, positions), tf.int64)], axis=1)
+    labels = tf.scatter_nd(
+        indices, tf.ones_like(positions[:, 0], dtype=tf.float32),
+        tf.stack([tf.shape(tag_indices, out_type=tf.int64)[0], tag_count]))
+
+    # Duplicated indices are added by scatter_nd.
+    return tf.minimum(labels, 1.0)
@@ -1,7 +1,8 @@
 import math
 
 import numpy as np
-import skimage.transform
+import six
+import tensorflow as tf
 
 
 def calculate_image_scale(source_width, source_height, target_width, target_height):
@@ -22,35 +23,174 @@ def calculate_image_scale(source_width, source_height, target_width, target_heig
     return scale
 
 
+def _translation_matrices(x, y):
+    ones = tf.ones_like(x)
+    zeros = tf.zeros_like(x)
+
+    return tf.stack([
+        tf.stack([ones, zeros, x], axis=-1),
+        tf.stack([zeros, ones, y], axis=-1),
+        tf.stack([zeros, zeros, ones], axis=-1)], axis=-2)
+
+
+def _scale_matrices(scale):
+    ones = tf.ones_like(scale)
+    zeros = tf.zeros_like(scale)
+
+    return tf.stack([
+        tf.stack([scale, zeros, zeros], axis=-1),
+        tf.stack([zeros, scale, zeros], axis=-1),
+        tf.stack([zeros, zeros, ones], axis=-1)], axis=-2)
+
+
+def _rotation_matrices(radian):
+    ones = tf.ones_like(radian)
+    zeros = tf.zeros_like(radian)
+    cos = tf.math.cos(radian)
+    sin = tf.math.sin(radian)
+
+    return tf.stack([
+        tf.stack([cos, -sin, zeros], axis=-1),
+        tf.stack([sin, cos, zeros], axis=-1),
+        tf.stack([zeros, zeros, ones], axis=-1)], axis=-2)
+
+
+def transform_and_pad_images(images, target_width, target_height, scales=None, rotations=None, shifts=None,
+                             interpolation='BILINEAR', fill_mode='NEAREST'):
+    """
+    Transform batch of images and pad by edge pixels, as graph operations.
+    All images in batch must have same size. scales and rotations are [batch] tensors, shifts is [batch, 2] tensor.
+    """
+    images = tf.convert_to_tensor(images)
+    images_shape = tf.shape(images)
+    batch_size = images_shape[0]
+    image_width = tf.cast(images_shape[2], tf.float32)
+    image_height = tf.cast(images_shape[1], tf.float32)
+    target_width_f = tf.cast(target_width, tf.float32)
+    target_height_f = tf.cast(target_height, tf.float32)
+    zeros = tf.zeros((batch_size,), dtype=tf.float32)
+
+    # centerize
+    t = _translation_matrices(zeros - image_width * 0.5, zeros - image_height * 0.5)
+
+    if scales is not None:
+        t = tf.linalg.matmul(_scale_matrices(tf.cast(scales, tf.float32)), t)
+
+    if rotations is not None:
+        radian = (tf.cast(rotations, tf.float32) / 180.0) * math.pi
+        t = tf.linalg.matmul(_rotation_matrices(radian), t)
+
+    t = tf.linalg.matmul(_translation_matrices(zeros + target_width_f * 0.5, zeros + target_height_f * 0.5), t)
+
+    if shifts is not None:
+        shifts = tf.cast(shifts, tf.float32)
+        t = tf.linalg.matmul(_translation_matrices(target_width_f * shifts[:, 0], target_height_f * shifts[:, 1]), t)
+
+    # Transform of ImageProjectiveTransformV3 maps output pixel to input pixel.
+    t = tf.linalg.inv(t)
+    t = t / t[:, 2:3, 2:3]
+    transforms = tf.reshape(t, (batch_size, 9))[:, :8]
+
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=tf.cast(images, tf.float32),
+        transforms=transforms,
+        output_shape=tf.stack([target_height, target_width]),
+        fill_value=0.0,
+        interpolation=interpolation,
+        fill_mode=fill_mode)
+
+
 def transform_and_pad_image(image, target_width, target_height, scale=None, rotation=None, shift=None, order=1, mode='edge'):
     """
     Transform image and pad by edge pixles.
     """
-    image_width = image.shape[1]
-    image_height = image.shape[0]
-    image_array = image
+    interpolation = {0: 'NEAREST', 1: 'BILINEAR'}[order]
+    fill_mode = {'edge': 'NEAREST', 'constant': 'CONSTANT', 'reflect': 'REFLECT', 'wrap': 'WRAP'}[mode]
 
-    # centerize
-    t = skimage.transform.AffineTransform(
-        translation=(-image_width * 0.5, -image_height * 0.5))
+    image_array = transform_and_pad_images(
+        images=tf.expand_dims(image, 0),
+        target_width=target_width,
+        target_height=target_height,
+        scales=[scale] if scale else None,
+        rotations=[rotation] if rotation else None,
+        shifts=[shift] if shift else None,
+        interpolation=interpolation,
+        fill_mode=fill_mode)
+
+    return image_array[0].numpy()
+
+
+def center_and_pad_image(image, target_width, target_height):
+    """
+    Centerize image and pad by edge pixels. This is graph version of transform_and_pad_image without augmentation.
+    """
+    return transform_and_pad_images(tf.expand_dims(image, 0), target_width, target_height)[0]
+
+
+# Scale denominators supported by libjpeg DCT-domain downscaling, from the smallest output.
+JPEG_DECODE_RATIOS = (8, 4, 2, 1)
+
+
+def get_jpeg_decode_ratio(image_raw, target_width, target_height):
+    """
+    Get index of JPEG_DECODE_RATIOS for the smallest decoded image which is still not smaller than the image
+    resized to fit in target size, as graph operations. Only JPEG header is parsed.
+    """
+    shape = tf.cast(tf.image.extract_jpeg_shape(image_raw), tf.float32)
+    scale = tf.minimum(tf.cast(target_height, tf.float32) / shape[0], tf.cast(target_width, tf.float32) / shape[1])
+    ratios = tf.constant(JPEG_DECODE_RATIOS, dtype=tf.float32)
+
+    # Decoded size is ceil(size / ratio), so ratio * scale <= 1 keeps enough pixels. Full size is used for upscaling.
+    return tf.argmax(tf.cast(tf.logical_or(ratios * scale <= 1.0, tf.equal(ratios, 1.0)), tf.int32), output_type=tf.int32)
+
+
+def _decode_jpeg(image_raw, target_width, target_height):
+    if target_width is None or target_height is None:
+        return tf.io.decode_jpeg(image_raw, channels=3)
 
-    if scale:
-        t += skimage.transform.AffineTransform(scale=(scale, scale))
+    return tf.switch_case(
+        get_jpeg_decode_ratio(image_raw, target_width, target_height),
+        [lambda ratio=ratio: tf.io.decode_jpeg(image_raw, channels=3, ratio=ratio) for ratio in JPEG_DECODE_RATIOS])
 
-    if rotation:
-        radian = (rotation / 180.0) * math.pi
-        t += skimage.transform.AffineTransform(rotation=radian)
 
-    t += skimage.transform.AffineTransform(
-        translation=(target_width * 0.5, target_height * 0.5))
+def _decode_webp_numpy(image_raw):
+    from PIL import Image
 
-    if shift:
-        t += skimage.transform.AffineTransform(
-            translation=(target_width * shift[0], target_height * shift[1]))
+    with Image.open(six.BytesIO(image_raw)) as image:
+        return np.asarray(image.convert('RGB'))
 
-    warp_shape = (target_height, target_width)
 
-    image_array = skimage.transform.warp(
-        image_array, (t).inverse, output_shape=warp_shape, order=order, mode=mode)
+def _decode_webp(image_raw):
+    if hasattr(tf.io, 'decode_webp'):
+        image = tf.io.decode_webp(image_raw, channels=3)
+        if image.shape.rank == 4:
+            # First frame of animation, like GIF.
+            image = image[0]
+    else:
+        # Older TensorFlow can not decode WebP.
+        image = tf.numpy_function(_decode_webp_numpy, [image_raw], tf.uint8, stateful=False)
+
+    return tf.reshape(image, tf.stack([tf.shape(image)[0], tf.shape(image)[1], 3]))
+
 
-    return image_array
+def decode_image(image_raw, target_width=None, target_height=None):
+    """
+    Decode PNG, JPEG, GIF (first frame), BMP or WebP image as uint8 RGB image, as graph operations.
+    Format is detected from content, not from file extension.
+    If target size is given, JPEG is decoded with DCT-domain downscaling to the smallest size which is not smaller
+    than the image resized to fit in target size. Result must be resized to target size after decoding.
+    """
+    # Header is padded, so short or empty data fails on decoding, not on format detection.
+    header = tf.strings.join([tf.strings.substr(image_raw, 0, 12), b'\0' * 12])
+    is_jpeg = tf.equal(tf.strings.substr(header, 0, 3), b'\xff\xd8\xff')
+    is_webp = tf.logical_and(
+        tf.equal(tf.strings.substr(header, 0, 4), b'RIFF'), tf.equal(tf.strings.substr(header, 8, 4), b'WEBP'))
+
+    image = tf.case([
+        (is_jpeg, lambda: _decode_jpeg(image_raw, target_width, target_height)),
+        (is_webp, lambda: _decode_webp(image_raw))],
+        default=lambda: tf.io.decode_image(image_raw, channels=3, expand_animations=False),
+        exclusive=True)
+    image.set_shape((None, None, 3))
+
+    return image
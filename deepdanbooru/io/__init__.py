@@ -1,9 +1,11 @@
+import hashlib
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import boto3
 import logging
-from botocore.exceptions import ClientError
 
 
 def serialize_as_json(target_object, path, encoding='utf-8'):
@@ -38,10 +40,15 @@ class CloudStorage:
     :param region_name: (optional) AWS region name (i.e. us-east-1)
     :param s3_bucket: (optional) default bucket name
     :param s3_key_prefix: (optional) every upload goes under this prefix as a subdirectory in S3
+    :param max_workers: (optional) number of files uploaded at once by sync_dir
+    :param multipart_chunksize: (optional) files larger than this are uploaded in parts of this size
     :return: True if file was uploaded, else False
     """
     def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, region_name=None, s3_bucket=None,
-                 s3_key_prefix=""):
+                 s3_key_prefix="", max_workers=8, multipart_chunksize=8 * 1024 * 1024):
+        # boto3 is imported only when S3 is used, since importing it is slow.
+        import boto3
+        from boto3.s3.transfer import TransferConfig
 
         self.session = boto3.Session(
             aws_access_key_id=aws_access_key_id,
@@ -51,6 +58,18 @@ class CloudStorage:
         self.s3_client = self.session.client('s3')
         self.s3_bucket_default = s3_bucket
         self.s3_key_prefix = s3_key_prefix
+        self.max_workers = max_workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize, multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_workers)
+        # (s3_bucket, s3_key) -> (size, mtime_ns) of files which are known to be same as S3 objects.
+        self.synced_files = {}
+        self.synced_files_lock = threading.Lock()
+        # Background uploads run one by one in submitted order.
+        self.background_executor = ThreadPoolExecutor(max_workers=1)
+        self.background_futures = []
+        # Total seconds spent on background uploads, excluding waiting before upload.
+        self.background_seconds = 0.0
 
     def upload_file(self, local_file, s3_key, s3_bucket=None):
         """Upload a file to an S3 s3_bucket
@@ -60,6 +79,7 @@ class CloudStorage:
         :param s3_key: S3 object name. If not specified then local_file is used
         :return: True if file was uploaded, else False
         """
+        from botocore.exceptions import ClientError
 
         s3_bucket = s3_bucket or self.s3_bucket_default
         assert s3_bucket, "You must provide an S3 bucket or initialize this class with an S3 bucket"
@@ -105,3 +125,161 @@ class CloudStorage:
                 upload_successful = self.upload_file(local_file=full_path, s3_bucket=s3_bucket, s3_key=s3_path)
                 if not upload_successful:
                     print("Upload failed...")
+
+    def get_etag(self, local_file):
+        """Compute ETag which S3 gives to local_file uploaded with transfer_config
+
+        :param local_file: File to compute ETag
+        :return: ETag without quotes
+        """
+        from s3transfer.utils import ChunksizeAdjuster
+
+        # Part size is adjusted by s3transfer in same way on upload.
+        chunksize = ChunksizeAdjuster().adjust_chunksize(
+            self.transfer_config.multipart_chunksize, os.path.getsize(local_file))
+        digests = []
+
+        with open(local_file, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(chunksize), b''):
+                digests.append(hashlib.md5(chunk).digest())
+
+        if os.path.getsize(local_file) < self.transfer_config.multipart_threshold:
+            return digests[0].hex() if digests else hashlib.md5().hexdigest()
+
+        return f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}'
+
+    def list_objects(self, s3_bucket, s3_key):
+        """List objects under s3_key
+
+        :return: {key: (size, etag)}
+        """
+        objects = {}
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=s3_key):
+            for content in page.get('Contents', []):
+                objects[content['Key']] = (content['Size'], content['ETag'].strip('"'))
+
+        return objects
+
+    def sync_dir(self, local_dir, s3_key, s3_bucket=None):
+        """Upload new or changed files in directory to an S3 s3_bucket in parallel
+
+        Files are compared with the last synced size and mtime, or with size and ETag of S3 objects
+        for files which are not synced by this instance yet.
+        Files under local_dir are uploaded to {s3_key_prefix}/{s3_key}/{basename of local_dir}/{relative path}.
+
+        :param local_dir: Directory with files to upload
+        :param s3_bucket: s3_bucket to upload to
+        :param s3_key: S3 key of directory
+        :return: (uploaded file count, failed file count)
+        """
+        from botocore.exceptions import ClientError
+
+        s3_bucket = s3_bucket or self.s3_bucket_default
+        assert s3_bucket, "You must provide an S3 bucket or initialize this class with an S3 bucket"
+        assert os.path.isdir(local_dir), "local_dir must be a valid directory and not a file"
+
+        s3_dir = os.path.join(self.s3_key_prefix, s3_key, os.path.basename(os.path.normpath(local_dir)))
+        s3_dir = s3_dir.replace("\\", "/").strip("/")
+        files = []
+
+        for subdir, dirs, file_names in os.walk(local_dir):
+            for file_name in file_names:
+                full_path = os.path.join(subdir, file_name)
+                s3_path = f'{s3_dir}/{os.path.relpath(full_path, local_dir)}'.replace("\\", "/")
+
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    continue
+
+                with self.synced_files_lock:
+                    is_synced = self.synced_files.get((s3_bucket, s3_path)) == (stat.st_size, stat.st_mtime_ns)
+
+                if not is_synced:
+                    files.append((full_path, s3_path, stat))
+
+        objects = None
+
+        if files and any((s3_bucket, s3_path) not in self.synced_files for _, s3_path, _ in files):
+            objects = self.list_objects(s3_bucket, s3_dir + '/')
+
+        def sync_file(file):
+            full_path, s3_path, stat = file
+
+            try:
+                if objects and objects.get(s3_path, (None,))[0] == stat.st_size \
+                        and objects[s3_path][1] == self.get_etag(full_path):
+                    is_uploaded = False
+                else:
+                    self.s3_client.upload_file(full_path, s3_bucket, s3_path, Config=self.transfer_config)
+                    is_uploaded = True
+            except FileNotFoundError:
+                # File is removed while syncing, for example old checkpoint.
+                return False, False
+            except ClientError as e:
+                logging.error(e)
+                return False, True
+
+            with self.synced_files_lock:
+                self.synced_files[(s3_bucket, s3_path)] = (stat.st_size, stat.st_mtime_ns)
+
+            return is_uploaded, False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(sync_file, files))
+
+        uploaded_count = sum(is_uploaded for is_uploaded, _ in results)
+        failed_count = sum(is_failed for _, is_failed in results)
+        print(f'Synced {local_dir} to s3://{s3_bucket}/{s3_dir} : '
+              f'{uploaded_count} uploaded, {failed_count} failed, {len(results) - uploaded_count - failed_count} unchanged')
+
+        return uploaded_count, failed_count
+
+    def sync_dir_async(self, local_dir, s3_key, s3_bucket=None, wait_for=None):
+        """Run sync_dir in background thread
+
+        :param wait_for: (optional) function called in background thread before syncing,
+            for example to wait for files being written
+        :return: Future of sync_dir
+        """
+        def sync_dir():
+            if wait_for:
+                wait_for()
+
+            return self.run_background(self.sync_dir, local_dir, s3_key, s3_bucket)
+
+        future = self.background_executor.submit(sync_dir)
+        self.background_futures.append(future)
+
+        return future
+
+    def upload_file_async(self, local_file, s3_key, s3_bucket=None):
+        """Run upload_file in background thread
+
+        :return: Future of upload_file
+        """
+        future = self.background_executor.submit(self.run_background, self.upload_file, local_file, s3_key, s3_bucket)
+        self.background_futures.append(future)
+
+        return future
+
+    def run_background(self, function, *args):
+        start = time.perf_counter()
+
+        try:
+            return function(*args)
+        finally:
+            self.background_seconds += time.perf_counter() - start
+
+    def wait(self):
+        """Wait for all background uploads
+
+        Exception raised in background is raised again.
+        """
+        futures = self.background_futures
+        self.background_futures = []
+
+        for future in futures:
+            future.result()
@@ -7,3 +7,5 @@ from .resnet import create_resnet_custom_v2
 from .resnet import create_resnet_custom_v3
 
 from .efficientnet import create_efficientnet_factory
+
+from .precision import set_precision, convert_model_precision, rebuild_model_with_policy
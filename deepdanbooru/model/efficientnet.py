@@ -20,7 +20,7 @@ def create_efficientnet_factory(model_name):
 
         x = model(x)
         x = dd.model.layers.conv_gap(x, output_dim)
-        x = tf.keras.layers.Activation('sigmoid')(x)
+        x = tf.keras.layers.Activation('sigmoid', dtype='float32')(x)
 
         return x
 
@@ -3,6 +3,8 @@ import tensorflow as tf
 
 def focal_loss(alpha=0.25, gamma=2.0, epsilon=1e-7):
     def loss(y_true, y_pred):
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
         value = -alpha * y_true * tf.math.pow(1.0 - y_pred, gamma) * tf.math.log(y_pred + epsilon) - (
             1.0 - alpha) * (1.0 - y_true) * tf.math.pow(y_pred, gamma) * tf.math.log(1.0 - y_pred + epsilon)
 
@@ -13,6 +15,9 @@ def focal_loss(alpha=0.25, gamma=2.0, epsilon=1e-7):
 
 def binary_crossentropy(epsilon=1e-7):
     def loss(y_true, y_pred):
+        # Compute in float32 even if model runs in bfloat16.
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
         clipped_y_pred = tf.clip_by_value(y_pred, epsilon, tf.float32.max)
         clipped_y_pred_nega = tf.clip_by_value(
             1.0 - y_pred, epsilon, tf.float32.max)
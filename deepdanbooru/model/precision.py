@@ -0,0 +1,106 @@
+import tensorflow as tf
+
+
+def is_bfloat16_supported():
+    """
+    Check whether bfloat16 can be computed natively.
+    GPU needs compute capability 8.0 or higher, CPU needs AVX512_BF16 or AMX_BF16 instructions.
+    """
+    gpu_devices = tf.config.list_physical_devices('GPU')
+
+    if gpu_devices:
+        return all(tf.config.experimental.get_device_details(device).get('compute_capability', (0, 0)) >= (8, 0)
+                   for device in gpu_devices)
+
+    try:
+        with open('/proc/cpuinfo', 'r') as cpuinfo:
+            flags = cpuinfo.read().split()
+    except OSError:
+        return False
+
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def get_precision_policy(precision):
+    """
+    Convert precision option ('float32' or 'bfloat16') to keras dtype policy name.
+    """
+    if not precision or precision == 'float32':
+        return 'float32'
+    elif precision == 'bfloat16':
+        if not is_bfloat16_supported():
+            print('bfloat16 is not supported on this device. Using float32 ...')
+            return 'float32'
+
+        return 'mixed_bfloat16'
+    else:
+        raise Exception(f'Not supported precision : {precision}')
+
+
+def set_precision(precision):
+    """
+    Set global dtype policy for models created after this call.
+    Variables are kept in float32 and computation is done in bfloat16 when precision is 'bfloat16'.
+    """
+    policy = get_precision_policy(precision)
+    tf.keras.mixed_precision.set_global_policy(policy)
+
+    return policy
+
+
+def iterate_layers(layers):
+    """
+    Iterate layers except input layers, including layers of nested models.
+    """
+    for layer in layers:
+        if isinstance(layer, tf.keras.Model):
+            yield from iterate_layers(layer.layers)
+        elif not isinstance(layer, tf.keras.layers.InputLayer):
+            yield layer
+
+
+def get_layer_policies(model, policy):
+    """
+    Get {layer name: dtype policy name} of model for policy. Output layers are kept in float32.
+    """
+    output_layer_names = set(model.output_names)
+
+    return {layer.name: 'float32' if layer.name in output_layer_names else policy
+            for layer in iterate_layers(model.layers)}
+
+
+def rebuild_model_with_policy(model, policy):
+    """
+    Build new model from config of model with dtype policy (output layers are kept in float32), and copy weights.
+    Model is rebuilt from config instead of clone_model, since clone_model of compiled model fails on Keras 3.
+    """
+    layer_policies = get_layer_policies(model, policy)
+    config = model.get_config()
+
+    def set_policies(layer_configs):
+        for layer_config in layer_configs:
+            if 'layers' in layer_config['config']:
+                set_policies(layer_config['config']['layers'])
+            elif layer_config['config'].get('name') in layer_policies:
+                layer_config['config']['dtype'] = layer_policies[layer_config['config']['name']]
+
+    set_policies(config['layers'])
+    rebuilt_model = model.__class__.from_config(config)
+    rebuilt_model.set_weights(model.get_weights())
+
+    return rebuilt_model
+
+
+def convert_model_precision(model, precision):
+    """
+    Convert model to the dtype policy of precision. Output layers are kept in float32.
+    Model is rebuilt only if any layer has other policy, so model saved in mixed precision is converted
+    back to float32 too.
+    """
+    policy = get_precision_policy(precision)
+    layer_policies = get_layer_policies(model, policy)
+
+    if all(layer.dtype_policy.name == layer_policies[layer.name] for layer in iterate_layers(model.layers)):
+        return model
+
+    return rebuild_model_with_policy(model, policy)
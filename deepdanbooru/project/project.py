@@ -1,6 +1,5 @@
 import os
 import deepdanbooru as dd
-import tensorflow as tf
 
 DEFAULT_PROJECT_CONTEXT = {
     'image_width': 299,
@@ -21,14 +20,22 @@ DEFAULT_PROJECT_CONTEXT = {
     'learning_rate': 0.001,
     'rotation_range': [0.0, 360.0],
     'scale_range': [0.9, 1.1],
-    'shift_range': [-0.1, 0.1]
+    'shift_range': [-0.1, 0.1],
+    'distribution': None,
+    'distribution_cpu_device_count': None,
+    'precision': 'float32',
+    'steps_per_execution': 1,
+    'jit_compile': False,
+    'async_checkpoint': True
 }
 
 
 def load_project(project_path):
+    import tensorflow as tf
+
     project_context_path = os.path.join(project_path, 'project.json')
     project_context = dd.io.deserialize_from_json(project_context_path)
-    tags = dd.data.load_tags_from_project(project_path)
+    tags = load_tags_from_project(project_path)
 
     model_type = project_context['model']
     model_path = os.path.join(project_path, f'model-{model_type}.h5')
@@ -38,6 +45,8 @@ def load_project(project_path):
 
 
 def load_model_from_project(project_path, compile_model=True):
+    import tensorflow as tf
+
     project_context_path = os.path.join(project_path, 'project.json')
     project_context = dd.io.deserialize_from_json(project_context_path)
 
@@ -0,0 +1,4 @@
+from .checkpoint import create_checkpoint_options, save_checkpoint, ModelExporter
+from .distribution import create_distribution_strategy, is_chief, synchronize_workers
+from .instrumentation import TrainingMetrics, ProfilerWindow
+from .train_step import create_train_function
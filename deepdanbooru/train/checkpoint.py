@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+def create_checkpoint_options(async_checkpoint=True):
+    """
+    Create CheckpointOptions for saving checkpoints.
+    If async_checkpoint is True and it is supported by TensorFlow, variables are copied on save and written
+    by background thread. Next save waits only if the previous write is still in flight.
+    """
+    if async_checkpoint:
+        for name in ['enable_async', 'experimental_enable_async_checkpoint']:
+            try:
+                return tf.train.CheckpointOptions(**{name: True})
+            except TypeError:
+                continue
+
+    return tf.train.CheckpointOptions()
+
+
+def save_checkpoint(manager, options):
+    """
+    Save checkpoint by manager with options and return options for the next save.
+    Async checkpoint can not copy some variables (for example, variables of Keras 3 fail on the second save),
+    so it falls back to synchronous save.
+    """
+    try:
+        manager.save(options=options)
+    except ValueError as e:
+        if not getattr(options, 'experimental_enable_async_checkpoint', False):
+            raise
+
+        print(f'Async checkpoint is not supported for this model, falling back to synchronous save : {e}')
+        options = tf.train.CheckpointOptions()
+        manager.save(options=options)
+
+    return options
+
+
+class ModelExporter:
+    """
+    Export model as h5 file in background thread.
+    Weights are copied to a clone of model (created on the first export and reused), and the clone is written
+    while training continues. Next export waits only if the previous one is still in flight.
+    The file is written to temporary path and renamed, so incomplete file never appears at export path.
+    Exported model is always float32, even if model is trained in mixed precision.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.export_model = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = None
+
+    def export(self, export_path, on_exported=None):
+        """
+        Start export to export_path. on_exported(export_path) is called in background after the file is written.
+        """
+        self.wait()
+
+        if self.export_model is None:
+            self.export_model = dd.model.rebuild_model_with_policy(self.model, 'float32')
+
+        for export_variable, variable in zip(self.export_model.weights, self.model.weights):
+            export_variable.assign(variable)
+
+        self.future = self.executor.submit(self.write, export_path, on_exported)
+
+        return self.future
+
+    def write(self, export_path, on_exported):
+        temporary_path = f'{export_path}.tmp.h5'
+        self.export_model.save(temporary_path, include_optimizer=False)
+        os.replace(temporary_path, export_path)
+
+        if on_exported:
+            on_exported(export_path)
+
+    def wait(self):
+        """
+        Wait for export in flight. Exception raised in background is raised again.
+        """
+        if self.future:
+            self.future.result()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
@@ -0,0 +1,49 @@
+import tensorflow as tf
+
+
+def create_distribution_strategy(distribution=None, cpu_device_count=None):
+    """
+    Create tf.distribute strategy from project setting.
+    distribution can be None (default strategy), 'mirrored' or 'multi_worker_mirrored'.
+    If cpu_device_count is set, CPU is split into logical devices and used as replicas when there is no GPU.
+    This must be called before TensorFlow runtime is initialized.
+    """
+    if cpu_device_count:
+        cpu_devices = tf.config.list_physical_devices('CPU')
+        tf.config.set_logical_device_configuration(
+            cpu_devices[0], [tf.config.LogicalDeviceConfiguration() for _ in range(cpu_device_count)])
+
+    if not distribution:
+        return tf.distribute.get_strategy()
+    elif distribution == 'mirrored':
+        if tf.config.list_logical_devices('GPU'):
+            return tf.distribute.MirroredStrategy()
+        else:
+            devices = [device.name for device in tf.config.list_logical_devices('CPU')]
+            return tf.distribute.MirroredStrategy(
+                devices=devices, cross_device_ops=tf.distribute.ReductionToOneDevice())
+    elif distribution == 'multi_worker_mirrored':
+        # Cluster is configured by TF_CONFIG environment variable.
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    else:
+        raise Exception(f'Not supported distribution : {distribution}')
+
+
+def synchronize_workers(strategy):
+    """
+    Wait until all workers reach here, by reducing a value across all replicas.
+    """
+    strategy.reduce(tf.distribute.ReduceOp.SUM, strategy.run(lambda: tf.constant(1.0)), axis=None)
+
+
+def is_chief(strategy):
+    """
+    Check whether current worker is responsible for writing checkpoints, logs and models.
+    """
+    cluster_resolver = getattr(strategy, 'cluster_resolver', None)
+
+    if cluster_resolver is None or not cluster_resolver.task_type:
+        return True
+
+    return cluster_resolver.task_type == 'chief' or (
+        cluster_resolver.task_type == 'worker' and cluster_resolver.task_id == 0)
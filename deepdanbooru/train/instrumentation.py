@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import tensorflow as tf
+
+
+class TrainingMetrics:
+    """
+    Accumulate durations and gauges of training loop between logging steps, and emit them as TensorBoard scalars
+    and optional JSON lines file. Durations are emitted as seconds_{name}, and gauges are averaged over samples.
+    Durations can be added from background threads.
+    """
+
+    def __init__(self, duration_names=(), summary_writer=None, metrics_path=None):
+        self.duration_names = duration_names
+        self.summary_writer = summary_writer
+        self.metrics_path = metrics_path
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = dict.fromkeys(self.duration_names, 0.0)
+            self.gauges = {}
+
+    def add_duration(self, name, seconds):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(name, time.perf_counter() - start)
+
+    def add_gauge(self, name, value):
+        with self.lock:
+            value_sum, count = self.gauges.get(name, (0.0, 0))
+            self.gauges[name] = (value_sum + float(value), count + 1)
+
+    def get_duration(self, name):
+        with self.lock:
+            return self.durations.get(name, 0.0)
+
+    def write(self, step, **values):
+        """
+        Emit accumulated metrics and values at step, then reset accumulated metrics.
+        :return: dict of emitted metrics
+        """
+        with self.lock:
+            metrics = {name: float(value) for name, value in values.items()}
+            metrics.update({f'seconds_{name}': seconds for name, seconds in self.durations.items()})
+            metrics.update({name: value_sum / count for name, (value_sum, count) in self.gauges.items()})
+
+        self.reset()
+
+        if self.summary_writer:
+            with self.summary_writer.as_default():
+                for name, value in metrics.items():
+                    tf.summary.scalar(name, value, step=step)
+
+        if self.metrics_path:
+            with open(self.metrics_path, 'a', encoding='utf-8') as stream:
+                stream.write(json.dumps({'step': int(step), 'time': time.time(), **metrics}) + '\n')
+
+        return metrics
+
+
+class ProfilerWindow:
+    """
+    Record tf.profiler trace while minibatch counter is in [start_minibatch, stop_minibatch).
+    Trace is written to log_dir and can be viewed in Profile tab of TensorBoard.
+    """
+
+    def __init__(self, log_dir, minibatch_range=None):
+        self.log_dir = log_dir
+        self.minibatch_range = minibatch_range
+        self.is_running = False
+        self.is_done = not minibatch_range
+
+    def update(self, current_minibatch):
+        if self.is_done:
+            return
+
+        start_minibatch, stop_minibatch = self.minibatch_range
+
+        if not self.is_running and start_minibatch <= current_minibatch < stop_minibatch:
+            print(f'Starting profiler trace ... (minibatch {start_minibatch} ~ {stop_minibatch})')
+            tf.profiler.experimental.start(self.log_dir)
+            self.is_running = True
+        elif current_minibatch >= stop_minibatch:
+            self.stop()
+
+    def stop(self):
+        if self.is_running:
+            tf.profiler.experimental.stop()
+            print(f'Profiler trace is saved to {self.log_dir}')
+            self.is_running = False
+
+        self.is_done = True
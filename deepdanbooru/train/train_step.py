@@ -0,0 +1,83 @@
+import tensorflow as tf
+
+import deepdanbooru as dd
+
+
+def create_train_function(model, optimizer, loss_function, metrics, minibatch_counter, sample_counters, jit_compile=False,
+                          strategy=None, label_count=None):
+    """
+    Create compiled function which runs training steps from dataset iterator.
+    The function takes (iterator, steps) and returns (loss_sum, step_count, sample_count, data_wait_seconds).
+    step_count can be smaller than steps at the end of dataset.
+    data_wait_seconds is the time spent waiting for minibatches from iterator, so the rest of the call is compute.
+    If strategy is given, iterator must be distributed iterator of that strategy.
+    If label_count is given, iterator yields tag indices padded by -1 instead of labels, and they are converted to
+    labels on device before the compiled step.
+    """
+    strategy = strategy or tf.distribute.get_strategy()
+
+    @tf.function(jit_compile=jit_compile)
+    def train_step(x, y):
+        sample_count = tf.shape(x)[0]
+
+        # Replica can get empty minibatch at the end of distributed dataset.
+        # Some kernels fail on empty batch, so one padding sample is added and excluded from loss and metrics.
+        padding = tf.maximum(1 - sample_count, 0)
+        x = tf.pad(x, tf.concat([[[0, padding]], tf.zeros((tf.rank(x) - 1, 2), dtype=tf.int32)], axis=0))
+
+        with tf.GradientTape() as tape:
+            y_pred = model(x, training=True)[:sample_count]
+            loss = loss_function(y, y_pred)
+            if model.losses:
+                loss += tf.math.add_n(model.losses)
+
+        gradients = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+
+        for metric in metrics:
+            metric.update_state(y, y_pred)
+
+        return loss, tf.cast(sample_count, tf.int64)
+
+    def replica_step(x, y):
+        # Tag count of minibatch varies, so labels are made outside of jit compiled step.
+        if label_count is not None:
+            y = dd.data.tag_indices_to_labels(y, label_count)
+
+        return train_step(x, y)
+
+    @tf.function
+    def train_function(iterator, steps):
+        loss_sum = tf.constant(0.0, dtype=tf.float32)
+        step_count = tf.constant(0, dtype=tf.int64)
+        sample_count = tf.constant(0, dtype=tf.int64)
+        data_wait_seconds = tf.constant(0.0, dtype=tf.float64)
+
+        for _ in tf.range(steps):
+            # Timestamps are stateful, so they are ordered with iterator and training ops.
+            wait_start = tf.timestamp()
+            optional = iterator.get_next_as_optional()
+            has_value = optional.has_value()
+            with tf.control_dependencies([has_value]):
+                data_wait_seconds += tf.timestamp() - wait_start
+
+            if not has_value:
+                break
+
+            x, y = optional.get_value()
+            # Loss is sum over samples, so summing gradients of replicas is equal to single device.
+            loss, minibatch_sample_count = strategy.run(replica_step, args=(x, y))
+            loss = strategy.reduce(tf.distribute.ReduceOp.SUM, loss, axis=None)
+            minibatch_sample_count = strategy.reduce(tf.distribute.ReduceOp.SUM, minibatch_sample_count, axis=None)
+
+            minibatch_counter.assign_add(1)
+            for sample_counter in sample_counters:
+                sample_counter.assign_add(minibatch_sample_count)
+
+            loss_sum += tf.cast(loss, tf.float32)
+            step_count += 1
+            sample_count += minibatch_sample_count
+
+        return loss_sum, step_count, sample_count, data_wait_seconds
+
+    return train_function
@@ -22,7 +22,7 @@ install_requires = [
     'numpy',
     'tqdm'
 ]
-tensorflow_pkg = 'tensorflow>=2.1.0'
+tensorflow_pkg = 'tensorflow>=2.5.0'
 
 setuptools.setup(
     name="deepdanbooru",
@@ -40,7 +40,7 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=install_requires,
     extras_require={
         'tensorflow': [tensorflow_pkg],
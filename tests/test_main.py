@@ -23,6 +23,54 @@ def test_help(func_name):
     assert result.output
 
 
+def test_startup_time():
+    # Help and importing package must not import TensorFlow or other slow packages, so run in new process.
+    import subprocess
+    import sys
+    import time
+    script = '''
+import sys
+from click.testing import CliRunner
+import deepdanbooru.__main__
+assert CliRunner().invoke(deepdanbooru.__main__.main, ['--help']).exit_code == 0
+assert CliRunner().invoke(deepdanbooru.__main__.main, ['train-project', '--help']).exit_code == 0
+print(sorted(module for module in ['tensorflow', 'boto3', 'pandas'] if module in sys.modules))
+'''
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines()[-1] == '[]'
+
+    def measure(*args):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + list(args), check=True, capture_output=True)
+        return time.perf_counter() - start
+
+    tensorflow_seconds = min(measure('-c', 'import tensorflow') for _ in range(2))
+    help_seconds = min(measure('-m', 'deepdanbooru', '--help') for _ in range(3))
+    import_seconds = min(measure('-c', 'import deepdanbooru') for _ in range(3))
+    print(f'import tensorflow: {tensorflow_seconds:.2f} s, --help: {help_seconds:.2f} s, '
+          f'import deepdanbooru: {import_seconds:.2f} s')
+    assert help_seconds < tensorflow_seconds
+    assert import_seconds < tensorflow_seconds
+
+
+def test_command_function_after_module_import(tmp_path):
+    # Command module of the same name as its function must not hide the function, so run in new process.
+    import subprocess
+    import sys
+    script = f'''
+import deepdanbooru.commands.create_project
+import deepdanbooru.commands.make_training_database
+import deepdanbooru as dd
+dd.commands.create_project({(tmp_path / 'project').as_posix()!r})
+assert callable(dd.commands.make_training_database)
+assert callable(dd.commands.make_training_database_metadata_glob)
+'''
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / 'project' / 'project.json').exists()
+
+
 @pytest.fixture
 def packages():
     with open('requirements.txt') as f:
@@ -77,3 +125,772 @@ def test_load_image_for_evaluate(tmp_path, use_bytes_io):
         res = load_image_for_evaluate(image_input, 299, 299)
     assert isinstance(res, numpy.ndarray)
     assert res.shape == (299, 299, 3)
+
+
+@pytest.mark.parametrize('image_format', ['JPEG', 'PNG', 'GIF', 'WEBP', 'BMP'])
+def test_decode_image(image_format):
+    import deepdanbooru as dd
+    stream = six.BytesIO()
+    Image.new('RGB', (1200, 900), color=(255, 0, 0)).save(stream, format=image_format)
+
+    image = dd.image.decode_image(stream.getvalue()).numpy()
+    assert image.shape == (900, 1200, 3)
+    numpy.testing.assert_allclose(image[450, 600], [255, 0, 0], atol=8)
+
+    # JPEG is decoded in 1/4 size, which is the smallest one still larger than 299x224.
+    image = dd.image.decode_image(stream.getvalue(), 299, 299).numpy()
+    assert image.shape == ((225, 300, 3) if image_format == 'JPEG' else (900, 1200, 3))
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_image_cache(tmp_path, spill):
+    import os
+    import tensorflow as tf
+    import deepdanbooru as dd
+    image_paths = []
+    for index in range(3):
+        image_paths.append((tmp_path / f'{index}.png').as_posix())
+        Image.new('RGB', (40, 30), color=(index, 0, 0)).save(image_paths[-1])
+    (tmp_path / 'spill').mkdir()
+    # Budget is enough for 2 images.
+    image_cache = dd.data.ImageCache(
+        40 * 30 * 3 * 2, (tmp_path / 'spill').as_posix() if spill else None)
+    dataset = tf.data.Dataset.from_tensor_slices(image_paths).map(
+        lambda image_path: image_cache.load_tf(
+            image_path, lambda: tf.io.decode_png(tf.io.read_file(image_path), channels=3)),
+        num_parallel_calls=2)
+
+    assert [image[0, 0, 0] for image in dataset.as_numpy_iterator()] == [0, 1, 2]
+    assert len(image_cache) == (3 if spill else 2)
+    assert image_cache.byte_count == 40 * 30 * 3 * 2
+    # Without spill path, uncached images skip the cache once the budget is full.
+    assert bool(image_cache.is_full_variable.numpy()) == (not spill)
+
+    # Cached images are used without reading files.
+    for image_path in image_paths:
+        os.remove(image_path)
+    if spill:
+        assert [image[0, 0, 0] for image in dataset.as_numpy_iterator()] == [0, 1, 2]
+    else:
+        with pytest.raises(tf.errors.NotFoundError):
+            list(dataset.as_numpy_iterator())
+    image_cache.close()
+    assert not list((tmp_path / 'spill').iterdir())
+
+
+def test_evaluate_images_batch(tmp_path):
+    import tensorflow as tf
+    from deepdanbooru.commands import evaluate_images
+    image_paths = []
+    for i in range(5):
+        image_path = tmp_path / f'test{i}.png'
+        Image.new('RGB', (40, 30), color=(i * 50, 0, 0)).save(image_path)
+        image_paths.append(image_path.as_posix())
+    inputs = tf.keras.Input(shape=(32, 32, 3))
+    outputs = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+    model = tf.keras.Model(inputs=inputs, outputs=outputs)
+    tags = ['red', 'green', 'blue']
+
+    results = list(evaluate_images(image_paths, model, tags, -1.0, batch_size=2))
+
+    assert [image_path for image_path, _ in results] == image_paths
+    for i, (_, result) in enumerate(results):
+        assert [tag for tag, _ in result] == tags
+        assert result[0][1] == pytest.approx(i * 50 / 255.0, abs=1e-3)
+
+
+def test_evaluate_images_empty():
+    import tensorflow as tf
+    from deepdanbooru.commands import evaluate_images
+    inputs = tf.keras.Input(shape=(32, 32, 3))
+    outputs = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+    model = tf.keras.Model(inputs=inputs, outputs=outputs)
+
+    assert list(evaluate_images([], model, ['red', 'green', 'blue'], 0.5, batch_size=2)) == []
+
+
+def test_evaluate_project(tmp_path):
+    import json
+    import tensorflow as tf
+    import deepdanbooru.__main__
+    project_path = tmp_path / 'project'
+    project_path.mkdir()
+    with open(project_path / 'project.json', 'w') as f:
+        json.dump({'model': 'test'}, f)
+    with open(project_path / 'tags.txt', 'w') as f:
+        f.write('red\ngreen\nblue\n')
+    inputs = tf.keras.Input(shape=(32, 32, 3))
+    outputs = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+    tf.keras.Model(inputs=inputs, outputs=outputs).save((project_path / 'model-test.h5').as_posix())
+    (tmp_path / 'images').mkdir()
+    for i in range(3):
+        Image.new('RGB', (40, 30), color=(255, 0, 0)).save(tmp_path / 'images' / f'test{i}.png')
+
+    result = CliRunner().invoke(deepdanbooru.__main__.main, [
+        'evaluate-project', project_path.as_posix(), (tmp_path / 'images').as_posix(), '--batch-size', '2'])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.count('Tags of ') == 3
+    assert result.output.count('(1.000) red') == 3
+    assert 'green' not in result.output
+
+
+def _transform_and_pad_image_skimage(image, target_width, target_height, scale=None, rotation=None, shift=None):
+    import skimage.transform
+    image_width = image.shape[1]
+    image_height = image.shape[0]
+    t = skimage.transform.AffineTransform(
+        translation=(-image_width * 0.5, -image_height * 0.5))
+    if scale:
+        t += skimage.transform.AffineTransform(scale=(scale, scale))
+    if rotation:
+        t += skimage.transform.AffineTransform(rotation=(rotation / 180.0) * numpy.pi)
+    t += skimage.transform.AffineTransform(
+        translation=(target_width * 0.5, target_height * 0.5))
+    if shift:
+        t += skimage.transform.AffineTransform(
+            translation=(target_width * shift[0], target_height * shift[1]))
+    return skimage.transform.warp(
+        image, t.inverse, output_shape=(target_height, target_width), order=1, mode='edge')
+
+
+@pytest.mark.parametrize('scale, rotation, shift', [
+    (None, None, None),
+    (0.9, None, None),
+    (None, 135.0, None),
+    (None, None, (0.1, -0.05)),
+    (1.1, 300.0, (-0.1, 0.1)),
+])
+def test_transform_and_pad_image(scale, rotation, shift):
+    from deepdanbooru.image import transform_and_pad_image, transform_and_pad_images
+    image = numpy.random.RandomState(0).rand(37, 50, 3) * 255.0
+    expected = _transform_and_pad_image_skimage(image, 41, 33, scale, rotation, shift)
+
+    res = transform_and_pad_image(image, 41, 33, scale=scale, rotation=rotation, shift=shift)
+    assert res.shape == (33, 41, 3)
+    numpy.testing.assert_allclose(res, expected, atol=0.01)
+
+    res_batch = transform_and_pad_images(
+        numpy.stack([image, image]), 41, 33,
+        scales=[scale or 1.0] * 2, rotations=[rotation or 0.0] * 2, shifts=[shift or (0.0, 0.0)] * 2)
+    numpy.testing.assert_allclose(res_batch.numpy()[1], expected, atol=0.01)
+
+
+def test_dataset_wrapper_augmentation_seed():
+    import deepdanbooru as dd
+    image = numpy.random.RandomState(0).rand(40, 40, 3).astype(numpy.float32) * 255.0
+
+    def transform(seed, key):
+        dataset_wrapper = dd.data.DatasetWrapper(
+            None, [], 32, 32, scale_range=[0.9, 1.1], rotation_range=[0.0, 360.0], shift_range=[-0.1, 0.1], seed=seed)
+        return dataset_wrapper.map_transform_image_and_label(
+            image, [0], dataset_wrapper.get_sample_seed(key))[0].numpy()
+
+    # Same epoch seed and path give same transform, other epoch or path gives other one.
+    numpy.testing.assert_array_equal(transform(0, 'a.jpg'), transform(0, 'a.jpg'))
+    assert not numpy.allclose(transform(0, 'a.jpg'), transform(1, 'a.jpg'))
+    assert not numpy.allclose(transform(0, 'a.jpg'), transform(0, 'b.jpg'))
+
+
+def test_dataset_wrapper_skip_count(tmp_path):
+    import deepdanbooru as dd
+    (tmp_path / '0000').mkdir()
+    random_ = numpy.random.RandomState(0)
+    for post_id in range(7):
+        Image.fromarray((random_.rand(20, 20, 3) * 255).astype(numpy.uint8)).save(tmp_path / '0000' / f'{post_id}.png')
+    image_records = dd.data.ImageRecords(
+        tmp_path.as_posix(), ['0000'], ['.png'], numpy.arange(7, dtype=numpy.int64), numpy.zeros(7, dtype=numpy.int32),
+        numpy.zeros(7, dtype=numpy.int32), numpy.arange(8, dtype=numpy.int64), numpy.arange(7, dtype=numpy.int32))
+    dataset_wrapper = dd.data.DatasetWrapper(
+        image_records, ['tag'] * 7, 16, 16, scale_range=[0.9, 1.1], rotation_range=[0.0, 360.0],
+        shift_range=[-0.1, 0.1], seed=3)
+
+    def read(skip_count=0, shard_count=1, shard_index=0):
+        return list(dataset_wrapper.get_dataset(
+            1, skip_count=skip_count, shard_count=shard_count, shard_index=shard_index).as_numpy_iterator())
+
+    items = read()
+    # Resumed workers read their shards of the samples after offset, with the same augmentation.
+    for shard_index in range(2):
+        resumed_items = read(3, 2, shard_index)
+        expected_items = items[3:][shard_index::2]
+        assert len(resumed_items) == len(expected_items)
+        for (images, tag_indices), (expected_images, expected_tag_indices) in zip(resumed_items, expected_items):
+            numpy.testing.assert_array_equal(tag_indices, expected_tag_indices)
+            numpy.testing.assert_allclose(images, expected_images, atol=1e-6)
+
+
+def test_train_function_mirrored_strategy():
+    # Logical devices must be configured before TensorFlow runtime is initialized, so run in new process.
+    import subprocess
+    import sys
+    import textwrap
+    script = textwrap.dedent('''
+        import tensorflow as tf
+        import deepdanbooru as dd
+        strategy = dd.train.create_distribution_strategy('mirrored', cpu_device_count=2)
+        assert strategy.num_replicas_in_sync == 2
+        with strategy.scope():
+            inputs = tf.keras.Input(shape=(8, 8, 3))
+            x = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+            outputs = tf.keras.layers.Dense(4, activation='sigmoid')(x)
+            model = tf.keras.Model(inputs=inputs, outputs=outputs)
+            optimizer = tf.optimizers.Adam()
+            metric = tf.keras.metrics.Precision()
+        used_minibatch = tf.Variable(0, dtype=tf.int64)
+        used_sample = tf.Variable(0, dtype=tf.int64)
+        train_function = dd.train.create_train_function(
+            model, optimizer, dd.model.losses.binary_crossentropy(), [metric],
+            minibatch_counter=used_minibatch, sample_counters=[used_sample], strategy=strategy, label_count=4)
+
+        def dataset_function(input_context):
+            batch_size = input_context.get_per_replica_batch_size(8)
+            x = tf.random.uniform((20, 8, 8, 3))
+            y = tf.tile([[0, 2, -1]], (20, 1))
+            return tf.data.Dataset.from_tensor_slices((x, y)).shard(
+                input_context.num_input_pipelines, input_context.input_pipeline_id).batch(batch_size)
+
+        iterator = iter(strategy.distribute_datasets_from_function(dataset_function))
+        while int(train_function(iterator, tf.constant(2, dtype=tf.int64))[1]) > 0:
+            pass
+        print(int(used_minibatch), int(used_sample))
+    ''')
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-2:] == ['3', '20']
+
+
+def test_tag_indices_to_labels():
+    import deepdanbooru as dd
+    tag_indices = numpy.array([[0, 3, -1], [1, 1, 2], [-1, -1, -1]], dtype=numpy.int32)
+
+    labels = dd.data.tag_indices_to_labels(tag_indices, 5).numpy()
+
+    numpy.testing.assert_array_equal(labels, [[1, 0, 0, 1, 0], [0, 1, 1, 0, 0], [0, 0, 0, 0, 0]])
+    assert dd.data.tag_indices_to_labels(numpy.zeros((0, 0), dtype=numpy.int32), 5).shape == (0, 5)
+
+
+def test_tag_encoder():
+    import deepdanbooru as dd
+    tag_encoder = dd.data.TagEncoder(['a', 'b', 'c', 'rating:safe', 'rating:explicit'])
+    tag_string = 'c unknown a rating:safe'
+
+    assert tag_encoder.encode_indices(tag_string).tolist() == [2, 0, 3]
+    assert tag_encoder.encode_indices('unknown').tolist() == []
+    numpy.testing.assert_array_equal(tag_encoder.encode(tag_string), [1, 0, 1, 1, 0])
+    assert tag_encoder.encode_indices_tf(tag_string).numpy().tolist() == [2, 0, 3]
+    numpy.testing.assert_array_equal(tag_encoder.encode_tf(tag_string).numpy(), [1, 0, 1, 1, 0])
+
+
+def test_convert_model_precision():
+    import tensorflow as tf
+    import deepdanbooru as dd
+    inputs = tf.keras.Input(shape=(8, 8, 3))
+    x = tf.keras.layers.Conv2D(4, (3, 3))(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Activation('sigmoid', dtype='float32')(x)
+    model = tf.keras.Model(inputs=inputs, outputs=outputs)
+    converted_model = dd.model.convert_model_precision(model, 'bfloat16')
+    images = numpy.random.rand(2, 8, 8, 3).astype(numpy.float32)
+
+    y = converted_model(images)
+
+    assert y.dtype == tf.float32
+    numpy.testing.assert_allclose(y.numpy(), model(images).numpy(), atol=0.02)
+
+
+def test_save_mixed_precision_model_as_float32(tmp_path):
+    import tensorflow as tf
+    import deepdanbooru as dd
+    tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    try:
+        inputs = tf.keras.Input(shape=(8, 8, 3))
+        x = tf.keras.layers.Conv2D(4, (3, 3))(inputs)
+        x = tf.keras.layers.GlobalAveragePooling2D()(x)
+        outputs = tf.keras.layers.Activation('sigmoid', dtype='float32')(x)
+        model = tf.keras.Model(inputs=inputs, outputs=outputs)
+        # Model saved by older version keeps mixed precision policy.
+        model.save((tmp_path / 'model-mixed.h5').as_posix(), include_optimizer=False)
+        dd.model.convert_model_precision(model, 'float32').save(
+            (tmp_path / 'model.h5').as_posix(), include_optimizer=False)
+        model_exporter = dd.train.ModelExporter(model)
+        model_exporter.export((tmp_path / 'model.h5.e1').as_posix())
+        model_exporter.close()
+    finally:
+        tf.keras.mixed_precision.set_global_policy('float32')
+
+    for model_file_name in ['model.h5', 'model.h5.e1']:
+        loaded_model = tf.keras.models.load_model((tmp_path / model_file_name).as_posix(), compile=False)
+        assert {layer.dtype_policy.name for layer in loaded_model.layers[1:]} == {'float32'}
+    # evaluate converts model to float32 by default.
+    loaded_model = tf.keras.models.load_model((tmp_path / 'model-mixed.h5').as_posix(), compile=False)
+    assert loaded_model.layers[1].dtype_policy.name == 'mixed_bfloat16'
+    converted_model = dd.model.convert_model_precision(loaded_model, 'float32')
+    assert {layer.dtype_policy.name for layer in converted_model.layers[1:]} == {'float32'}
+    images = numpy.random.rand(2, 8, 8, 3).astype(numpy.float32)
+    numpy.testing.assert_allclose(converted_model(images).numpy(), loaded_model(images).numpy(), atol=0.02)
+
+
+@pytest.mark.parametrize('jobs, bulk_load', [(1, False), (2, True)])
+def test_make_training_database_metadata_glob(tmp_path, jobs, bulk_load):
+    import json
+    import sqlite3
+    from deepdanbooru.commands import make_training_database_metadata_glob
+    for shard in range(2):
+        with open(tmp_path / f'meta{shard}.json', 'w') as f:
+            for post_id in range(shard * 5 + 1, shard * 5 + 6):
+                f.write(json.dumps({
+                    'id': str(post_id), 'md5': f'md5{post_id}', 'file_ext': 'jpg', 'rating': 's', 'score': '1',
+                    'is_deleted': post_id == 3, 'tags': [{'name': 'tag_a'}, {'name': 'tag_b'}]}) + '\n')
+    output_path = (tmp_path / 'db.sqlite').as_posix()
+    make_training_database_metadata_glob((tmp_path / 'meta*.json').as_posix(), output_path, end_id=9, chunk_size=2, jobs=jobs,
+                                         bulk_load=bulk_load)
+    with sqlite3.connect(output_path) as connection:
+        rows = connection.execute('SELECT id, tag_string FROM posts ORDER BY id').fetchall()
+        index_names = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'posts'")]
+        journal_mode = connection.execute('PRAGMA journal_mode').fetchone()[0]
+    assert [row[0] for row in rows] == [1, 2, 4, 5, 6, 7, 8, 9]
+    assert rows[0][1] == 'tag_a tag_b rating:safe'
+    assert index_names == ['posts_file_ext_tag_count_general']
+    assert journal_mode == 'delete'
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_make_training_database_metadata_duplicated_id(tmp_path, jobs):
+    import json
+    import sqlite3
+    from deepdanbooru.commands import make_training_database_metadata_glob
+    with open(tmp_path / 'meta0.json', 'w') as f:
+        for post_id, tag in [(1, 'a'), (2, 'b'), (3, 'c'), (2, 'x')]:
+            f.write(json.dumps({
+                'id': str(post_id), 'md5': f'md5{post_id}', 'file_ext': 'jpg', 'rating': 's', 'score': '1',
+                'is_deleted': False, 'tags': [{'name': tag}]}) + '\n')
+    output_path = (tmp_path / 'db.sqlite').as_posix()
+
+    make_training_database_metadata_glob((tmp_path / 'meta*.json').as_posix(), output_path, chunk_size=10, jobs=jobs)
+
+    with sqlite3.connect(output_path) as connection:
+        rows = connection.execute('SELECT id, tag_string FROM posts ORDER BY id').fetchall()
+    # The last row of duplicated id is used.
+    assert rows == [(1, 'a rating:safe'), (2, 'x rating:safe'), (3, 'c rating:safe')]
+
+
+def _kill_parse_metadata_shard(*args):
+    import os
+    os._exit(1)
+
+
+def test_make_training_database_metadata_worker_killed(tmp_path, monkeypatch):
+    import json
+    make_training_database = importlib.import_module('deepdanbooru.commands.make_training_database')
+    for shard in range(2):
+        with open(tmp_path / f'meta{shard}.json', 'w') as f:
+            f.write(json.dumps({
+                'id': str(shard + 1), 'md5': 'md5', 'file_ext': 'jpg', 'rating': 's', 'score': '1',
+                'is_deleted': False, 'tags': [{'name': 'a'}]}) + '\n')
+    # Worker which dies without sending error must not block the writer.
+    monkeypatch.setattr(make_training_database, 'parse_metadata_shard', _kill_parse_metadata_shard)
+
+    with pytest.raises(Exception, match='Parsing metadata is failed'):
+        make_training_database.make_training_database_metadata_glob(
+            (tmp_path / 'meta*.json').as_posix(), (tmp_path / 'db.sqlite').as_posix(), jobs=2)
+
+
+def test_make_training_database_metadata_incremental(tmp_path):
+    import json
+    import sqlite3
+    from deepdanbooru.commands import make_training_database_metadata_glob
+
+    def write_shard(shard, posts):
+        with open(tmp_path / f'meta{shard}.json', 'w') as f:
+            for post_id, tag, is_deleted in posts:
+                f.write(json.dumps({
+                    'id': str(post_id), 'md5': f'md5{post_id}', 'file_ext': 'jpg', 'rating': 'e', 'score': '1',
+                    'is_deleted': is_deleted, 'tags': [{'name': tag}]}) + '\n')
+
+    def import_metadata():
+        make_training_database_metadata_glob(
+            (tmp_path / 'meta*.json').as_posix(), output_path, chunk_size=2, overwrite=False, incremental=True)
+        with sqlite3.connect(output_path) as connection:
+            return connection.execute('SELECT id, tag_string FROM posts ORDER BY id').fetchall()
+
+    output_path = (tmp_path / 'db.sqlite').as_posix()
+    write_shard(0, [(1, 'a', False), (2, 'b', False), (3, 'c', False)])
+    write_shard(1, [(4, 'd', False)])
+    assert len(import_metadata()) == 4
+    write_shard(0, [(1, 'a', False), (2, 'x', False), (3, 'c', True)])
+    write_shard(2, [(5, 'e', False)])
+    assert import_metadata() == [
+        (1, 'a rating:explicit'), (2, 'x rating:explicit'), (4, 'd rating:explicit'), (5, 'e rating:explicit')]
+
+
+def test_make_training_database_metadata_incremental_image_added(tmp_path):
+    import json
+    import os
+    import sqlite3
+    from deepdanbooru.commands import make_training_database_metadata_glob
+
+    with open(tmp_path / 'meta0.json', 'w') as f:
+        for post_id in [1, 2, 3]:
+            f.write(json.dumps({
+                'id': str(post_id), 'md5': f'md5{post_id}', 'file_ext': 'jpg', 'rating': 's', 'score': '1',
+                'is_deleted': False, 'tags': [{'name': 'a'}]}) + '\n')
+    image_directory = tmp_path / 'images' / '0000'
+    image_directory.mkdir(parents=True)
+    (image_directory / '1.jpg').touch()
+
+    def import_metadata():
+        make_training_database_metadata_glob(
+            (tmp_path / 'meta*.json').as_posix(), output_path, overwrite=False, incremental=True,
+            image_folder_path=(tmp_path / 'images').as_posix())
+        with sqlite3.connect(output_path) as connection:
+            return [id for id, in connection.execute('SELECT id FROM posts ORDER BY id')]
+
+    output_path = (tmp_path / 'db.sqlite').as_posix()
+    assert import_metadata() == [1]
+    # Image is downloaded after the metadata shard is imported.
+    (image_directory / '3.jpg').touch()
+    os.utime(image_directory, ns=(0, 0))
+    assert import_metadata() == [1, 3]
+    assert import_metadata() == [1, 3]
+
+
+def test_make_training_database_metadata_image_path_glob(tmp_path):
+    import json
+    import sqlite3
+    from deepdanbooru.commands import make_training_database_metadata_glob
+    from deepdanbooru.commands.make_training_database import get_image_folder_path_from_glob
+
+    assert get_image_folder_path_from_glob('/images/*/*') == '/images'
+    assert get_image_folder_path_from_glob('/images/*/*.png') is None
+    assert get_image_folder_path_from_glob('/images*/*/*') is None
+
+    with open(tmp_path / 'meta0.json', 'w') as f:
+        for post_id in [1, 2]:
+            f.write(json.dumps({
+                'id': str(post_id), 'md5': f'md5{post_id}', 'file_ext': 'jpg', 'rating': 's', 'score': '1',
+                'is_deleted': False, 'tags': [{'name': 'a'}]}) + '\n')
+    (tmp_path / 'images' / '0000').mkdir(parents=True)
+    (tmp_path / 'images' / '0000' / '2.jpg').touch()
+    output_path = (tmp_path / 'db.sqlite').as_posix()
+
+    make_training_database_metadata_glob(
+        (tmp_path / 'meta*.json').as_posix(), output_path, image_path_glob=(tmp_path / 'images' / '*' / '*').as_posix())
+
+    # Image files are found by image manifest, which is saved to the output.
+    with sqlite3.connect(output_path) as connection:
+        assert connection.execute('SELECT id FROM posts').fetchall() == [(2,)]
+        assert connection.execute('SELECT id FROM image_manifest').fetchall() == [(2,)]
+
+
+@pytest.mark.parametrize('path_layout', ['id', 'md5'])
+def test_load_image_records_compact(tmp_path, path_layout):
+    import sqlite3
+    import deepdanbooru as dd
+    database_path = (tmp_path / 'db.sqlite').as_posix()
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(
+            'CREATE TABLE posts (id INTEGER PRIMARY KEY, md5 TEXT, file_ext TEXT, tag_string TEXT, tag_count_general INTEGER)')
+        connection.executemany('INSERT INTO posts VALUES (?, ?, ?, ?, ?)', [
+            (1, 'ab' + '0' * 30, 'png', 'a b', 2),
+            (2, 'cd' + '0' * 30, 'jpg', 'b unknown c', 3),
+            (3, 'ef' + '0' * 30, 'gif', 'a', 1),
+            (4, 'ab' + '1' * 30, 'jpg', 'c', 1),
+            (5, 'cd' + '1' * 30, 'png', 'c', 1)])
+    for post_id, directory, extension in [(1, '0001', '.png'), (2, '0002', '.jpg'), (4, '0001', '.jpg')]:
+        (tmp_path / 'images' / directory).mkdir(parents=True, exist_ok=True)
+        (tmp_path / 'images' / directory / f'{post_id}{extension}').touch()
+
+    records = dd.data.load_image_records_compact(database_path, 1, ['a', 'b', 'c'], path_layout=path_layout)
+
+    image_folder_path = (tmp_path / 'images').as_posix()
+    if path_layout == 'id':
+        expected_paths = [f'{image_folder_path}/0001/1.png', f'{image_folder_path}/0002/2.jpg',
+                          f'{image_folder_path}/0001/4.jpg']
+    else:
+        expected_paths = [f'{image_folder_path}/ab/{"ab" + "0" * 30}.png', f'{image_folder_path}/cd/{"cd" + "0" * 30}.jpg',
+                          f'{image_folder_path}/ab/{"ab" + "1" * 30}.jpg', f'{image_folder_path}/cd/{"cd" + "1" * 30}.png']
+    assert [records.get_image_path(i) for i in range(len(records))] == expected_paths
+    assert records.get_tag_indices(1).tolist() == [1, 2]
+    dataset = list(records.get_dataset(numpy.array([1, 0])).as_numpy_iterator())
+    assert [image_path.decode() for image_path, _ in dataset] == expected_paths[1::-1]
+    assert [tag_indices.tolist() for _, tag_indices in dataset] == [[1, 2], [0, 1]]
+
+
+@pytest.mark.parametrize('image_format', ['raw', 'png'])
+def test_build_cache(tmp_path, image_format):
+    import json
+    import os
+    import sqlite3
+    import tensorflow as tf
+    import deepdanbooru as dd
+    tag_strings = {1: 'a b', 2: 'b', 3: 'c a', 4: 'a', 5: 'b unknown c'}
+    expected_tag_indices = {1: [0, 1], 2: [1], 3: [2, 0], 4: [0], 5: [1, 2]}
+    database_path = (tmp_path / 'db.sqlite').as_posix()
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(
+            'CREATE TABLE posts (id INTEGER PRIMARY KEY, md5 TEXT, file_ext TEXT, tag_string TEXT, tag_count_general INTEGER)')
+        connection.executemany('INSERT INTO posts VALUES (?, ?, ?, ?, ?)', [
+            (post_id, f'md5{post_id}', 'png', tag_string, 2) for post_id, tag_string in tag_strings.items()])
+    (tmp_path / 'images' / '0000').mkdir(parents=True)
+    for post_id in tag_strings:
+        Image.new('RGB', (32, 32), color=(post_id * 40, 0, 0)).save(tmp_path / 'images' / '0000' / f'{post_id}.png')
+    project_path = tmp_path / 'project'
+    dd.commands.create_project(project_path.as_posix())
+    with open(project_path / 'project.json') as f:
+        project_context = json.load(f)
+    project_context.update({
+        'image_width': 32, 'image_height': 32, 'database_path': database_path, 'minimum_tag_count': 1,
+        'scale_range': [1.0, 1.0]})
+    with open(project_path / 'project.json', 'w') as f:
+        json.dump(project_context, f)
+    with open(project_path / 'tags.txt', 'w') as f:
+        f.write('a\nb\nc\n')
+
+    dd.commands.build_cache(project_path.as_posix(), 2, image_format, False)
+
+    cache_path = (project_path / 'cache').as_posix()
+    cache_context = dd.data.load_cache_context(cache_path)
+    assert cache_context['record_count'] == 5
+    shard_paths = dd.data.get_cache_shard_paths(cache_path, cache_context)
+    assert len(shard_paths) == 3
+    post_ids = []
+    for serialized in tf.data.TFRecordDataset(shard_paths):
+        features = tf.io.parse_single_example(serialized, dd.data.CACHE_RECORD_FEATURES)
+        post_id = int(os.path.splitext(os.path.basename(features['key'].numpy().decode()))[0])
+        post_ids.append(post_id)
+        assert features['image_format'].numpy() == image_format.encode()
+        assert (int(features['height']), int(features['width'])) == (32, 32)
+        if image_format == 'raw':
+            assert len(features['image'].numpy()) == 32 * 32 * 3
+        else:
+            assert features['image'].numpy().startswith(b'\x89PNG')
+        image = dd.data.decode_cache_image(features).numpy()
+        assert image.shape == (32, 32, 3)
+        assert image[16, 16].tolist() == [post_id * 40, 0, 0]
+        assert tf.sparse.to_dense(features['tag_indices']).numpy().tolist() == expected_tag_indices[post_id]
+    assert sorted(post_ids) == [1, 2, 3, 4, 5]
+
+    dataset_wrapper = dd.data.DatasetWrapper(
+        shard_paths, ['a', 'b', 'c'], 32, 32, scale_range=None, rotation_range=None, shift_range=None, seed=0)
+
+    def read(skip_count):
+        return [(int(round(images[0, 16, 16, 0] * 255.0 / 40.0)), tag_indices[0].tolist())
+                for images, tag_indices in dataset_wrapper.get_cached_dataset(
+                    1, skip_count=skip_count).as_numpy_iterator()]
+
+    records = read(0)
+    assert sorted(records) == sorted(expected_tag_indices.items())
+    assert read(2) == records[2:]
+
+
+def test_validate_image_records(tmp_path):
+    import os
+    import sqlite3
+    import deepdanbooru as dd
+    database_path = (tmp_path / 'db.sqlite').as_posix()
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(
+            'CREATE TABLE posts (id INTEGER PRIMARY KEY, md5 TEXT, file_ext TEXT, tag_string TEXT, tag_count_general INTEGER)')
+        connection.executemany('INSERT INTO posts VALUES (?, ?, ?, ?, ?)', [
+            (1, 'ab' + '0' * 30, 'png', 'a', 1),
+            (2, 'cd' + '0' * 30, 'jpg', 'b', 1),
+            (3, 'ef' + '0' * 30, 'png', 'c', 1)])
+    image_paths = {}
+    for post_id, md5, extension in [(1, 'ab' + '0' * 30, 'png'), (2, 'cd' + '0' * 30, 'jpg'), (3, 'ef' + '0' * 30, 'png')]:
+        image_paths[post_id] = tmp_path / 'images' / md5[:2] / f'{md5}.{extension}'
+        image_paths[post_id].parent.mkdir(parents=True)
+    Image.new('RGB', (32, 32), color='red').save(image_paths[1], format='PNG')
+    Image.new('RGB', (32, 32), color='red').save(image_paths[2], format='JPEG')
+    image_paths[2].write_bytes(image_paths[2].read_bytes()[:100])
+    # GIF with wrong extension is decoded by content.
+    Image.new('RGB', (32, 32), color='red').save(image_paths[3], format='GIF')
+
+    records = dd.data.load_image_records_compact(database_path, 1, ['a', 'b', 'c'], path_layout='md5')
+    assert dd.data.validate_image_records(database_path, records, jobs=2) == (3, 1, 0, 1)
+    assert dd.data.validate_image_records(database_path, records, jobs=2) == (0, 0, 3, 1)
+    assert dd.data.load_quarantined_ids(database_path).tolist() == [2]
+    records = dd.data.load_image_records_compact(database_path, 1, ['a', 'b', 'c'], path_layout='md5')
+    assert records.ids.tolist() == [1, 3]
+    assert [records.get_tag_indices(i).tolist() for i in range(len(records))] == [[0], [2]]
+
+    # Fixed image is validated again.
+    Image.new('RGB', (32, 32), color='red').save(image_paths[2], format='JPEG')
+    os.utime(image_paths[2], ns=(0, 0))
+    records = dd.data.load_image_records_compact(
+        database_path, 1, ['a', 'b', 'c'], path_layout='md5', exclude_quarantined=False)
+    assert dd.data.validate_image_records(database_path, records, jobs=2) == (1, 0, 2, 0)
+    assert len(dd.data.load_image_records_compact(database_path, 1, ['a', 'b', 'c'], path_layout='md5')) == 3
+
+
+def test_update_image_manifest(tmp_path):
+    import deepdanbooru as dd
+    database_path = (tmp_path / 'db.sqlite').as_posix()
+    image_folder_path = tmp_path / 'images'
+    for directory, file_name in [('0001', '1.png'), ('0001', '11.jpg'), ('0002', '2.jpg'), ('0002', 'readme.txt')]:
+        (image_folder_path / directory).mkdir(parents=True, exist_ok=True)
+        (image_folder_path / directory / file_name).write_bytes(b'0')
+
+    dd.data.update_image_manifest(database_path, image_folder_path.as_posix())
+    assert sorted(dd.data.load_image_paths(database_path, 'images')) == ['1', '11', '2']
+
+    (image_folder_path / '0001' / '11.jpg').unlink()
+    (image_folder_path / '0003').mkdir()
+    (image_folder_path / '0003' / '3.png').write_bytes(b'0')
+    dd.data.update_image_manifest(database_path, image_folder_path.as_posix())
+    directories, extensions, ids, directory_codes, extension_codes = dd.data.load_image_manifest(database_path)
+    assert ids.tolist() == [1, 2, 3]
+    assert [directories[code] + '/' + str(id) + extensions[extension_code]
+            for id, code, extension_code in zip(ids, directory_codes, extension_codes)] == [
+        '0001/1.png', '0002/2.jpg', '0003/3.png']
+
+
+def test_download_tags(tmp_path):
+    import collections
+    import http.server
+    import json
+    import threading
+    import urllib.parse
+    import deepdanbooru as dd
+    tag_counts = {'0': 30000, '4': 5000}
+    requested_pages = collections.Counter()
+    failing_pages = {('0', 5): 1, ('0', 8): 1}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            category, page, limit = query['search[category]'], int(query['page']), int(query['limit'])
+            requested_pages[(category, page)] += 1
+
+            if failing_pages.get((category, page), 0) > 0:
+                # Page 5 is recovered by retry and page 8 interrupts download.
+                failing_pages[(category, page)] -= 1
+                self.send_response(503 if page == 5 else 404)
+                self.end_headers()
+                return
+
+            tag_count = tag_counts[category]
+            body = json.dumps([{'name': f'tag_{category}_{index}', 'post_count': tag_count - index}
+                               for index in range((page - 1) * limit, min(page * limit, tag_count))]).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    request_url = f'http://127.0.0.1:{server.server_port}/tags.json'
+
+    try:
+        with pytest.raises(Exception):
+            dd.commands.download_tags(tmp_path.as_posix(), 20000, 500, False, jobs=4, request_url=request_url)
+        assert not (tmp_path / 'tags.txt').exists()
+        assert requested_pages[('0', 5)] == 2
+
+        failing_pages.clear()
+        requested_pages.clear()
+        dd.commands.download_tags(tmp_path.as_posix(), 20000, 500, False, jobs=4, request_url=request_url)
+    finally:
+        server.shutdown()
+
+    # Pages before the failed page are resumed from checkpoint.
+    assert not any(requested_pages[('0', page)] for page in range(1, 8))
+    assert all(requested_pages[('0', page)] == 1 for page in range(8, 21))
+    assert not list(tmp_path.glob('*.download.jsonl'))
+    tags = (tmp_path / 'tags.txt').read_text().splitlines()
+    assert len(tags) == 20000 + 4501 + 3
+    assert 'tag_0_19999' in tags and 'tag_0_20000' not in tags and 'tag_4_4500' in tags
+
+
+def test_cloud_storage_sync_dir(tmp_path, monkeypatch):
+    moto = pytest.importorskip('moto')
+    import os
+    import deepdanbooru as dd
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    local_dir = tmp_path / 'checkpoints'
+    (local_dir / 'sub').mkdir(parents=True)
+    (local_dir / 'small').write_bytes(b'0' * 100)
+    (local_dir / 'sub' / 'large').write_bytes(os.urandom(11 * 1024 * 1024))
+
+    with moto.mock_aws():
+        cloud_storage = dd.io.CloudStorage(
+            region_name='us-east-1', s3_bucket='bucket', s3_key_prefix='project',
+            multipart_chunksize=5 * 1024 * 1024)
+        cloud_storage.s3_client.create_bucket(Bucket='bucket')
+        assert cloud_storage.sync_dir(local_dir.as_posix(), '') == (2, 0)
+        assert cloud_storage.sync_dir_async(local_dir.as_posix(), '').result() == (0, 0)
+
+        objects = cloud_storage.list_objects('bucket', 'project/')
+        assert sorted(objects) == ['project/checkpoints/small', 'project/checkpoints/sub/large']
+        assert objects['project/checkpoints/sub/large'][1].endswith('-3')
+
+        # Unchanged files are found by ETag without the local manifest.
+        (local_dir / 'small').write_bytes(b'1' * 100)
+        cloud_storage = dd.io.CloudStorage(
+            region_name='us-east-1', s3_bucket='bucket', s3_key_prefix='project',
+            multipart_chunksize=5 * 1024 * 1024)
+        future = cloud_storage.sync_dir_async(local_dir.as_posix(), '')
+        cloud_storage.wait()
+        assert future.result() == (1, 0)
+        assert cloud_storage.sync_dir(local_dir.as_posix(), '') == (0, 0)
+        assert cloud_storage.s3_client.get_object(
+            Bucket='bucket', Key='project/checkpoints/small')['Body'].read() == b'1' * 100
+
+
+def test_model_exporter(tmp_path):
+    import os
+    import tensorflow as tf
+    import deepdanbooru as dd
+    inputs = tf.keras.Input(shape=(4,))
+    model = tf.keras.Model(inputs=inputs, outputs=tf.keras.layers.Dense(2)(inputs))
+    model.compile(optimizer='adam', loss=dd.model.losses.binary_crossentropy())
+    x = numpy.ones((1, 4), dtype=numpy.float32)
+    expected = model.predict(x)
+    export_path = (tmp_path / 'model.h5.e1').as_posix()
+    exported_paths = []
+
+    model_exporter = dd.train.ModelExporter(model)
+    model_exporter.export(export_path, on_exported=exported_paths.append)
+    # Weights are copied on export, so training can continue.
+    model.set_weights([weights + 1 for weights in model.get_weights()])
+    model_exporter.close()
+
+    assert exported_paths == [export_path]
+    assert not (tmp_path / 'model.h5.e1.tmp.h5').exists()
+    os.replace(export_path, tmp_path / 'model.h5')
+    numpy.testing.assert_allclose(
+        tf.keras.models.load_model(tmp_path / 'model.h5', compile=False).predict(x), expected)
+
+
+def test_training_metrics(tmp_path):
+    import json
+    import tensorflow as tf
+    import deepdanbooru as dd
+    metrics_path = tmp_path / 'metrics.jsonl'
+    training_metrics = dd.train.TrainingMetrics(
+        duration_names=['data_wait', 'compute'], summary_writer=tf.summary.create_noop_writer(),
+        metrics_path=metrics_path.as_posix())
+
+    training_metrics.add_duration('data_wait', 1.0)
+    training_metrics.add_duration('data_wait', 0.5)
+    with training_metrics.measure('checkpoint'):
+        pass
+    training_metrics.add_gauge('input_queue_depth', 2)
+    training_metrics.add_gauge('input_queue_depth', 4)
+    metrics = training_metrics.write(10, loss=0.25)
+    training_metrics.write(20, loss=0.5)
+
+    assert metrics['seconds_data_wait'] == 1.5
+    assert metrics['seconds_compute'] == 0.0
+    assert metrics['seconds_checkpoint'] >= 0.0
+    assert metrics['input_queue_depth'] == 3.0
+    records = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    assert [record['step'] for record in records] == [10, 20]
+    assert records[0]['loss'] == 0.25 and records[0]['seconds_data_wait'] == 1.5
+    # Durations are reset after write, but gauges without samples are not emitted.
+    assert records[1]['seconds_data_wait'] == 0.0 and 'input_queue_depth' not in records[1]